@@ -0,0 +1,192 @@
+"""Batch-size autotuning for the CLIP vision encoder.
+
+Images/second of the vision encoder rises with the batch size until the
+accelerator is saturated, then flattens or drops, at a size that depends on
+the machine and the model. The first embedding run probes growing batch
+sizes on synthetic pixels, climbing while throughput still improves and
+peak memory stays under a ceiling, and stores the best size and its rate
+next to the Lance DB, keyed by machine and model. Later runs start at the
+tuned size, and `embed.py --dry-run` estimates with the measured rate
+(preferring the end-to-end rate of the last sync, which includes decoding).
+"""
+
+import json
+import os
+import platform
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Callable
+
+import mlx.core as mx
+import numpy as np
+
+from core import DB_PATH, IMAGES_PER_SECOND, MODEL_PATH
+from text_cache import model_identity
+
+# Batch sizes probed, smallest first
+BATCH_SIZES = (8, 16, 32, 64, 128, 256)
+
+# Share of physical memory the encoder may use at peak
+MEMORY_FRACTION = 0.25
+
+# A larger batch is only chosen if it is at least this much faster
+MIN_GAIN = 1.05
+
+# Timed forward passes per probed size (after one warm-up pass)
+PROBE_REPEATS = 2
+
+
+def autotune_path(db_path: str = DB_PATH) -> Path:
+    """Location of the batch-size tuning file next to a Lance DB."""
+    return Path(db_path).with_suffix(".autotune.json")
+
+
+def physical_memory() -> int:
+    """Bytes of physical memory (0 if unknown)."""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return 0
+
+
+def machine_key(model_dir: str = MODEL_PATH) -> str:
+    """Tuning key: host, CPU architecture, memory size and model identity."""
+    memory_gb = round(physical_memory() / 2**30)
+    return f"{platform.node()}/{platform.machine()}/{memory_gb}GB/{model_identity(model_dir)}"
+
+
+@dataclass
+class Tuning:
+    """Tuned batch size of one machine and model.
+
+    Attributes:
+        batch_size: Images per vision-encoder forward pass
+        images_per_second: Encoder throughput at batch_size
+        peak_memory: Peak MLX memory at batch_size in bytes (0 if unknown)
+        rates: Images/second of every probed size
+        sync_images_per_second: End-to-end rate of the last sync (read,
+            decode and encode), if one has run since tuning
+    """
+
+    batch_size: int
+    images_per_second: float
+    peak_memory: int = 0
+    rates: dict[int, float] = field(default_factory=dict)
+    sync_images_per_second: float | None = None
+
+    @property
+    def estimate_rate(self) -> float:
+        """Images/second to estimate sync times with."""
+        return self.sync_images_per_second or self.images_per_second
+
+
+def load_tuning(path: Path | None = None, key: str | None = None) -> Tuning | None:
+    """Stored tuning for this machine and model, if any."""
+    path = path or autotune_path()
+    try:
+        data = json.loads(path.read_text()).get(key or machine_key())
+    except (OSError, ValueError):
+        return None
+    if not data:
+        return None
+    data["rates"] = {int(size): rate for size, rate in data.get("rates", {}).items()}
+    return Tuning(**data)
+
+
+def save_tuning(tuning: Tuning, path: Path | None = None, key: str | None = None):
+    """Store the tuning of this machine and model, keeping other entries."""
+    path = path or autotune_path()
+    try:
+        entries = json.loads(path.read_text())
+    except (OSError, ValueError):
+        entries = {}
+    entries[key or machine_key()] = asdict(tuning)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(entries, indent=2))
+    tmp_path.replace(path)
+
+
+def estimated_rate(path: Path | None = None) -> tuple[float, bool]:
+    """Images/second for sync estimates, and whether it was measured here.
+
+    Falls back to IMAGES_PER_SECOND before the first tuning.
+    """
+    tuning = load_tuning(path)
+    if tuning is None:
+        return IMAGES_PER_SECOND, False
+    return tuning.estimate_rate, True
+
+
+def record_sync_rate(images: int, seconds: float, path: Path | None = None):
+    """Store the end-to-end rate of a sync with the tuning, if there is one."""
+    tuning = load_tuning(path)
+    if tuning is None or images < tuning.batch_size or seconds <= 0:
+        return
+    tuning.sync_images_per_second = round(images / seconds, 1)
+    save_tuning(tuning, path)
+
+
+def measure_batch(model, img_processor, batch_size: int, repeats: int = PROBE_REPEATS) -> tuple[float, int]:
+    """Images/second and peak MLX memory of encoding batches of synthetic pixels."""
+    rng = np.random.default_rng(0)
+    size = img_processor.crop_size
+    pixels = rng.integers(0, 256, (batch_size, size, size, 3), dtype=np.uint8)
+
+    def encode():
+        output = model(pixel_values=img_processor.from_pixels(pixels))
+        mx.eval(output.image_embeds)
+
+    encode()  # Warm-up: compiles kernels and grows the allocator
+    mx.reset_peak_memory()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        encode()
+    elapsed = time.perf_counter() - start
+    return batch_size * repeats / elapsed, mx.get_peak_memory()
+
+
+def probe(measure: Callable[[int], tuple[float, int]], sizes=BATCH_SIZES, memory_limit: int | None = None, log_fn=print) -> Tuning:
+    """Hill-climb batch sizes: stop at the first size that is slower than the
+    best so far or exceeds `memory_limit` bytes at peak.
+
+    Args:
+        measure: Returns (images/second, peak memory bytes) for a batch size
+        sizes: Batch sizes to try, smallest first
+        memory_limit: Peak memory ceiling (None: no ceiling)
+    """
+    best: Tuning | None = None
+    rates: dict[int, float] = {}
+    for size in sizes:
+        rate, peak = measure(size)
+        rates[size] = round(rate, 1)
+        log_fn(f"Batch {size}: {rate:.1f} images/s, peak memory {peak / 2**20:,.0f} MB")
+        if memory_limit and peak > memory_limit:
+            break
+        if best is None or rate > best.images_per_second * MIN_GAIN:
+            best = Tuning(size, round(rate, 1), peak)
+        elif rate < best.images_per_second:
+            break
+    if best is None:
+        # Even the smallest size is over the ceiling; use it anyway
+        best = Tuning(sizes[0], rates[sizes[0]])
+    best.rates = rates
+    return best
+
+
+def tuned_batch_size(model, img_processor, db_path: str = DB_PATH, retune: bool = False, log_fn=print) -> int:
+    """Batch size for this machine and model, probing and storing it on first use.
+
+    Args:
+        retune: Probe again even if a tuning is stored
+    """
+    path = autotune_path(db_path)
+    key = machine_key()
+    tuning = None if retune else load_tuning(path, key)
+    if tuning is None:
+        log_fn("Tuning the embedding batch size for this machine...")
+        memory_limit = int(physical_memory() * MEMORY_FRACTION) or None
+        tuning = probe(lambda size: measure_batch(model, img_processor, size), memory_limit=memory_limit, log_fn=log_fn)
+        save_tuning(tuning, path, key)
+        log_fn(f"Batch size {tuning.batch_size} ({tuning.images_per_second:.1f} images/s)")
+    return tuning.batch_size
@@ -0,0 +1,170 @@
+"""Micro-batching inference worker for concurrent search requests.
+
+Requests are queued and handled by one worker thread. Queries that arrive
+within a short window (up to a maximum batch size) share one text-encoder
+forward pass and one scoring pass, and each caller waits on its own future.
+Keeping this work off the event loop also means `/health` and other
+endpoints stay responsive while searches run.
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+from composite import CompositeQuery, query_text, query_texts, query_vector
+from filters import SearchFilter
+from index import hybrid_search
+from lexical import LexicalIndex
+
+# Queries coalesced into one forward pass at most
+DEFAULT_MAX_BATCH = 16
+
+# How long the worker waits for more queries after the first one arrives
+DEFAULT_MAX_WAIT_MS = 2.0
+
+# Recent request latencies kept for percentiles
+_LATENCY_WINDOW = 1000
+
+
+@dataclass
+class _Request:
+    index: object  # SearchIndex or LanceSearchIndex to search
+    query: str | CompositeQuery
+    limit: int
+    nprobe: int | None
+    filters: SearchFilter | None = None
+    lexical: LexicalIndex | None = None
+    future: Future = field(default_factory=Future)
+    enqueued: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class _Call:
+    fn: Callable
+    args: tuple
+    future: Future = field(default_factory=Future)
+
+    def run(self):
+        try:
+            self.future.set_result(self.fn(*self.args))
+        except Exception as e:
+            self.future.set_exception(e)
+
+
+class SearchBatcher:
+    """Worker thread that answers search requests in micro-batches.
+
+    Args:
+        encode: Embeds a list of query strings into a (Q, 512) array
+        max_batch: Most queries per batch
+        max_wait_ms: Longest a request waits for others to join its batch
+    """
+
+    def __init__(self, encode: Callable[[list[str]], np.ndarray], max_batch: int = DEFAULT_MAX_BATCH, max_wait_ms: float = DEFAULT_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000
+        self.requests = 0
+        self.batches = 0
+        self._latencies: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self._queue: queue.Queue[_Request | _Call] = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="search-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, index, query: str | CompositeQuery, limit: int, nprobe: int | None = None, filters: SearchFilter | None = None, lexical: LexicalIndex | None = None) -> Future:
+        """Queue a search; the future resolves to a list of (path, score) pairs.
+
+        The phrases of a composite query are encoded with the rest of the
+        batch and combined into one query vector.
+
+        With `lexical`, results are fused with path-token matches (see
+        index.hybrid_search); the query is still encoded and scored with
+        the batch.
+        """
+        request = _Request(index, query, limit, nprobe, filters, lexical)
+        self._queue.put(request)
+        return request.future
+
+    def call(self, fn: Callable, *args) -> Future:
+        """Run fn(*args) on the worker thread, between batches.
+
+        Keeps other model work (such as embedding an image) on the same
+        thread as the text encoder.
+        """
+        call = _Call(fn, args)
+        self._queue.put(call)
+        return call.future
+
+    def stats(self) -> dict:
+        """Queue depth, batching and latency metrics for status endpoints."""
+        latencies = np.array(self._latencies) * 1000
+        return {
+            "queue_depth": self._queue.qsize(),
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0.0,
+            "latency_ms_p50": round(float(np.percentile(latencies, 50)), 2) if len(latencies) else None,
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2) if len(latencies) else None,
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if isinstance(item, _Call):
+                item.run()
+                continue
+            batch = [item]
+            call = None
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if isinstance(item, _Call):
+                    call = item
+                    break
+                batch.append(item)
+            self._process(batch)
+            if call is not None:
+                call.run()
+
+    def _process(self, batch: list[_Request]):
+        try:
+            # One forward pass over every phrase in the batch
+            texts = [query_texts(r.query) for r in batch]
+            encoded = self.encode([t for phrases in texts for t in phrases])
+            bounds = np.cumsum([0] + [len(phrases) for phrases in texts])
+            embeddings = np.stack([query_vector(r.query, encoded[bounds[i]:bounds[i + 1]]) for i, r in enumerate(batch)])
+
+            # One scoring pass per distinct (index, nprobe, filters) in the batch;
+            # hybrid searches then fuse their lexical matches into their ranking
+            groups: dict[tuple, list[int]] = {}
+            for i, r in enumerate(batch):
+                groups.setdefault((id(r.index), r.nprobe, r.filters), []).append(i)
+            for rows in groups.values():
+                first = batch[rows[0]]
+                limit = max(batch[i].limit for i in rows)
+                results = first.index.search_batch(embeddings[rows], limit, nprobe=first.nprobe, filters=first.filters)
+                for i, matches in zip(rows, results):
+                    r = batch[i]
+                    if r.lexical is not None:
+                        matches = hybrid_search(r.index, r.lexical, query_text(r.query), embeddings[i], r.limit, r.nprobe, r.filters, vector_results=matches[:r.limit])
+                    r.future.set_result(matches[:r.limit])
+        except Exception as e:
+            for r in batch:
+                if not r.future.done():
+                    r.future.set_exception(e)
+
+        now = time.perf_counter()
+        self.requests += len(batch)
+        self.batches += 1
+        self._latencies.extend(now - r.enqueued for r in batch)
@@ -7,7 +7,7 @@ from pathlib import Path
 import daft
 from daft import col
 
-from core import EmbedImages
+from core import DECODE_WORKERS, EmbedImages, ImageEmbedder, load_model
 
 
 def benchmark(n_images: int):
@@ -28,6 +28,32 @@ def benchmark(n_images: int):
     return elapsed
 
 
+def benchmark_stages(n_images: int, workers: int = DECODE_WORKERS, batch_size: int = 64):
+    """Time decode, preprocess and model stages with serial vs threaded decoding."""
+    image_dir = Path("data/pokemon")
+    image_paths = sorted([str(p) for p in image_dir.glob("*.png")])[:n_images]
+    print(f"Testing stages with {len(image_paths)} image(s), batches of {batch_size}...")
+
+    model, _, img_processor = load_model()
+    ImageEmbedder(model, img_processor, workers=1)(image_paths[:1])  # warm up
+
+    results = {}
+    for n_workers in dict.fromkeys([1, workers]):
+        embedder = ImageEmbedder(model, img_processor, workers=n_workers)
+        start = time.time()
+        for i in range(0, len(image_paths), batch_size):
+            embedder(image_paths[i:i + batch_size])
+        elapsed = time.time() - start
+        results[n_workers] = embedder.stats()
+        timings = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in embedder.timings.items())
+        print(f"  {n_workers} decode worker(s): {elapsed:.2f}s total ({timings})")
+
+    if workers > 1:
+        speedup = results[1]["decode_s"] / results[workers]["decode_s"]
+        print(f"Decode speedup with {workers} workers: {speedup:.1f}x")
+    return results
+
+
 def run_all_benchmarks():
     """Run one benchmark iteration and append to CSV."""
     import csv
@@ -76,7 +102,11 @@ def run_all_benchmarks():
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
+    if len(sys.argv) > 1 and sys.argv[1] == "stages":
+        # python benchmark.py stages [n_images] [workers]
+        n = int(sys.argv[2]) if len(sys.argv) > 2 else 225
+        benchmark_stages(n, int(sys.argv[3]) if len(sys.argv) > 3 else DECODE_WORKERS)
+    elif len(sys.argv) > 1:
         n = int(sys.argv[1])
         benchmark(n)
     else:
@@ -0,0 +1,129 @@
+"""Benchmark search recall and latency of the ANN indexes against exact search."""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH, EMBEDDING_DIM
+from index import SearchIndex, lance_version, load_index
+from ivf import IVFIndex
+from lance_index import LanceSearchIndex, has_vector_index
+from quantize import QuantizedVectors, make_quantizer
+
+
+def make_synthetic(n: int, n_clusters: int = 1000, seed: int = 0) -> SearchIndex:
+    """Clustered random vectors standing in for a real photo library."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, EMBEDDING_DIM)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)]
+    vectors += 1.5 * rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+    return SearchIndex.from_vectors([f"img_{i}" for i in range(n)], vectors)
+
+
+def make_queries(index: SearchIndex, n: int, seed: int = 1) -> np.ndarray:
+    """Queries near stored vectors (perturbed copies of random valid rows)."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(np.flatnonzero(index.valid), n)
+    noise = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+    queries = index.matrix[rows] + 0.1 * noise
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def run(search_fn, queries: np.ndarray) -> tuple[list[set], np.ndarray]:
+    """Run search_fn per query, returning result path sets and latencies (ms)."""
+    results, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        found = search_fn(q)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append({path for path, _ in found})
+    return results, np.array(latencies)
+
+
+def recall(truth: list[set], found: list[set]) -> float:
+    """Mean fraction of exact top-k results that were also returned."""
+    return float(np.mean([len(t & f) / max(len(t), 1) for t, f in zip(truth, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark search recall and latency")
+    parser.add_argument("--synthetic", type=int, metavar="N", help="Use N synthetic vectors instead of the Lance DB")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("-k", type=int, default=10, help="Results per query (recall@k)")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        print(f"Generating {args.synthetic:,} synthetic vectors...")
+        index = make_synthetic(args.synthetic)
+    elif Path(DB_PATH).exists():
+        index = load_index(DB_PATH)
+    else:
+        print("No embeddings found. Run embed.py first or pass --synthetic N.")
+        return
+
+    print(f"Images: {len(index):,}, queries: {args.queries}, k: {args.k}")
+    queries = make_queries(index, args.queries)
+
+    truth, exact_ms = run(lambda q: index.search(q, args.k, method="exact"), queries)
+    print(f"\nExact:  p50 {np.median(exact_ms):.2f}ms  p95 {np.percentile(exact_ms, 95):.2f}ms")
+
+    # Quantized first pass + exact re-ranking (full vectors fetched from the in-memory matrix)
+    print(f"\nQuantized storage (float32 matrix: {index.nbytes / 2**20:.1f} MB)")
+    print(f"{'storage':>8}  {'rerank':>6}  {'memory MB':>9}  {'saving':>7}  {'recall@' + str(args.k):>10}  {'p50 ms':>8}")
+    sample = index.matrix[np.flatnonzero(index.valid)[:50_000]]
+    for storage in ["int8", "pq", "binary"]:
+        quantizer = make_quantizer(storage, sample)
+        quantized = QuantizedVectors(quantizer, quantizer.encode(index.matrix), lambda rows: index.matrix[rows])
+        qindex = SearchIndex(index.paths, None, index.valid, quantized=quantized)
+        for rerank in [args.k, 100, 256, 500, 1000]:
+            qindex.rerank = rerank
+            found, ms = run(lambda q: qindex.search(q, args.k), queries)
+            print(
+                f"{storage:>8}  {rerank:>6}  {qindex.nbytes / 2**20:>9.1f}  {index.nbytes / qindex.nbytes:>6.0f}x  "
+                f"{recall(truth, found):>10.3f}  {np.median(ms):>8.2f}"
+            )
+
+    if index.ivf is None:
+        start = time.perf_counter()
+        index.ivf = IVFIndex.build(index.matrix, index.valid, db_version=0)
+        print(f"Built IVF index in {time.perf_counter() - start:.1f}s")
+
+    print(f"\nIVF ({index.ivf.n_lists:,} lists)")
+    print(f"{'nprobe':>8}  {'recall@' + str(args.k):>10}  {'p50 ms':>8}  {'p95 ms':>8}  {'speedup':>8}")
+    for nprobe in [1, 2, 4, 8, 16, 32, 64, 128]:
+        if nprobe > index.ivf.n_lists:
+            break
+        found, ms = run(lambda q: index.search(q, args.k, nprobe=nprobe, method="ivf"), queries)
+        print(
+            f"{nprobe:>8}  {recall(truth, found):>10.3f}  {np.median(ms):>8.2f}  "
+            f"{np.percentile(ms, 95):>8.2f}  {np.median(exact_ms) / np.median(ms):>7.1f}x"
+        )
+
+    if index.hnsw is not None:
+        print(f"\nHNSW ({len(index.hnsw):,} nodes)")
+        print(f"{'ef':>8}  {'recall@' + str(args.k):>10}  {'p50 ms':>8}  {'p95 ms':>8}  {'speedup':>8}")
+        for ef in [16, 32, 64, 128, 256]:
+            found, ms = run(lambda q: index.hnsw.search(q, args.k, ef=ef), queries)
+            print(
+                f"{ef:>8}  {recall(truth, found):>10.3f}  {np.median(ms):>8.2f}  "
+                f"{np.percentile(ms, 95):>8.2f}  {np.median(exact_ms) / np.median(ms):>7.1f}x"
+            )
+
+    if not args.synthetic and has_vector_index(DB_PATH):
+        lindex = LanceSearchIndex(DB_PATH, lance_version(DB_PATH))
+        print("\nLance IVF_PQ index")
+        print(f"{'nprobes':>8}  {'refine':>6}  {'recall@' + str(args.k):>10}  {'p50 ms':>8}  {'p95 ms':>8}")
+        for nprobe in [8, 32, 64]:
+            for refine in [1, 10, 50]:
+                lindex.refine_factor = refine
+                found, ms = run(lambda q: lindex.search(q, args.k, nprobe=nprobe), queries)
+                print(
+                    f"{nprobe:>8}  {refine:>6}  {recall(truth, found):>10.3f}  "
+                    f"{np.median(ms):>8.2f}  {np.percentile(ms, 95):>8.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,9 @@
 # Copyright © 2023-2024 Apple Inc.
 
 import json
+import threading
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import mlx.core as mx
 import numpy as np
@@ -33,18 +34,59 @@ class CLIPImageProcessor:
         self.image_mean = mx.array(image_mean)
         self.image_std = mx.array(image_std)
         self.size = size
+        self._buffer: Optional[np.ndarray] = None
+        self._buffer_lock = threading.Lock()
 
     def __call__(self, images: List[Image]) -> mx.array:
-        return mx.concatenate(
-            [self._preprocess(image)[None] for image in images], axis=0
-        )
+        if not self.do_center_crop:
+            # Image sizes differ, so they cannot share a batch buffer
+            return mx.concatenate(
+                [self._preprocess(image)[None] for image in images], axis=0
+            )
+        return self.batch(images)
+
+    def batch(self, images: List[Image]) -> mx.array:
+        """Preprocess center-cropped images as one (B, crop, crop, 3) batch.
+
+        Each crop is written into a uint8 NumPy buffer that is kept and
+        reused by later batches (grown when a batch is larger), and rescale
+        and normalize run once over the whole batch.
+        """
+        with self._buffer_lock:
+            if self._buffer is None or len(self._buffer) < len(images):
+                self._buffer = self.allocate(len(images))
+            return self.from_pixels(self.pack(images, self._buffer))
+
+    def allocate(self, n: int) -> np.ndarray:
+        """Empty uint8 buffer for batches of up to n images (see pack)."""
+        return np.empty((n, self.crop_size, self.crop_size, 3), dtype=np.uint8)
+
+    def pack(self, images: List[Image], buffer: np.ndarray) -> np.ndarray:
+        """Write resized, center-cropped RGB images into the start of `buffer`."""
+        for i, image in enumerate(images):
+            image = self._crop(image)
+            buffer[i] = np.asarray(image if image.mode == "RGB" else image.convert("RGB"))
+        return buffer[:len(images)]
+
+    def from_pixels(self, pixels: np.ndarray) -> mx.array:
+        """Rescaled, normalized model input from packed uint8 pixels.
+
+        The pixels are copied, so their buffer can be reused right away.
+        """
+        pixels = rescale(mx.array(pixels))
+        if self.do_normalize:
+            pixels = normalize(pixels, self.image_mean, self.image_std)
+        return pixels
 
-    def _preprocess(self, image: Image) -> mx.array:
+    def _crop(self, image: Image) -> Image:
         if self.do_resize:
             image = resize(image, self.size)
-        if self.do_center_crop:
+        if self.do_center_crop and image.size != (self.crop_size, self.crop_size):
             image = center_crop(image, (self.crop_size, self.crop_size))
-        image = mx.array(np.array(image))
+        return image
+
+    def _preprocess(self, image: Image) -> mx.array:
+        image = mx.array(np.array(self._crop(image)))
         image = rescale(image)
         if self.do_normalize:
             image = normalize(image, self.image_mean, self.image_std)
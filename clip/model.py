@@ -201,9 +201,10 @@ class ClipTextModel(nn.Module):
         self.encoder = Encoder(config)
         self.final_layer_norm = nn.LayerNorm(config.hidden_size)
 
-    def __call__(self, x: mx.array) -> CLIPTextOutput:
+    def __call__(self, x: mx.array, eot_positions: Optional[mx.array] = None) -> CLIPTextOutput:
         B, N = x.shape
-        eot_tokens = mx.argmax(x, axis=-1)
+        # Without explicit positions, pool at the end-of-text token (the highest id)
+        eot_tokens = mx.argmax(x, axis=-1) if eot_positions is None else eot_positions
         x = self.embeddings(x)
         mask = nn.MultiHeadAttention.create_additive_causal_mask(N, x.dtype)
         for l in self.encoder.layers:
@@ -305,8 +306,8 @@ class CLIPModel(nn.Module):
         self.text_projection = nn.Linear(text_embed_dim, projection_dim, bias=False)
         self.logit_scale = mx.array(0.0)
 
-    def get_text_features(self, x: mx.array) -> mx.array:
-        return self.text_projection(self.text_model(x).pooler_output)
+    def get_text_features(self, x: mx.array, eot_positions: Optional[mx.array] = None) -> mx.array:
+        return self.text_projection(self.text_model(x, eot_positions).pooler_output)
 
     def get_image_features(self, x: mx.array) -> mx.array:
         return self.visual_projection(self.vision_model(x).pooler_output)
@@ -316,9 +317,10 @@ class CLIPModel(nn.Module):
         input_ids: Optional[mx.array] = None,
         pixel_values: Optional[mx.array] = None,
         return_loss=False,
+        eot_positions: Optional[mx.array] = None,
     ) -> CLIPModelOutput:
         if input_ids is not None:
-            text_model_output = self.text_model(input_ids)
+            text_model_output = self.text_model(input_ids, eot_positions)
             text_embeds = self.text_projection(text_model_output.pooler_output)
             text_embeds = text_embeds / LA.norm(text_embeds, axis=-1, keepdims=True)
         else:
@@ -58,6 +58,17 @@ class TestCLIP(unittest.TestCase):
                 ),
             )
 
+    def test_batch_tokenize(self):
+        texts = ["a cat", "a photo of a dog on the beach", "dog " * 100]
+        tokens, eot_positions = self.mx_tokenizer.batch_tokenize(texts)
+        self.assertEqual(tokens.shape, (3, 77))
+        self.assertEqual(eot_positions.tolist()[2], 76)
+        # Padded batch embeds each text exactly like encoding it alone
+        batched = self.mx_clip(input_ids=tokens, eot_positions=eot_positions).text_embeds
+        for i, txt in enumerate(texts[:2]):
+            single = self.mx_clip(input_ids=self.mx_tokenizer([txt])).text_embeds
+            self.assertTrue(np.allclose(batched[i], single[0], atol=1e-5))
+
     def test_text_encoder(self):
         texts = ["a photo of a cat", "a photo of a dog"]
         # Tokenize
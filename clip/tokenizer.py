@@ -7,6 +7,9 @@ from typing import Any
 import mlx.core as mx
 import regex
 
+# Padded sequence lengths used by batch_tokenize (the last is the context length)
+LENGTH_BUCKETS = (8, 16, 32, 64, 77)
+
 
 class CLIPTokenizer:
     """A simple port of CLIPTokenizer from https://github.com/huggingface/transformers/ ."""
@@ -106,6 +109,26 @@ class CLIPTokenizer:
             tokens.append(self.eos_token)
         return mx.array(tokens)
 
+    def batch_tokenize(self, texts, max_length=77, buckets=LENGTH_BUCKETS):
+        """Tokenize a batch of texts into one padded array.
+
+        Sequences longer than `max_length` are truncated (keeping the
+        end-of-text token last). All sequences are padded with end-of-text
+        tokens to the smallest bucket that fits the longest one, so the text
+        encoder only ever sees a few distinct shapes.
+
+        Returns:
+            (tokens, eot_positions): (B, L) token ids and the (B,) index of
+            each sequence's end-of-text token, for `ClipTextModel`.
+        """
+        batch = [self.tokenize(t).tolist() for t in texts]
+        batch = [t if len(t) <= max_length else t[: max_length - 1] + [self.eos_token] for t in batch]
+        longest = max(len(t) for t in batch)
+        width = next((b for b in buckets if b >= longest), max_length)
+        tokens = mx.array([t + [self.eos_token] * (width - len(t)) for t in batch])
+        eot_positions = mx.array([len(t) - 1 for t in batch])
+        return tokens, eot_positions
+
     @staticmethod
     def from_pretrained(path: str):
         path = Path(path)
@@ -0,0 +1,98 @@
+"""Composite queries: weighted positive and negative phrases searched as one query.
+
+"dog on beach" minus "people" is the query "dog on beach" with the extra
+term {"people": -0.5}. All phrases are embedded in one batched text-encoder
+pass and their weighted embeddings summed into a single query vector.
+Images are unit vectors scored by dot product, so that vector ranks images
+by the weighted sum of their similarities to each phrase (the index
+normalizes it, which scales every score alike), in one scan of the index
+however many phrases the query has.
+"""
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from text_cache import normalize_query
+
+# Phrases per composite query (including the query itself)
+MAX_TERMS = 16
+
+
+@dataclass(frozen=True)
+class CompositeQuery:
+    """Weighted phrases searched together.
+
+    Attributes:
+        terms: (phrase, weight) pairs, phrases normalized and sorted so equal
+            queries compare equal; negative weights push results away
+    """
+
+    terms: tuple[tuple[str, float], ...]
+
+    @classmethod
+    def from_params(cls, query: str, terms: dict[str, float] | None = None) -> "str | CompositeQuery":
+        """Combine a query (weight 1.0) with weighted extra phrases.
+
+        Returns the plain query when there are no extra phrases. Repeated
+        phrases add up their weights, and phrases weighted 0 are dropped.
+
+        Raises:
+            ValueError: Too many phrases, or none with a positive weight
+        """
+        if not terms:
+            return query
+        weights: dict[str, float] = {}
+        for text, weight in [(query, 1.0), *terms.items()]:
+            text = normalize_query(text)
+            if text:
+                weights[text] = weights.get(text, 0.0) + float(weight)
+        weights = {text: weight for text, weight in weights.items() if weight != 0}
+        if len(weights) > MAX_TERMS:
+            raise ValueError(f"At most {MAX_TERMS} phrases per query")
+        if not any(weight > 0 for weight in weights.values()):
+            raise ValueError("Query needs at least one phrase with a positive weight")
+        return cls(tuple(sorted(weights.items())))
+
+    @classmethod
+    def from_dict(cls, data: dict[str, float]) -> "CompositeQuery":
+        return cls(tuple(sorted((str(text), float(weight)) for text, weight in data.items())))
+
+    def to_dict(self) -> dict[str, float]:
+        """JSON-serializable {phrase: weight} (see from_dict)."""
+        return dict(self.terms)
+
+    @property
+    def texts(self) -> list[str]:
+        return [text for text, _ in self.terms]
+
+    @property
+    def text(self) -> str:
+        """The positive phrases, for matching against image paths."""
+        return " ".join(text for text, weight in self.terms if weight > 0)
+
+    def combine(self, embeddings: np.ndarray) -> np.ndarray:
+        """Weighted sum of the (len(terms), 512) embeddings of `texts`."""
+        weights = np.array([weight for _, weight in self.terms], dtype=np.float32)
+        return (weights @ embeddings).astype(np.float32)
+
+
+def query_texts(query: str | CompositeQuery) -> list[str]:
+    """Phrases to embed for a plain or composite query."""
+    return query.texts if isinstance(query, CompositeQuery) else [query]
+
+
+def query_text(query: str | CompositeQuery) -> str:
+    """Text of a plain or composite query, for lexical matching."""
+    return query.text if isinstance(query, CompositeQuery) else query
+
+
+def query_vector(query: str | CompositeQuery, embeddings: np.ndarray) -> np.ndarray:
+    """Query vector from the embeddings of query_texts(query)."""
+    return query.combine(embeddings) if isinstance(query, CompositeQuery) else embeddings[0]
+
+
+def embed_query(encode: Callable[[list[str]], np.ndarray], query: str | CompositeQuery) -> np.ndarray:
+    """Embed a plain or composite query with one call to `encode`."""
+    return query_vector(query, encode(query_texts(query)))
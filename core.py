@@ -1,6 +1,10 @@
 """Shared utilities for local image search."""
 
+import math
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Setup path for clip module
@@ -11,6 +15,8 @@ if str(_CLIP_DIR) not in sys.path:
 
 import clip
 import daft
+from image_processor import center_crop, resize
+import mlx.core as mx
 from daft import DataType, Series
 from PIL import Image
 import numpy as np
@@ -32,7 +38,17 @@ IMAGE_EXTENSIONS = {
     ".heic", ".heif", # iPhone photos
 }
 
-# Benchmark: ~280 images/second on M4 Max for batches of 225+
+# Dimension of CLIP ViT-B/32 image and text embeddings
+EMBEDDING_DIM = 512
+
+# Queries encoded per text-encoder forward pass
+MAX_TEXT_BATCH = 64
+
+# Threads decoding, resizing and cropping images while embedding
+DECODE_WORKERS = min(8, os.cpu_count() or 1)
+
+# Benchmark: ~280 images/second on M4 Max for batches of 225+; dry-run estimates
+# use the rate measured on this machine once the batch size is tuned (see autotune)
 IMAGES_PER_SECOND = 280
 
 # Default directories to exclude when scanning home directory
@@ -48,42 +64,153 @@ DEFAULT_EXCLUDE_DIRS = [
 ]
 
 
+def load_image(path, img_processor, fast: bool = True) -> Image.Image:
+    """Decode an image and resize and center-crop it to the model input size.
+
+    This is the expensive part of preprocessing; the processor then only
+    rescales and normalizes the crop.
+
+    Args:
+        path: Image file path or binary file object
+        fast: Decode no more pixels than the resize needs: JPEGs are decoded
+            in draft mode at the smallest 1/2, 1/4 or 1/8 scale whose short
+            side is still at least the resize target, and larger images are
+            shrunk by an integer factor with reduce() before the final
+            resample. Embeddings stay within a small cosine distance of
+            the full-resolution path (fast=False).
+
+    Raises:
+        OSError: The file is missing or not a readable image
+    """
+    image = Image.open(path)
+    target = img_processor.size if img_processor.do_resize else None
+    if fast and target and image.format == "JPEG":
+        width, height = image.size
+        scale = target / min(width, height)
+        if scale < 1:
+            image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+    image = image.convert("RGB")
+    if fast and target:
+        factor = min(image.size) // target
+        if factor >= 2:
+            image = image.reduce(factor)
+    if img_processor.do_resize:
+        image = resize(image, img_processor.size)
+    if img_processor.do_center_crop:
+        image = center_crop(image, (img_processor.crop_size, img_processor.crop_size))
+    return image
+
+
+class ImageEmbedder:
+    """CLIP image embeddings with images decoded on a thread pool.
+
+    PIL releases the GIL while decoding and resizing, so images of a batch
+    are loaded in parallel (in order) while the model runs on the calling
+    thread. Seconds spent per stage are accumulated in `timings`.
+
+    Args:
+        model: CLIP model
+        img_processor: CLIPImageProcessor of the model
+        workers: Decoding threads (1 decodes on the calling thread)
+        batch_size: Images per model forward pass (None: all paths of a call)
+    """
+
+    def __init__(self, model, img_processor, workers: int = DECODE_WORKERS, batch_size: int | None = None):
+        self.model = model
+        self.img_processor = img_processor
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix="decode") if self.workers > 1 else None
+        self.images = 0
+        self.timings = {"decode": 0.0, "preprocess": 0.0, "model": 0.0}
+
+    def _load(self, path: str) -> Image.Image | None:
+        try:
+            return load_image(path, self.img_processor)
+        except Exception as e:
+            print(f"Warning: Failed to load {path}: {e}")
+            return None
+
+    def __call__(self, paths: list[str]) -> np.ndarray:
+        """Embed image files; returns (len(paths), 512) float32, zero rows for failed images."""
+        start = time.perf_counter()
+        images = list(self.pool.map(self._load, paths)) if self.pool is not None else [self._load(p) for p in paths]
+        failed = np.array([image is None for image in images], dtype=bool)
+        placeholder = Image.new("RGB", (self.img_processor.crop_size, self.img_processor.crop_size))
+        images = [placeholder if image is None else image for image in images]
+        decoded = time.perf_counter()
+
+        batch_size = self.batch_size or max(1, len(images))
+        chunks = []
+        for i in range(0, len(images), batch_size):
+            began = time.perf_counter()
+            pixel_values = self.img_processor(images[i:i + batch_size])
+            mx.eval(pixel_values)
+            preprocessed = time.perf_counter()
+            output = self.model(pixel_values=pixel_values)
+            chunks.append(np.array(output.image_embeds, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+            self.timings["preprocess"] += preprocessed - began
+            self.timings["model"] += time.perf_counter() - preprocessed
+        embeddings = np.concatenate(chunks) if chunks else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        embeddings[failed] = 0.0
+
+        self.images += len(paths)
+        self.timings["decode"] += decoded - start
+        return embeddings
+
+    def stats(self) -> dict:
+        """Images embedded and seconds and images/second per stage."""
+        return {
+            "images": self.images,
+            "workers": self.workers,
+            **{f"{stage}_s": round(seconds, 3) for stage, seconds in self.timings.items()},
+            **{
+                f"{stage}_images_per_s": round(self.images / seconds, 1) if seconds else None
+                for stage, seconds in self.timings.items()
+            },
+        }
+
+
 @daft.cls
 class EmbedImages:
-    """Daft UDF to generate CLIP embeddings for images."""
+    """Daft UDF to generate CLIP embeddings for images.
+
+    Batches are encoded in chunks of the batch size tuned for this machine
+    and model (see autotune), which is probed on first use.
+    """
+
+    def __init__(self, workers: int = DECODE_WORKERS):
+        from autotune import tuned_batch_size  # autotune imports core
 
-    def __init__(self):
-        self.model, _, self.img_processor = clip.load(MODEL_PATH)
+        model, _, img_processor = clip.load(MODEL_PATH)
+        self.embedder = ImageEmbedder(model, img_processor, workers, tuned_batch_size(model, img_processor))
 
-    @daft.method.batch(return_dtype=DataType.embedding(DataType.float32(), 512))
+    @daft.method.batch(return_dtype=DataType.embedding(DataType.float32(), EMBEDDING_DIM))
     def __call__(self, paths: Series):
         """Takes a Series of image paths, returns a list of 512-dim embeddings."""
-        path_list = paths.to_pylist()
-        images = []
-        failed = []
-        for p in path_list:
-            try:
-                images.append(Image.open(p).convert("RGB"))
-            except Exception as e:
-                print(f"Warning: Failed to load {p}: {e}")
-                failed.append(p)
-                images.append(Image.new("RGB", (224, 224)))  # placeholder
-
-        pixel_values = self.img_processor(images)
-        output = self.model(pixel_values=pixel_values)
-        embeddings = [np.array(emb) for emb in output.image_embeds]
-
-        # Zero out embeddings for failed images
-        for i, p in enumerate(path_list):
-            if p in failed:
-                embeddings[i] = np.zeros(512, dtype=np.float32)
-
-        return embeddings
+        return list(self.embedder(paths.to_pylist()))
 
 
 def load_model():
-    """Load the CLIP model, tokenizer, and image processor."""
-    return clip.load(MODEL_PATH)
+    """Load the CLIP model, tokenizer, and image processor.
+
+    Weights are evaluated right away: MLX binds lazily loaded arrays to the
+    loading thread's stream, and the servers load on one thread but run the
+    model on another.
+    """
+    model, tokenizer, img_processor = clip.load(MODEL_PATH)
+    mx.eval(model.parameters())
+    return model, tokenizer, img_processor
+
+
+def embed_image(model, img_processor, path: str) -> np.ndarray:
+    """Embed one image file with the same preprocessing as EmbedImages.
+
+    Raises:
+        OSError: The file is missing or not a readable image
+    """
+    output = model(pixel_values=img_processor([load_image(path, img_processor)]))
+    return np.array(output.image_embeds[0])
 
 
 def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
@@ -91,11 +218,38 @@ def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
     return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
 
 
-def embed_text(model, tokenizer, text: str) -> np.ndarray:
-    """Embed a text query."""
-    tokens = tokenizer([text])
-    output = model(input_ids=tokens)
-    return np.array(output.text_embeds[0])
+def embed_text(model, tokenizer, text: str, cache=None) -> np.ndarray:
+    """Embed a text query (truncated to the 77-token context).
+
+    Args:
+        cache: Optional TextEmbeddingCache; repeat queries skip the encoder
+    """
+    if cache is not None:
+        return cache.get(text, lambda t: embed_text(model, tokenizer, t))
+    return embed_texts(model, tokenizer, [text])[0]
+
+
+def embed_texts(model, tokenizer, texts: list[str], cache=None) -> np.ndarray:
+    """Embed several text queries with one padded forward pass per MAX_TEXT_BATCH.
+
+    Queries are tokenized into length buckets (see CLIPTokenizer.batch_tokenize)
+    and pooled at their end-of-text positions.
+
+    Args:
+        cache: Optional TextEmbeddingCache; only uncached queries are encoded
+
+    Returns:
+        (len(texts), 512) float32 embeddings
+    """
+    if cache is not None:
+        return cache.get_batch(texts, lambda missing: embed_texts(model, tokenizer, missing))
+
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    for start in range(0, len(texts), MAX_TEXT_BATCH):
+        tokens, eot_positions = tokenizer.batch_tokenize(texts[start:start + MAX_TEXT_BATCH])
+        output = model(input_ids=tokens, eot_positions=eot_positions)
+        embeddings[start:start + len(tokens)] = np.array(output.text_embeds)
+    return embeddings
 
 
 def find_images(directory: Path, recursive: bool = True, show_progress: bool = True, exclude_dirs: list[str] | None = None) -> list[Path]:
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""Find groups of near-duplicate images (bursts, re-saved copies) in the embedding store.
+
+All pairs are compared with tiled matrix multiplies: the unit-vector matrix
+is cut into row tiles and each (i, j >= i) tile pair is scored as one
+matmul on a thread pool, so at most `workers` tile-sized score blocks exist
+at a time. Pairs above the threshold are merged into groups with
+union-find and written to a Lance table next to the DB, which the servers
+use to collapse duplicates in search results.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH, format_time
+from duplicates import duplicates_path, write_duplicates
+from index import lance_version, load_index
+
+# Cosine similarity above which two images count as near-duplicates
+DEFAULT_THRESHOLD = 0.95
+
+# Rows per tile; a tile pair's score block is TILE_ROWS^2 float32 (64 MB)
+TILE_ROWS = 4096
+
+
+class UnionFind:
+    """Disjoint sets over 0..n-1 with path halving and union by size."""
+
+    def __init__(self, n: int):
+        self.parent = np.arange(n, dtype=np.int64)
+        self.size = np.ones(n, dtype=np.int64)
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return int(x)
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+
+
+def _tile_pairs(matrix: np.ndarray, valid: np.ndarray, i: int, j: int, tile: int, threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    """Row pairs (a < b) above `threshold` between row tiles starting at i and j."""
+    a = matrix[i:i + tile].astype(np.float32, copy=False)
+    b = a if i == j else matrix[j:j + tile].astype(np.float32, copy=False)
+    rows, cols = np.nonzero(a @ b.T >= threshold)
+    rows += i
+    cols += j
+    keep = (rows < cols) & valid[rows] & valid[cols]
+    return rows[keep], cols[keep]
+
+
+def near_duplicate_pairs(matrix: np.ndarray, valid: np.ndarray, threshold: float = DEFAULT_THRESHOLD, tile: int = TILE_ROWS, workers: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """All row pairs (a < b) of unit vectors with cosine similarity >= threshold.
+
+    Args:
+        matrix: (N, 512) unit vectors (float32 or float16, may be memory-mapped)
+        valid: Boolean mask, False for failed images (never paired)
+        threshold: Minimum cosine similarity
+        tile: Rows per tile
+        workers: Threads scoring tile pairs (default: CPU count)
+    """
+    starts = range(0, len(matrix), tile)
+    tasks = [(i, j) for i in starts for j in starts if j >= i]
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        found = list(pool.map(lambda ij: _tile_pairs(matrix, valid, ij[0], ij[1], tile, threshold), tasks))
+    if not found:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate([a for a, _ in found]), np.concatenate([b for _, b in found])
+
+
+def duplicate_groups(n: int, pairs: tuple[np.ndarray, np.ndarray]) -> list[list[int]]:
+    """Connected groups of rows (size >= 2), largest first, rows in order."""
+    sets = UnionFind(n)
+    for a, b in zip(*pairs):
+        sets.union(int(a), int(b))
+    members: dict[int, list[int]] = {}
+    for row in np.unique(np.concatenate(pairs)):
+        members.setdefault(sets.find(int(row)), []).append(int(row))
+    return sorted(members.values(), key=lambda rows: (-len(rows), rows[0]))
+
+
+def find_duplicates(db_path: str = DB_PATH, threshold: float = DEFAULT_THRESHOLD, tile: int = TILE_ROWS, workers: int | None = None, log_fn=print) -> list[list[str]]:
+    """Group near-duplicate images in a Lance DB and write the groups table.
+
+    Returns:
+        Groups of paths, largest first
+    """
+    start = time.perf_counter()
+    version = lance_version(db_path)
+    index = load_index(db_path, version=version)
+    pairs = near_duplicate_pairs(index.matrix, index.valid, threshold, tile, workers)
+    groups = [[index.paths[row] for row in rows] for rows in duplicate_groups(len(index), pairs)]
+
+    path = duplicates_path(db_path)
+    write_duplicates(path, groups, version, threshold)
+    redundant = sum(len(g) - 1 for g in groups)
+    log_fn(
+        f"Compared {len(index):,} images: {len(groups):,} groups, {redundant:,} redundant images "
+        f"(cosine >= {threshold}) in {format_time(time.perf_counter() - start)}"
+    )
+    return groups
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find near-duplicate images in the embedding store"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"Cosine similarity for two images to count as duplicates (default: {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument(
+        "--tile",
+        type=int,
+        default=TILE_ROWS,
+        help=f"Rows per tile of the all-pairs comparison (default: {TILE_ROWS})",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Threads comparing tiles (default: CPU count)",
+    )
+    parser.add_argument(
+        "--show",
+        type=int,
+        default=10,
+        help="Number of largest groups to print (default: 10)",
+    )
+
+    args = parser.parse_args()
+
+    if not Path(DB_PATH).exists():
+        print("No embeddings found. Run embed.py first.")
+        sys.exit(1)
+
+    groups = find_duplicates(threshold=args.threshold, tile=args.tile, workers=args.workers)
+    for i, group in enumerate(groups[:args.show]):
+        print(f"\nGroup {i + 1} ({len(group)} images):")
+        for path in group:
+            print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
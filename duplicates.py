@@ -0,0 +1,110 @@
+"""Near-duplicate groups written by dedupe.py, used to collapse search results.
+
+The groups live in a small Lance table next to the embeddings (one row per
+image that has a near-duplicate). Servers load it with the embeddings and
+keep only the best-scoring image of each group in search results.
+"""
+
+from pathlib import Path
+from typing import Callable
+
+import lance
+import pyarrow as pa
+
+from core import DB_PATH
+
+
+def duplicates_path(db_path: str = DB_PATH) -> Path:
+    """Location of the near-duplicate groups table next to a Lance DB."""
+    return Path(db_path).with_suffix(".duplicates.lance")
+
+
+def write_duplicates(path: Path, groups: list[list[str]], db_version: int, threshold: float):
+    """Write groups of duplicate paths (group ids follow list order)."""
+    paths = [p for group in groups for p in group]
+    ids = [g for g, group in enumerate(groups) for _ in group]
+    schema = pa.schema(
+        [("group", pa.int64()), ("path", pa.string())],
+        metadata={"db_version": str(db_version), "threshold": str(threshold)},
+    )
+    table = pa.table({"group": pa.array(ids, pa.int64()), "path": pa.array(paths, pa.string())}, schema=schema)
+    lance.write_dataset(table, str(path), mode="overwrite")
+
+
+class DuplicateGroups:
+    """Group id of every image that has near-duplicates.
+
+    Attributes:
+        groups: {path: group id} for grouped images only
+        db_version: Lance DB version the groups were computed from
+        threshold: Cosine similarity threshold used
+    """
+
+    def __init__(self, groups: dict[str, int], db_version: int = 0, threshold: float = 0.0):
+        self.groups = groups
+        self.db_version = db_version
+        self.threshold = threshold
+
+    @classmethod
+    def load(cls, db_path: str = DB_PATH) -> "DuplicateGroups | None":
+        """Load the groups written by dedupe.py (None if it has not been run).
+
+        Groups are keyed by path, so they stay usable after later syncs;
+        new images are simply not grouped until dedupe.py runs again.
+        """
+        path = duplicates_path(db_path)
+        if not path.exists():
+            return None
+        dataset = lance.dataset(str(path))
+        table = dataset.to_table(columns=["path", "group"])
+        metadata = dataset.schema.metadata or {}
+        return cls(
+            dict(zip(table.column("path").to_pylist(), table.column("group").to_pylist())),
+            int(metadata.get(b"db_version", 0)),
+            float(metadata.get(b"threshold", 0.0)),
+        )
+
+    def __len__(self) -> int:
+        return len(self.groups)
+
+    def collapse(self, results: list[tuple[str, float]], seen: set | None = None) -> list[tuple[str, float]]:
+        """Drop results whose group already appeared earlier in the ranking.
+
+        Args:
+            seen: Groups of earlier results, updated in place (to collapse a
+                ranking that arrives in chunks)
+        """
+        seen = set() if seen is None else seen
+        collapsed = []
+        for path, score in results:
+            group = self.groups.get(path)
+            if group is not None:
+                if group in seen:
+                    continue
+                seen.add(group)
+            collapsed.append((path, score))
+        return collapsed
+
+    def collapse_ranking(self, results: list[tuple[str, float]], limit: int, searched: int) -> list[tuple[str, float]] | None:
+        """Collapsed top `limit` results, or None if a deeper search is needed.
+
+        Args:
+            results: Ranking returned for a search of depth `searched`
+            limit: Results wanted after collapsing
+            searched: Depth that was searched (len(results) < searched means
+                the ranking holds every match)
+        """
+        collapsed = self.collapse(results)
+        if len(collapsed) < limit and len(results) >= searched:
+            return None
+        return collapsed[:limit]
+
+
+def collapsed_search(search: Callable[[int], list], limit: int, duplicates: DuplicateGroups | None) -> list[tuple[str, float]]:
+    """Run search(depth) and collapse duplicates, searching deeper until `limit` results remain."""
+    if duplicates is None:
+        return search(limit)
+    depth = limit
+    while (ranking := duplicates.collapse_ranking(search(depth), limit, depth)) is None:
+        depth *= 2
+    return ranking
@@ -7,12 +7,38 @@ import time
 from pathlib import Path
 
 import daft
-from daft import col, DataType
-
-from core import EmbedImages, find_images, format_time, IMAGES_PER_SECOND, DB_PATH
+import lance
+import numpy as np
+import pyarrow as pa
+from daft import col, DataType, Series
+
+from autotune import autotune_path, estimated_rate, record_sync_rate, tuned_batch_size
+from core import find_images, format_time, load_model, DB_PATH, EMBEDDING_DIM
+from fingerprint import FingerprintCache, fingerprint_files
+from hnsw import COMPACT_RATIO, HNSWIndex, hnsw_path
+from index import SearchIndex, arrow_vectors, lance_version
+from ivf import IVF_MIN_IMAGES, IVFIndex, default_n_lists, ivf_path
+from lance_index import LANCE_INDEX_MIN_IMAGES, compact_if_fragmented, create_vector_index, delete_paths, has_vector_index, update_vector_index
+from lexical import LEXICAL_COMPACT_RATIO, LexicalIndex, lexical_path
+from pipeline import EmbeddingPipeline
+from quantize import BITS_WORDS, sign_bits
+from sidecar import read_sidecar, sidecar_path, stored_dtype, write_sidecar
 
 # Type for vector column
-VECTOR_DTYPE = DataType.embedding(DataType.float32(), 512)
+VECTOR_DTYPE = DataType.embedding(DataType.float32(), EMBEDDING_DIM)
+
+# Type the vector column is written as (Lance can only index plain fixed-size lists)
+STORED_VECTOR_DTYPE = DataType.fixed_size_list(DataType.float32(), EMBEDDING_DIM)
+
+# Type for the binary sign-code column (512 bits packed into uint64 words)
+BITS_DTYPE = DataType.fixed_size_list(DataType.uint64(), BITS_WORDS)
+
+
+@daft.func.batch(return_dtype=BITS_DTYPE)
+def vector_bits(vectors: Series):
+    """Compute binary sign codes for a batch of vectors (the `bits` column)."""
+    bits = sign_bits(arrow_vectors(vectors.to_arrow()))
+    return pa.FixedSizeListArray.from_arrays(pa.array(bits.reshape(-1)), BITS_WORDS)
 
 
 def get_current_files(directory: Path, recursive: bool = True, show_progress: bool = True, exclude_dirs: list[str] | None = None) -> dict[str, float]:
@@ -32,7 +58,250 @@ def get_stored_files() -> dict[str, float]:
     return dict(zip(data["path"], data["mtime"]))
 
 
-def sync_embeddings(directory: Path, recursive: bool = True, log_fn=print, exclude_dirs: list[str] | None = None) -> dict:
+def get_stored_fingerprints() -> tuple[list[str], list[str | None]]:
+    """Read (paths, fingerprints) of the stored rows in row order.
+
+    Rows written before fingerprints were stored have None.
+    """
+    if not Path(DB_PATH).exists():
+        return [], []
+
+    dataset = lance.dataset(DB_PATH)
+    has_fingerprints = "fingerprint" in dataset.schema.names
+    table = dataset.to_table(columns=["path", "fingerprint"] if has_fingerprints else ["path"])
+    paths = table.column("path").to_pylist()
+    return paths, table.column("fingerprint").to_pylist() if has_fingerprints else [None] * len(paths)
+
+
+def read_stored_rows(paths: set[str], fingerprints: dict[str, str | None]) -> daft.DataFrame:
+    """Stored (path, mtime, vector, fingerprint) rows of the given paths.
+
+    Fingerprints come from `fingerprints`, which may fill in or extend the
+    stored ones. Vectors are cast to the Embedding type (Lance returns lists).
+    """
+    df = daft.read_lance(DB_PATH).select("path", "mtime", "vector").where(col("path").is_in(list(paths)))
+    table = df.to_arrow()
+    column = pa.array([fingerprints.get(p) for p in table.column("path").to_pylist()], pa.string())
+    df = daft.from_arrow(table.append_column("fingerprint", column))
+    return df.with_column("vector", col("vector").cast(VECTOR_DTYPE))
+
+
+def read_rows_vectors(rows: list[int]) -> np.ndarray:
+    """Vectors of stored rows by row number, as (len(rows), 512) float32."""
+    return arrow_vectors(lance.dataset(DB_PATH).take(rows, columns=["vector"]).column("vector"))
+
+
+def update_ivf_index(force: bool = False, index: SearchIndex | None = None, log_fn=print):
+    """Build or refresh the IVF index persisted next to DB_PATH.
+
+    IVF search is approximate, so the index is only created when requested
+    (`force`, from --ivf) and kept up to date afterwards. Existing centroids
+    are reused while the library stays within 2x of the size they were
+    trained for, so a refresh only reassigns vectors to posting lists.
+
+    Args:
+        index: The latest DB_PATH version, if already loaded (read otherwise)
+    """
+    path = ivf_path(DB_PATH)
+    if not Path(DB_PATH).exists():
+        return
+    if not (force or path.exists()):
+        n = lance.dataset(DB_PATH).count_rows()
+        if n >= IVF_MIN_IMAGES:
+            log_fn(f"Tip: {n:,} images are searched exactly; sync with --ivf for faster approximate search")
+        return
+
+    version = lance_version(DB_PATH)
+    if index is None:
+        index = SearchIndex.from_lance(DB_PATH, version=version)
+    n_valid = int(index.valid.sum())
+    if n_valid == 0:
+        return
+
+    start = time.perf_counter()
+    centroids = None
+    if path.exists():
+        existing = IVFIndex.load(path)
+        target = default_n_lists(n_valid)
+        if target / 2 <= existing.n_lists <= min(target * 2, n_valid):
+            centroids = existing.centroids
+
+    log_fn("Updating IVF index..." if centroids is not None else "Building IVF index...")
+    ivf = IVFIndex.build(index.matrix, index.valid, version, centroids=centroids)
+    ivf.save(path)
+    log_fn(f"IVF index: {ivf.n_lists:,} lists over {n_valid:,} images in {format_time(time.perf_counter() - start)}")
+
+
+def update_vector_sidecar(dtype: str | None = None, index: SearchIndex | None = None, log_fn=print):
+    """Write the memory-mapped vector sidecar for the current DB_PATH version.
+
+    Servers map this file instead of deserializing the Lance table, so it
+    is rewritten after every sync that changes the DB.
+
+    Args:
+        dtype: "float32" or "float16" (default: the precision of the
+            existing sidecar, else float32)
+        index: The latest DB_PATH version, if already loaded (read otherwise)
+    """
+    if not Path(DB_PATH).exists():
+        return
+
+    start = time.perf_counter()
+    version = lance_version(DB_PATH)
+    if index is None:
+        index = SearchIndex.from_lance(DB_PATH, version=version)
+    path = sidecar_path(DB_PATH)
+    dtype = dtype or (stored_dtype(path) if path.exists() else None) or "float32"
+    write_sidecar(path, index.paths, index.matrix, index.valid, version, dtype=dtype)
+    log_fn(f"Vector sidecar: {len(index):,} {dtype} vectors ({path.stat().st_size / 2**20:.1f} MB) in {format_time(time.perf_counter() - start)}")
+
+
+def sidecar_is_current() -> bool:
+    """Whether the vector sidecar matches the latest DB_PATH version."""
+    path = sidecar_path(DB_PATH)
+    return path.exists() and read_sidecar(path)[0] == lance_version(DB_PATH)
+
+
+def schema_is_current() -> bool:
+    """Whether DB_PATH has every column sync writes, in their current types.
+
+    Only such a table can be changed in place; older ones are rewritten.
+    """
+    schema = lance.dataset(DB_PATH).schema
+    return (
+        {"path", "mtime", "vector", "fingerprint", "bits"} <= set(schema.names)
+        and pa.types.is_fixed_size_list(schema.field("vector").type)
+    )
+
+
+def write_in_place(df_new: daft.DataFrame | None, removed: set[str], fingerprints: dict[str, str], log_fn=print):
+    """Delete the `removed` rows of DB_PATH, append `df_new` and set the
+    fingerprints of kept rows, without rewriting the table.
+
+    Keeps Lance's vector index, which update_lance_index then extends to
+    the new rows. Data files are compacted once many syncs have added
+    fragments.
+    """
+    if removed:
+        delete_paths(DB_PATH, sorted(removed))
+    if df_new is not None:
+        df_new.write_lance(DB_PATH, mode="append")
+    if fingerprints:
+        # One commit for all of them, matched on path
+        dataset = lance.dataset(DB_PATH)
+        schema = dataset.schema
+        updates = pa.table({
+            "path": pa.array(list(fingerprints), schema.field("path").type),
+            "fingerprint": pa.array(list(fingerprints.values()), schema.field("fingerprint").type),
+        })
+        dataset.merge_insert("path").when_matched_update_all().execute(updates)
+    if compact_if_fragmented(DB_PATH):
+        log_fn("Compacted Lance data files")
+
+
+def update_lance_index(log_fn=print):
+    """Create or update Lance's IVF_PQ index on the vector column of DB_PATH.
+
+    Syncs change a table with an index in place, and the rows they add are
+    then assigned to the existing partitions; the index is only retrained
+    when the library size has drifted too far from the one it was trained
+    for (see lance_index.update_vector_index). Tables written before the
+    vector column was stored as a fixed-size list are converted first.
+    """
+    if not Path(DB_PATH).exists():
+        return
+
+    n = lance.dataset(DB_PATH).count_rows()
+    if n < LANCE_INDEX_MIN_IMAGES:
+        log_fn(f"Lance vector index needs at least {LANCE_INDEX_MIN_IMAGES} images, searching without it")
+        return
+
+    start = time.perf_counter()
+    if not pa.types.is_fixed_size_list(lance.dataset(DB_PATH).schema.field("vector").type):
+        log_fn("Converting vector column for Lance indexing...")
+        df = daft.read_lance(DB_PATH).with_column("vector", col("vector").cast(STORED_VECTOR_DTYPE))
+        df.write_lance(DB_PATH, mode="overwrite")
+
+    if has_vector_index(DB_PATH):
+        log_fn(f"Updating Lance vector index for {n:,} images...")
+        n_partitions, retrained = update_vector_index(DB_PATH)
+        action = "retrained" if retrained else "updated"
+    else:
+        log_fn(f"Building Lance vector index for {n:,} images...")
+        n_partitions, action = create_vector_index(DB_PATH), "built"
+    log_fn(f"Lance vector index: {n_partitions:,} partitions {action} in {format_time(time.perf_counter() - start)}")
+
+
+def read_vectors(paths: set[str] | None = None) -> tuple[list[str], list]:
+    """Read (paths, vectors) from DB_PATH, optionally only for the given paths."""
+    df = daft.read_lance(DB_PATH)
+    if paths is not None:
+        df = df.where(col("path").is_in(list(paths)))
+    data = df.select("path", "vector").collect().to_pydict()
+    return data["path"], data["vector"]
+
+
+def update_hnsw_index(added: set[str], removed: set[str], force: bool = False, log_fn=print):
+    """Apply sync deltas to the HNSW graph persisted next to DB_PATH.
+
+    Only maintained once it exists (or when forced, which builds it from all
+    stored embeddings). The graph is stamped with the DB version it matches;
+    servers ignore a graph with another version. Removed and modified images are tombstoned and new
+    and modified images inserted, so no full rebuild happens per refresh.
+    The graph is compacted once more than COMPACT_RATIO of it is tombstoned.
+    """
+    path = hnsw_path(DB_PATH)
+    if not Path(DB_PATH).exists() or not (force or path.exists()):
+        return
+
+    start = time.perf_counter()
+    if path.exists():
+        hnsw = HNSWIndex.load(path)
+        for p in removed:
+            hnsw.remove(p)
+        paths, vectors = read_vectors(added) if added else ([], [])
+        log_fn(f"Updating HNSW index (+{len(paths):,} / -{len(removed):,})...")
+    else:
+        hnsw = HNSWIndex()
+        paths, vectors = read_vectors()
+        log_fn(f"Building HNSW index for {len(paths):,} images...")
+
+    for p, v in zip(paths, vectors):
+        if np.any(v):  # failed images have zero vectors
+            hnsw.add(p, v)
+
+    if hnsw.tombstone_ratio > COMPACT_RATIO:
+        log_fn("Compacting HNSW index...")
+        hnsw = hnsw.compacted()
+
+    hnsw.db_version = lance_version(DB_PATH)
+    hnsw.save(path)
+    log_fn(f"HNSW index: {len(hnsw):,} images in {format_time(time.perf_counter() - start)}")
+
+
+def update_lexical_index(added: set[str], removed: set[str], log_fn=print):
+    """Apply sync deltas to the path-token index persisted next to DB_PATH.
+
+    Built from all stored paths when missing; afterwards only new paths are
+    tokenized and removed ones tombstoned, with a rebuild once more than
+    half of it is tombstoned.
+    """
+    if not Path(DB_PATH).exists():
+        return
+
+    start = time.perf_counter()
+    path = lexical_path(DB_PATH)
+    if path.exists():
+        index = LexicalIndex.load(path).updated(sorted(added), sorted(removed))
+        if index.tombstone_ratio > LEXICAL_COMPACT_RATIO:
+            index = index.compacted()
+    else:
+        index = LexicalIndex.build(lance.dataset(DB_PATH).to_table(columns=["path"]).column("path").to_pylist())
+    index.save(path)
+    log_fn(f"Lexical index: {len(index):,} paths, {len(index.tokens):,} tokens in {format_time(time.perf_counter() - start)}")
+
+
+def sync_embeddings(directory: Path, recursive: bool = True, log_fn=print, exclude_dirs: list[str] | None = None, ivf: bool = False, hnsw: bool = False, lance_index: bool = False, sidecar_dtype: str | None = None, retune: bool = False) -> dict:
     """Sync embeddings for images in a directory.
 
     Args:
@@ -40,9 +309,21 @@ def sync_embeddings(directory: Path, recursive: bool = True, log_fn=print, exclu
         recursive: Whether to search subdirectories
         log_fn: Function to use for logging (default: print)
         exclude_dirs: List of directory names to exclude (e.g. ["Library", ".cache"])
+        ivf: Build the IVF index for approximate search if it does not
+            exist yet (once built it is always kept in sync)
+        hnsw: Build the HNSW index if it does not exist yet (once built it is
+            always kept in sync)
+        lance_index: Build Lance's own vector index if it does not exist yet
+            (once built, later syncs update it in place)
+        sidecar_dtype: Precision of the memory-mapped vector sidecar
+            ("float32" or "float16"; default: keep the existing sidecar's)
+        retune: Probe the embedding batch size again even if it was tuned
+            on this machine before
 
     Returns:
-        Dict with stats: {new, modified, deleted, unchanged, total, elapsed}
+        Dict with stats: {new, modified, deleted, unchanged, reused, total, elapsed},
+        where reused counts new and modified images whose vector was taken
+        from an identical file instead of the model
     """
     # Scan current files
     log_fn(f"Scanning: {directory}")
@@ -74,53 +355,112 @@ def sync_embeddings(directory: Path, recursive: bool = True, log_fn=print, exclu
 
     if not to_embed and not deleted_paths:
         log_fn("Nothing to do.")
+        if lance_index and Path(DB_PATH).exists() and not has_vector_index(DB_PATH):
+            update_lance_index(log_fn=log_fn)
+        if Path(DB_PATH).exists() and (not sidecar_is_current() or sidecar_dtype not in (None, stored_dtype(sidecar_path(DB_PATH)))):
+            update_vector_sidecar(sidecar_dtype, log_fn=log_fn)
+        if ivf and not ivf_path(DB_PATH).exists():
+            update_ivf_index(force=True, log_fn=log_fn)
+        if Path(DB_PATH).exists() and hnsw_path(DB_PATH).exists() and HNSWIndex.load(hnsw_path(DB_PATH), mmap=True).db_version != lance_version(DB_PATH):
+            # Rebuilding Lance's index committed a new version with the same rows
+            update_hnsw_index(set(), set(), log_fn=log_fn)
+        if hnsw and not hnsw_path(DB_PATH).exists():
+            update_hnsw_index(set(), set(), force=True, log_fn=log_fn)
+        if not lexical_path(DB_PATH).exists():
+            update_lexical_index(set(), set(), log_fn=log_fn)
         return {
             "new": 0, "modified": 0, "deleted": 0,
-            "unchanged": len(unchanged_paths), "total": len(current), "elapsed": 0
+            "unchanged": len(unchanged_paths), "reused": 0, "total": len(current), "elapsed": 0
         }
 
     start = time.perf_counter()
 
-    if to_embed:
-        log_fn(f"Embedding {len(to_embed):,} images...")
+    # Overwriting the table drops Lance's vector index, so a table with one is
+    # changed in place: changed rows are deleted and their new versions appended
+    has_lance_index = Path(DB_PATH).exists() and has_vector_index(DB_PATH)
+    in_place = has_lance_index and schema_is_current()
+    lance_index = lance_index or has_lance_index
 
-        # Prepare data for new embeddings
+    reused = 0
+    fingerprint_updates: dict[str, str] = {}
+    if to_embed:
         paths_to_embed = sorted(to_embed)
-        mtimes_to_embed = [current[p] for p in paths_to_embed]
-
-        # Create DataFrame and embed
-        df_new = daft.from_pydict({"path": paths_to_embed, "mtime": mtimes_to_embed})
-        embed_images = EmbedImages()
-        df_new = df_new.with_column("vector", embed_images(col("path")))
-
-        # If we have unchanged embeddings, combine them
-        if unchanged_paths:
-            # Read existing and filter to unchanged only
-            df_existing = daft.read_lance(DB_PATH)
-            unchanged_list = list(unchanged_paths)
-            df_unchanged = df_existing.where(col("path").is_in(unchanged_list))
-
-            # Cast existing vectors to Embedding type (Lance returns as List)
-            df_unchanged = df_unchanged.with_column(
-                "vector", col("vector").cast(VECTOR_DTYPE)
-            )
-
-            # Combine unchanged + new
-            df_final = df_unchanged.concat(df_new)
+
+        # Reuse the vectors of content embedded before (copies, moved and
+        # re-saved files); unchanged rows from older DBs get fingerprints first
+        row_paths, row_fingerprints = get_stored_fingerprints()
+        fingerprints = dict(zip(row_paths, row_fingerprints))
+        missing = [p for p in sorted(unchanged_paths) if not fingerprints.get(p)]
+        if missing:
+            log_fn(f"Fingerprinting {len(missing):,} stored images...")
+            fingerprint_updates.update((p, f) for p, f in zip(missing, fingerprint_files(missing)) if f)
+        fingerprints.update(fingerprint_updates)
+        cache = FingerprintCache([fingerprints.get(p) for p in row_paths], row_paths, unchanged_paths)
+        plan = cache.resolve(paths_to_embed)
+        fingerprints.update(plan.upgraded)
+        fingerprint_updates.update(plan.upgraded)
+        reused = len(paths_to_embed) - len(plan.embed)
+        if reused:
+            log_fn(f"Reusing vectors of identical files for {reused:,} images")
+
+        embedded = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        if plan.embed:
+            log_fn(f"Embedding {len(plan.embed):,} images...")
+
+            # Embed with overlapping read/decode/model stages
+            model, _, img_processor = load_model()
+            batch_size = tuned_batch_size(model, img_processor, retune=retune, log_fn=log_fn)
+            pipeline = EmbeddingPipeline(model, img_processor, batch_size=batch_size)
+            embedded = arrow_vectors(pipeline.run(plan.embed, [current[p] for p in plan.embed]).column("vector"))
+            log_fn(pipeline.report())
+            record_sync_rate(len(plan.embed), pipeline.elapsed, autotune_path(DB_PATH))
+
+        vectors = plan.vectors(paths_to_embed, embedded, read_rows_vectors)
+        df_new = daft.from_arrow(pa.table({
+            "path": pa.array(paths_to_embed, pa.string()),
+            "mtime": pa.array([current[p] for p in paths_to_embed], pa.float64()),
+            "vector": pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1), pa.float32()), EMBEDDING_DIM),
+            "fingerprint": pa.array([plan.fingerprints[p] for p in paths_to_embed], pa.string()),
+        }))
+        df_new = df_new.with_column("vector", col("vector").cast(VECTOR_DTYPE))
+
+        # If we have unchanged embeddings (and rewrite the table), combine them
+        if unchanged_paths and not in_place:
+            df_final = read_stored_rows(unchanged_paths, fingerprints).concat(df_new)
         else:
             df_final = df_new
+    elif in_place:
+        df_final = None
     else:
         # No new embeddings, just filter out deleted
-        df_existing = daft.read_lance(DB_PATH)
-        keep_list = list(current_paths)
-        df_final = df_existing.where(col("path").is_in(keep_list))
+        df_final = read_stored_rows(current_paths, dict(zip(*get_stored_fingerprints())))
+
+    if df_final is not None:
+        # Materialize binary sign codes next to the vectors so servers never recompute them
+        df_final = df_final.with_column("bits", vector_bits(col("vector")))
+        df_final = df_final.with_column("vector", col("vector").cast(STORED_VECTOR_DTYPE))
 
     # Write to Lance
-    mode = "create" if not Path(DB_PATH).exists() else "overwrite"
-    df_final.write_lance(DB_PATH, mode=mode)
+    if in_place:
+        write_in_place(df_final, deleted_paths | modified_paths, fingerprint_updates, log_fn=log_fn)
+    else:
+        mode = "create" if not Path(DB_PATH).exists() else "overwrite"
+        df_final.write_lance(DB_PATH, mode=mode)
 
     elapsed = time.perf_counter() - start
 
+    # Keep the sidecar and approximate indexes in step with the new embeddings.
+    # Lance's index goes first: updating it commits a new DB version, which
+    # the sidecar and IVF index record.
+    if lance_index:
+        update_lance_index(log_fn=log_fn)
+    # One read of the new vectors serves both the sidecar and the IVF index
+    index = SearchIndex.from_lance(DB_PATH, version=lance_version(DB_PATH))
+    update_vector_sidecar(sidecar_dtype, index=index, log_fn=log_fn)
+    update_ivf_index(force=ivf, index=index, log_fn=log_fn)
+    update_hnsw_index(to_embed, deleted_paths | modified_paths, force=hnsw, log_fn=log_fn)
+    update_lexical_index(new_paths, deleted_paths, log_fn=log_fn)
+
     log_fn(f"Done in {format_time(elapsed)}")
     if to_embed:
         log_fn(f"Speed: {len(to_embed)/elapsed:.1f} images/second")
@@ -131,6 +471,7 @@ def sync_embeddings(directory: Path, recursive: bool = True, log_fn=print, exclu
         "modified": len(modified_paths),
         "deleted": len(deleted_paths),
         "unchanged": len(unchanged_paths),
+        "reused": reused,
         "total": len(current),
         "elapsed": elapsed
     }
@@ -156,6 +497,36 @@ def main():
         action="store_true",
         help="Don't search subdirectories",
     )
+    parser.add_argument(
+        "--ivf",
+        action="store_true",
+        help="Build the IVF index for faster approximate search (kept up to date by later syncs)",
+    )
+    parser.add_argument(
+        "--hnsw",
+        action="store_true",
+        help="Build the HNSW graph index (kept up to date by later syncs)",
+    )
+    parser.add_argument(
+        "--float16",
+        action="store_true",
+        help="Store the memory-mapped vector sidecar in half precision (kept by later syncs)",
+    )
+    parser.add_argument(
+        "--float32",
+        action="store_true",
+        help="Store the memory-mapped vector sidecar in full precision (the default; undoes --float16)",
+    )
+    parser.add_argument(
+        "--lance-index",
+        action="store_true",
+        help="Build Lance's IVF_PQ vector index (updated in place by later syncs)",
+    )
+    parser.add_argument(
+        "--retune",
+        action="store_true",
+        help="Measure the best embedding batch size for this machine again",
+    )
 
     args = parser.parse_args()
 
@@ -190,11 +561,15 @@ def main():
         print(f"Modified: {len(modified_paths):,}")
         print(f"Removed: {len(deleted_paths):,}")
         if to_embed:
-            estimated = len(to_embed) / IMAGES_PER_SECOND
-            print(f"\nTo embed: {len(to_embed):,} images (~{format_time(estimated)})")
+            rate, measured = estimated_rate(autotune_path(DB_PATH))
+            basis = f"{rate:.0f} images/s measured here" if measured else f"{rate:.0f} images/s, not yet measured here"
+            print(f"\nTo embed: {len(to_embed):,} images (~{format_time(len(to_embed) / rate)} at {basis})")
         return
 
-    sync_embeddings(directory, recursive=not args.no_recursive)
+    sync_embeddings(
+        directory, recursive=not args.no_recursive, ivf=args.ivf, hnsw=args.hnsw, lance_index=args.lance_index,
+        sidecar_dtype="float16" if args.float16 else "float32" if args.float32 else None, retune=args.retune,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+"""Metadata filters for vector search: directory prefix, extensions, mtime range.
+
+Per-row metadata is read from the Lance DB when embeddings load: row ids
+sorted by path (a directory is then one contiguous, binary-searched range),
+a dictionary-encoded extension code per row, the mtime column, and a
+path -> row map for looking up the stored vectors of given images. A filter
+resolves to the row ids that pass it and the index scores only those rows,
+so a selective filter makes a search cheaper instead of post-filtering a
+larger result list.
+"""
+
+import os
+from dataclasses import dataclass
+from datetime import datetime
+
+import lance
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _timestamp(value: float | str | None) -> float | None:
+    """Unix seconds from a number or an ISO 8601 date/datetime string."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Restricts a search to a subset of the images.
+
+    Attributes:
+        path_prefix: Directory to search in (recursively), ending in a separator
+        extensions: Lowercase file extensions including the dot, e.g. {".jpg"}
+        modified_after: Earliest mtime, inclusive (Unix seconds)
+        modified_before: Latest mtime, exclusive (Unix seconds)
+    """
+
+    path_prefix: str | None = None
+    extensions: frozenset[str] | None = None
+    modified_after: float | None = None
+    modified_before: float | None = None
+
+    @classmethod
+    def from_params(
+        cls,
+        path_prefix: str | None = None,
+        extensions: list[str] | None = None,
+        modified_after: float | str | None = None,
+        modified_before: float | str | None = None,
+    ) -> "SearchFilter | None":
+        """Build a filter from request parameters (None if none is set).
+
+        Args:
+            path_prefix: Directory; "~" is expanded and a trailing separator
+                added, so "/photos/2024" does not match "/photos/2024-old"
+            extensions: Extensions with or without the dot, any case
+            modified_after: Unix seconds or an ISO date such as "2024-01-01"
+            modified_before: Unix seconds or an ISO date
+        """
+        if path_prefix:
+            path_prefix = os.path.expanduser(path_prefix)
+            if not path_prefix.endswith(os.sep):
+                path_prefix += os.sep
+        else:
+            path_prefix = None
+        if extensions:
+            extensions = frozenset("." + e.lower().lstrip(".") for e in extensions)
+        else:
+            extensions = None
+        filters = cls(path_prefix, extensions, _timestamp(modified_after), _timestamp(modified_before))
+        return filters if filters != cls() else None
+
+    def to_dict(self) -> dict:
+        """JSON-serializable form (see from_dict)."""
+        return {
+            "path_prefix": self.path_prefix,
+            "extensions": sorted(self.extensions) if self.extensions is not None else None,
+            "modified_after": self.modified_after,
+            "modified_before": self.modified_before,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> "SearchFilter | None":
+        if data is None:
+            return None
+        extensions = data.get("extensions")
+        return cls(
+            data.get("path_prefix"),
+            frozenset(extensions) if extensions is not None else None,
+            data.get("modified_after"),
+            data.get("modified_before"),
+        )
+
+    def to_sql(self) -> str:
+        """Equivalent Lance SQL filter expression."""
+        clauses = []
+        if self.path_prefix is not None:
+            clauses.append(f"starts_with(path, {_sql_string(self.path_prefix)})")
+        if self.extensions is not None:
+            clauses.append("(" + " OR ".join(f"ends_with(lower(path), {_sql_string(e)})" for e in sorted(self.extensions)) + ")")
+        if self.modified_after is not None:
+            clauses.append(f"mtime >= {float(self.modified_after)!r}")
+        if self.modified_before is not None:
+            clauses.append(f"mtime < {float(self.modified_before)!r}")
+        return " AND ".join(clauses) if clauses else "true"
+
+
+def _lower_bound(values: pa.Array, target: str) -> int:
+    """First position in sorted `values` that is not less than `target`."""
+    lo, hi = 0, len(values)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if values[mid].as_py() < target:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+class RowMetadata:
+    """Per-row path, extension and mtime arrays for evaluating SearchFilters.
+
+    Attributes:
+        sorted_paths: All paths in sorted order (Arrow, not Python strings)
+        order: Row id of each entry in sorted_paths
+        extension_codes: Index into `extensions` per row (len(extensions) if none)
+        extensions: Distinct lowercase extensions, with the dot
+        mtimes: Modification time per row
+        row_ids: Row id of each path
+    """
+
+    def __init__(self, sorted_paths: pa.Array, order: np.ndarray, extension_codes: np.ndarray, extensions: list[str], mtimes: np.ndarray, row_ids: dict[str, int]):
+        self.sorted_paths = sorted_paths
+        self.order = order
+        self.extension_codes = extension_codes
+        self.extensions = extensions
+        self.mtimes = mtimes
+        self.row_ids = row_ids
+
+    @classmethod
+    def from_table(cls, table: pa.Table) -> "RowMetadata":
+        """Build from a table with `path` and `mtime` columns in index row order."""
+        paths = table.column("path").combine_chunks()
+        order = pc.sort_indices(paths)
+        suffixes = pc.extract_regex(pc.utf8_lower(paths), r"(?P<ext>\.[^./\\]+)$").field("ext")
+        encoded = suffixes.dictionary_encode()
+        extensions = encoded.dictionary.to_pylist()
+        codes = encoded.indices.fill_null(len(extensions)).to_numpy(zero_copy_only=False).astype(np.int32)
+        return cls(
+            paths.take(order),
+            order.to_numpy().astype(np.int64),
+            codes,
+            extensions,
+            table.column("mtime").to_numpy().astype(np.float64),
+            {path: row for row, path in enumerate(paths.to_pylist())},
+        )
+
+    @classmethod
+    def from_lance(cls, db_path: str, version: int) -> "RowMetadata":
+        """Read path and mtime columns from one version of a Lance DB."""
+        return cls.from_table(lance.dataset(db_path, version=version).to_table(columns=["path", "mtime"]))
+
+    def __len__(self) -> int:
+        return len(self.order)
+
+    def row(self, path: str) -> int | None:
+        """Row id of an image path (None if it is not indexed)."""
+        return self.row_ids.get(path)
+
+    def rows_of(self, paths: list[str]) -> np.ndarray:
+        """Row ids of image paths in one call, -1 for paths that are not indexed."""
+        get = self.row_ids.get
+        return np.fromiter((get(path, -1) for path in paths), dtype=np.int64, count=len(paths))
+
+    @property
+    def nbytes(self) -> int:
+        return self.sorted_paths.nbytes + self.order.nbytes + self.extension_codes.nbytes + self.mtimes.nbytes
+
+    def rows(self, filters: SearchFilter) -> np.ndarray:
+        """Sorted row ids that pass `filters`.
+
+        A path prefix narrows the rows to a binary-searched range first, so
+        the other conditions are only evaluated inside that directory.
+        """
+        rows = None
+        if filters.path_prefix is not None:
+            start = _lower_bound(self.sorted_paths, filters.path_prefix)
+            end = _lower_bound(self.sorted_paths, filters.path_prefix + "\U0010ffff")
+            rows = np.sort(self.order[start:end])
+
+        mask = None
+        if filters.extensions is not None:
+            allowed = np.zeros(len(self.extensions) + 1, dtype=bool)
+            allowed[[i for i, e in enumerate(self.extensions) if e in filters.extensions]] = True
+            mask = allowed[self.extension_codes if rows is None else self.extension_codes[rows]]
+        if filters.modified_after is not None or filters.modified_before is not None:
+            mtimes = self.mtimes if rows is None else self.mtimes[rows]
+            in_range = np.ones(len(mtimes), dtype=bool)
+            if filters.modified_after is not None:
+                in_range &= mtimes >= filters.modified_after
+            if filters.modified_before is not None:
+                in_range &= mtimes < filters.modified_before
+            mask = in_range if mask is None else mask & in_range
+
+        if mask is None:
+            return rows if rows is not None else np.arange(len(self), dtype=np.int64)
+        return np.flatnonzero(mask) if rows is None else rows[mask]
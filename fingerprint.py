@@ -0,0 +1,220 @@
+"""Content fingerprints of image files, and a fingerprint -> vector cache.
+
+The same photo often sits in several places (Downloads, Desktop, export
+folders), and moved or re-saved files show up as new or modified paths.
+A fingerprint identifies a file's content cheaply: a hash of its size and
+three sampled blocks (start, middle and end), or of the whole file when it
+is small. Every row of the Lance table stores the fingerprint of its file,
+and before embedding, sync looks up the fingerprints of new and modified
+files among the stored rows and among each other, so each distinct content
+goes through the model once.
+
+Files that differ only outside the sampled blocks share a sampled
+fingerprint, so a match is confirmed by hashing both files in full while
+both are on disk; the full hash is then appended to their fingerprints,
+which tells them apart from then on. A row whose file is gone cannot be
+hashed in full; its vector is reused on the sampled hash alone only for a
+file at another path (a moved file). A modified file never reuses its own
+old row unless its content is fully hashed.
+"""
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+
+import numpy as np
+
+from core import EMBEDDING_DIM
+
+# Bytes read per sampled block
+SAMPLE_BYTES = 64 * 1024
+
+# Sampled blocks per file; smaller files are hashed whole
+SAMPLES = 3
+
+# Threads reading files to fingerprint them
+FINGERPRINT_WORKERS = 8
+
+# Read size when hashing whole files
+_CHUNK_BYTES = 1 << 20
+
+
+def sampled_fingerprint(path: str) -> str:
+    """"<size>-<hash>" of a file's size and sampled blocks (hex).
+
+    Raises:
+        OSError: The file cannot be read
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= SAMPLE_BYTES * SAMPLES:
+            digest.update(f.read())
+        else:
+            for offset in (0, (size - SAMPLE_BYTES) // 2, size - SAMPLE_BYTES):
+                f.seek(offset)
+                digest.update(f.read(SAMPLE_BYTES))
+    return f"{size:x}-{digest.hexdigest()}"
+
+
+def full_hash(path: str) -> str:
+    """Hash of a file's whole content (hex).
+
+    Raises:
+        OSError: The file cannot be read
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_BYTES):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_key(fingerprint: str) -> str:
+    """The sampled part of a fingerprint (without any full hash)."""
+    return "-".join(fingerprint.split("-")[:2])
+
+
+def is_complete(fingerprint: str) -> bool:
+    """Whether a fingerprint covers the whole file (small file or full hash appended)."""
+    parts = fingerprint.split("-")
+    return len(parts) > 2 or int(parts[0], 16) <= SAMPLE_BYTES * SAMPLES
+
+
+def fingerprint_files(paths: list[str], workers: int = FINGERPRINT_WORKERS) -> list[str | None]:
+    """Sampled fingerprints of files, None for files that cannot be read."""
+    with ThreadPoolExecutor(max(1, workers), thread_name_prefix="fingerprint") as pool:
+        return list(pool.map(_try_fingerprint, paths))
+
+
+def _try_fingerprint(path: str) -> str | None:
+    try:
+        return sampled_fingerprint(path)
+    except OSError:
+        return None
+
+
+@dataclass
+class _Entry:
+    fingerprint: str
+    row: int | None  # Stored row holding the vector; None for a file embedded in this sync
+    path: str | None  # File on disk with this content, None if gone or changed
+    stored_path: str | None = None  # Path of the stored row
+
+
+@dataclass
+class Resolution:
+    """Which files to embed and which reuse a vector.
+
+    Attributes:
+        embed: Files whose content has no vector yet, in input order
+        fingerprints: Fingerprint of each input file (None if unreadable)
+        reused: File -> stored row whose vector it reuses
+        copies: File -> file in `embed` with the same content
+        upgraded: Stored (unchanged) file -> fingerprint with a full hash
+            appended while confirming a match
+    """
+
+    embed: list[str] = field(default_factory=list)
+    fingerprints: dict[str, str | None] = field(default_factory=dict)
+    reused: dict[str, int] = field(default_factory=dict)
+    copies: dict[str, str] = field(default_factory=dict)
+    upgraded: dict[str, str] = field(default_factory=dict)
+
+    def vectors(self, paths: list[str], embedded: np.ndarray, stored: Callable[[list[int]], np.ndarray]) -> np.ndarray:
+        """(len(paths), 512) vectors of the input files.
+
+        Args:
+            paths: The input files
+            embedded: Vectors of `embed`, in the same order
+            stored: Reads the vectors of stored rows
+        """
+        rows = list(dict.fromkeys(self.reused.values()))
+        stored_vectors = dict(zip(rows, stored(rows))) if rows else {}
+        embedded_vectors = dict(zip(self.embed, embedded))
+        out = np.zeros((len(paths), EMBEDDING_DIM), dtype=np.float32)
+        for i, path in enumerate(paths):
+            if path in self.reused:
+                out[i] = stored_vectors[self.reused[path]]
+            else:
+                out[i] = embedded_vectors[self.copies.get(path, path)]
+        return out
+
+
+class FingerprintCache:
+    """Fingerprint -> vector lookups over stored rows and files embedded in this sync.
+
+    Args:
+        fingerprints: Fingerprint of each stored row (None for rows without one)
+        paths: Path of each stored row
+        live: Stored paths whose files are unchanged on disk, so they can be
+            hashed in full to confirm a match
+    """
+
+    def __init__(self, fingerprints: list[str | None], paths: list[str], live: set[str]):
+        self._entries: dict[str, list[_Entry]] = {}
+        for row, (fingerprint, path) in enumerate(zip(fingerprints, paths)):
+            if fingerprint:
+                entry = _Entry(fingerprint, row, path if path in live else None, path)
+                self._entries.setdefault(fingerprint_key(fingerprint), []).append(entry)
+        self._full: dict[str, str | None] = {}
+
+    def resolve(self, paths: list[str], workers: int = FINGERPRINT_WORKERS) -> Resolution:
+        """Fingerprint files and match them against known content."""
+        resolution = Resolution()
+        for path, fingerprint in zip(paths, fingerprint_files(paths, workers)):
+            if fingerprint is None:
+                # Unreadable: the pipeline logs it and stores a zero vector
+                resolution.embed.append(path)
+                resolution.fingerprints[path] = None
+                continue
+            match = None
+            candidates = self._entries.get(fingerprint, [])
+            if candidates and is_complete(fingerprint):
+                match = candidates[0]
+            elif candidates:
+                own = self._full_hash(path)
+                if own is not None:
+                    fingerprint = f"{fingerprint}-{own}"
+                match = self._confirm(path, candidates, own, resolution)
+            resolution.fingerprints[path] = fingerprint
+            if match is None:
+                resolution.embed.append(path)
+                self._entries.setdefault(fingerprint_key(fingerprint), []).append(_Entry(fingerprint, None, path))
+            elif match.row is not None:
+                resolution.reused[path] = match.row
+            else:
+                resolution.copies[path] = match.path
+        return resolution
+
+    def _confirm(self, path: str, candidates: list[_Entry], own: str | None, resolution: Resolution) -> _Entry | None:
+        """The candidate with the same full hash, else the row of a file that
+        moved away (another path that no longer exists), which cannot be checked."""
+        unverified = None
+        for entry in candidates:
+            parts = entry.fingerprint.split("-")
+            other = parts[2] if len(parts) > 2 else None
+            if other is None and entry.path is not None:
+                other = self._full_hash(entry.path)
+                if other is not None:
+                    entry.fingerprint = f"{entry.fingerprint}-{other}"
+                    if entry.row is not None:
+                        resolution.upgraded[entry.path] = entry.fingerprint
+                    else:
+                        resolution.fingerprints[entry.path] = entry.fingerprint
+            if other is None:
+                if entry.stored_path not in (None, path) and not os.path.exists(entry.stored_path):
+                    unverified = unverified or entry
+            elif other == own:
+                return entry
+        return unverified if own is not None else None
+
+    def _full_hash(self, path: str) -> str | None:
+        if path not in self._full:
+            try:
+                self._full[path] = full_hash(path)
+            except OSError:
+                self._full[path] = None
+        return self._full[path]
@@ -0,0 +1,333 @@
+"""Hierarchical navigable small-world (HNSW) graph index.
+
+Nodes are keyed by image path so the graph can follow sync_embeddings
+deltas: new and modified images are inserted, deleted and modified ones are
+tombstoned. Tombstoned nodes keep routing searches but are never returned.
+"""
+
+import heapq
+import json
+import math
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH, EMBEDDING_DIM
+
+# Links per node on upper levels (level 0 keeps twice as many)
+DEFAULT_M = 16
+
+# Candidate list size while inserting (higher builds a better graph, slower)
+DEFAULT_EF_CONSTRUCTION = 100
+
+# Candidate list size while searching (raised to the result limit if smaller)
+DEFAULT_EF_SEARCH = 64
+
+# Rebuild from live nodes once this fraction of the graph is tombstoned
+COMPACT_RATIO = 0.5
+
+
+def hnsw_path(db_path: str = DB_PATH) -> Path:
+    """Location of the HNSW graph persisted next to a Lance DB."""
+    return Path(db_path).with_suffix(".hnsw")
+
+
+class PathTable:
+    """Read-only image paths stored as one UTF-8 blob plus offsets.
+
+    Lets a saved graph be memory-mapped without creating a Python string per
+    node up front; paths are decoded only when a search returns them.
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_list(cls, paths: list[str]) -> "PathTable":
+        encoded = [p.encode("utf-8") for p in paths]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        return cls(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+
+class HNSWIndex:
+    """HNSW graph over unit vectors with insert and tombstone delete.
+
+    Level-0 links live in a dense (capacity, 2 * m) array; the few nodes on
+    upper levels keep their links in one dict per level. Unused link slots
+    are -1.
+    """
+
+    def __init__(self, m: int = DEFAULT_M, ef_construction: int = DEFAULT_EF_CONSTRUCTION, seed: int = 0):
+        self.m = m
+        self.ef_construction = ef_construction
+        self._rng = np.random.default_rng(seed)
+        self._level_mult = 1 / math.log(m)
+
+        self.count = 0  # nodes ever inserted, including tombstoned ones
+        self.vectors = np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.links0 = np.full((0, 2 * m), -1, dtype=np.int32)
+        self.upper: list[dict[int, np.ndarray]] = []  # upper[l - 1][node] -> links on level l
+        self.paths: list[str] | PathTable = []
+        self.entry_point = -1
+        self.max_level = -1
+        self._node_of: dict[str, int] | None = None  # live path -> node, built lazily
+        self.db_version: int | None = None  # Lance DB version the graph matches (set when saved by sync)
+
+    def __len__(self) -> int:
+        """Number of live (non-tombstoned) nodes."""
+        return self.count - int(self.deleted[:self.count].sum())
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return 1 - len(self) / self.count if self.count else 0.0
+
+    @property
+    def node_of(self) -> dict[str, int]:
+        if self._node_of is None:
+            self._node_of = {
+                self.paths[n]: n for n in range(self.count) if not self.deleted[n]
+            }
+        return self._node_of
+
+    def __contains__(self, path: str) -> bool:
+        return path in self.node_of
+
+    # --- Graph primitives ---
+
+    def _links(self, node: int, level: int) -> np.ndarray:
+        row = self.links0[node] if level == 0 else self.upper[level - 1][node]
+        return row[row >= 0]
+
+    def _set_links(self, node: int, level: int, links: list[int]):
+        row = np.full(2 * self.m if level == 0 else self.m, -1, dtype=np.int32)
+        row[:len(links)] = links
+        if level == 0:
+            self.links0[node] = row
+        else:
+            self.upper[level - 1][node] = row
+
+    def _search_layer(self, query: np.ndarray, entry_points: list[int], ef: int, level: int) -> list[tuple[float, int]]:
+        """Best-first search on one level; returns (similarity, node) best first."""
+        visited = set(entry_points)
+        sims = (self.vectors[entry_points] @ query).tolist()
+        candidates = [(-s, n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(candidates)
+        results = [(s, n) for s, n in zip(sims, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            neg_sim, node = heapq.heappop(candidates)
+            if -neg_sim < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in self._links(node, level).tolist() if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for n, s in zip(neighbors, (self.vectors[neighbors] @ query).tolist()):
+                if len(results) < ef or s > results[0][0]:
+                    heapq.heappush(candidates, (-s, n))
+                    heapq.heappush(results, (s, n))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates: list[tuple[float, int]], m: int) -> list[int]:
+        """Pick up to m diverse neighbours from (similarity, node) pairs, best first.
+
+        A candidate is skipped if it is closer to an already selected neighbour
+        than to the base node; skipped candidates fill any remaining slots.
+        """
+        nodes = [n for _, n in candidates]
+        pairwise = (self.vectors[nodes] @ self.vectors[nodes].T).tolist()
+        selected, skipped = [], []
+        for i, (sim, _) in enumerate(candidates):
+            if len(selected) >= m:
+                break
+            if any(pairwise[i][j] > sim for j in selected):
+                skipped.append(i)
+            else:
+                selected.append(i)
+        return [nodes[i] for i in selected + skipped[:m - len(selected)]]
+
+    def _grow(self, size: int):
+        """Ensure per-node arrays can hold `size` nodes (doubling capacity)."""
+        capacity = len(self.vectors)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+        n = self.count
+        vectors = np.zeros((capacity, EMBEDDING_DIM), dtype=np.float32)
+        vectors[:n] = self.vectors[:n]
+        levels = np.zeros(capacity, dtype=np.int8)
+        levels[:n] = self.levels[:n]
+        deleted = np.zeros(capacity, dtype=bool)
+        deleted[:n] = self.deleted[:n]
+        links0 = np.full((capacity, 2 * self.m), -1, dtype=np.int32)
+        links0[:n] = self.links0[:n]
+        self.vectors, self.levels, self.deleted, self.links0 = vectors, levels, deleted, links0
+
+    # --- Public API ---
+
+    def add(self, path: str, vector: np.ndarray):
+        """Insert an image; an existing node for the same path is tombstoned."""
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / np.linalg.norm(vector)
+        self.remove(path)
+
+        node = self.count
+        self._grow(node + 1)
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self.vectors[node] = vector
+        self.levels[node] = level
+        self.paths.append(path)
+        self.node_of[path] = node
+        self.count += 1
+        while len(self.upper) < level:
+            self.upper.append({})
+        for lvl in range(level + 1):
+            self._set_links(node, lvl, [])
+
+        if self.entry_point < 0:
+            self.entry_point, self.max_level = node, level
+            return
+
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, level, -1):
+            entry = [self._search_layer(vector, entry, 1, lvl)[0][1]]
+
+        for lvl in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(vector, entry, self.ef_construction, lvl)
+            neighbors = self._select_neighbors(found, self.m)
+            self._set_links(node, lvl, neighbors)
+
+            max_links = 2 * self.m if lvl == 0 else self.m
+            for n in neighbors:
+                links = self._links(n, lvl).tolist() + [node]
+                if len(links) > max_links:
+                    sims = (self.vectors[links] @ self.vectors[n]).tolist()
+                    links = self._select_neighbors(sorted(zip(sims, links), reverse=True), max_links)
+                self._set_links(n, lvl, links)
+            entry = [n for _, n in found]
+
+        if level > self.max_level:
+            self.entry_point, self.max_level = node, level
+
+    def remove(self, path: str):
+        """Tombstone an image's node (no-op if the path is not indexed)."""
+        node = self.node_of.pop(path, None)
+        if node is not None:
+            self.deleted[node] = True
+
+    def search(self, query: np.ndarray, k: int, ef: int = DEFAULT_EF_SEARCH) -> list[tuple[str, float]]:
+        """Return up to k (path, cosine similarity) pairs, best first."""
+        if len(self) == 0 or k <= 0:
+            return []
+        query = np.asarray(query, dtype=np.float32)
+        query = query / np.linalg.norm(query)
+
+        entry = [self.entry_point]
+        for lvl in range(self.max_level, 0, -1):
+            entry = [self._search_layer(query, entry, 1, lvl)[0][1]]
+        found = self._search_layer(query, entry, max(ef, k), 0)
+
+        live = [(s, n) for s, n in found if not self.deleted[n]][:k]
+        return [(self.paths[n], s) for s, n in live]
+
+    def compacted(self) -> "HNSWIndex":
+        """Rebuild the graph from live nodes only, dropping tombstones."""
+        rebuilt = HNSWIndex(self.m, self.ef_construction)
+        rebuilt.db_version = self.db_version
+        for n in range(self.count):
+            if not self.deleted[n]:
+                rebuilt.add(self.paths[n], self.vectors[n])
+        return rebuilt
+
+    # --- Persistence ---
+
+    def save(self, path: Path):
+        """Write the graph as a directory of .npy files that load with mmap.
+
+        The directory is written next to the old one and swapped in, so a
+        server still mapping the previous files keeps working.
+        """
+        n = self.count
+        tmp_path = path.with_name(path.name + ".tmp")
+        if tmp_path.exists():
+            shutil.rmtree(tmp_path)
+        tmp_path.mkdir(parents=True)
+
+        paths = self.paths if isinstance(self.paths, PathTable) else PathTable.from_list(self.paths)
+        np.save(tmp_path / "vectors.npy", self.vectors[:n])
+        np.save(tmp_path / "levels.npy", self.levels[:n])
+        np.save(tmp_path / "deleted.npy", self.deleted[:n])
+        np.save(tmp_path / "links0.npy", self.links0[:n])
+        np.save(tmp_path / "paths.npy", paths.blob)
+        np.save(tmp_path / "path_offsets.npy", paths.offsets)
+        for lvl, links in enumerate(self.upper, start=1):
+            nodes = np.array(sorted(links), dtype=np.int32)
+            np.save(tmp_path / f"upper{lvl}_nodes.npy", nodes)
+            np.save(tmp_path / f"upper{lvl}_links.npy", np.array([links[i] for i in nodes.tolist()], dtype=np.int32).reshape(-1, self.m))
+        with open(tmp_path / "meta.json", "w") as f:
+            json.dump({
+                "m": self.m,
+                "ef_construction": self.ef_construction,
+                "count": n,
+                "entry_point": self.entry_point,
+                "max_level": self.max_level,
+                "db_version": self.db_version,
+            }, f)
+
+        old_path = path.with_name(path.name + ".old")
+        if path.exists():
+            if old_path.exists():
+                shutil.rmtree(old_path)
+            path.rename(old_path)
+        tmp_path.rename(path)
+        if old_path.exists():
+            shutil.rmtree(old_path)
+
+    @classmethod
+    def load(cls, path: Path, mmap: bool = False) -> "HNSWIndex":
+        """Load a saved graph.
+
+        Args:
+            path: Directory written by save()
+            mmap: Memory-map the arrays read-only for serving (loads in
+                milliseconds). Use mmap=False to get a graph that can be updated.
+        """
+        with open(path / "meta.json") as f:
+            meta = json.load(f)
+        mode = "r" if mmap else None
+        index = cls(meta["m"], meta["ef_construction"])
+        index.count = meta["count"]
+        index.entry_point = meta["entry_point"]
+        index.max_level = meta["max_level"]
+        index.db_version = meta.get("db_version")
+        index.vectors = np.load(path / "vectors.npy", mmap_mode=mode)
+        index.levels = np.load(path / "levels.npy", mmap_mode=mode)
+        index.deleted = np.load(path / "deleted.npy", mmap_mode=mode)
+        index.links0 = np.load(path / "links0.npy", mmap_mode=mode)
+        paths = PathTable(np.load(path / "paths.npy", mmap_mode=mode), np.load(path / "path_offsets.npy", mmap_mode=mode))
+        index.paths = paths if mmap else list(paths)
+        for lvl in range(1, max(index.max_level, 0) + 1):
+            nodes = np.load(path / f"upper{lvl}_nodes.npy")
+            links = np.load(path / f"upper{lvl}_links.npy")
+            index.upper.append(dict(zip(nodes.tolist(), links)))
+        return index
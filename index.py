@@ -0,0 +1,719 @@
+"""In-memory vector index shared by the FastAPI and MCP servers."""
+
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterator
+
+import lance
+import numpy as np
+import pyarrow as pa
+
+from core import DB_PATH, EMBEDDING_DIM
+from duplicates import DuplicateGroups, collapsed_search, duplicates_path
+from filters import RowMetadata, SearchFilter
+from hnsw import HNSWIndex, hnsw_path
+from ivf import DEFAULT_NPROBE, IVFIndex, ivf_path
+from lance_index import LanceSearchIndex
+from lexical import LEXICAL_DEPTH, LexicalIndex, fuse, lexical_path
+from quantize import BINARY_RERANK, BITS_WORDS, DEFAULT_RERANK, BinaryQuantizer, QuantizedVectors, make_quantizer
+from sidecar import read_sidecar, sidecar_path
+
+# Vectors sampled from the DB to fit a quantizer
+QUANTIZER_SAMPLE = 50_000
+
+# Ways to answer a query: scan every row, scan IVF posting lists, or walk the HNSW graph
+SEARCH_METHODS = ("exact", "ivf", "hnsw")
+
+# Rows per batch when streaming vectors out of Lance
+_READ_BATCH = 65_536
+
+# Filters keeping more than this fraction of rows score the whole matrix and
+# mask the rest, which is cheaper than gathering the kept rows
+_DENSE_FILTER_FRACTION = 0.25
+
+# Results in the first chunk of a streamed search (later chunks double)
+STREAM_FIRST_CHUNK = 16
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k highest scores, best first.
+
+    Uses argpartition so only the selected k entries are sorted.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        idx = np.argpartition(-scores, k - 1)[:k]
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+def top_k_chunks(scores: np.ndarray, k: int, first: int = STREAM_FIRST_CHUNK) -> Iterator[np.ndarray]:
+    """Yield the indices of the k highest scores in chunks, best first.
+
+    The top k are partitioned off once; each chunk (`first` indices, then
+    twice as many as the previous one) is then partitioned off the rest of
+    them and sorted, so the first chunk is ready without ordering all k.
+    """
+    k = min(k, len(scores))
+    if k <= 0:
+        return
+    idx = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    start, size = 0, max(1, first)
+    while start < k:
+        end = min(start + size, k)
+        if end < k:
+            rest = idx[start:]
+            idx[start:] = rest[np.argpartition(-scores[rest], end - start - 1)]
+        chunk = idx[start:end]
+        yield chunk[np.argsort(-scores[chunk], kind="stable")]
+        start, size = end, size * 2
+
+
+def _chunked(results: list, first: int = STREAM_FIRST_CHUNK) -> Iterator[list]:
+    """Split a ranked list into chunks of `first`, then doubling sizes."""
+    start, size = 0, max(1, first)
+    while start < len(results):
+        yield results[start:start + size]
+        start, size = start + size, size * 2
+
+
+def normalize_rows(vectors) -> tuple[np.ndarray, np.ndarray]:
+    """L2-normalize embedding rows.
+
+    Returns:
+        (matrix, valid): Contiguous float32 unit vectors, and a mask that is
+        False for zero vectors (images that failed to load), which stay zero.
+    """
+    matrix = np.array(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+    norms = np.linalg.norm(matrix, axis=1)
+    valid = norms > 1e-8
+    matrix[valid] /= norms[valid, None]
+    matrix[~valid] = 0.0
+    return np.ascontiguousarray(matrix), valid
+
+
+def _flat_values(array: pa.Array | pa.ChunkedArray) -> np.ndarray:
+    """Values of an Arrow fixed-size list column (or Daft extension over one)."""
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+    if isinstance(array, pa.ExtensionArray):
+        array = array.storage
+    return array.flatten().to_numpy(zero_copy_only=False)
+
+
+def arrow_vectors(array: pa.Array | pa.ChunkedArray) -> np.ndarray:
+    """Convert an Arrow vector column (fixed-size list or Daft embedding) to (N, 512) float32."""
+    return _flat_values(array).astype(np.float32, copy=False).reshape(-1, EMBEDDING_DIM)
+
+
+def arrow_bits(array: pa.Array | pa.ChunkedArray) -> np.ndarray:
+    """Convert an Arrow `bits` column to (N, 8) uint64 sign codes."""
+    return _flat_values(array).astype(np.uint64, copy=False).reshape(-1, BITS_WORDS)
+
+
+class LanceVectors:
+    """Fetches full-precision vectors by row id from one version of a Lance DB."""
+
+    def __init__(self, db_path: str, version: int):
+        self.dataset = lance.dataset(db_path, version=version)
+
+    def __call__(self, rows: np.ndarray) -> np.ndarray:
+        table = self.dataset.take(np.asarray(rows, dtype=np.int64).tolist(), columns=["vector"])
+        return normalize_rows(arrow_vectors(table.column("vector")))[0]
+
+
+class SearchIndex:
+    """Pre-normalized embedding matrix for cosine similarity search.
+
+    Built once when embeddings are loaded. Each query is answered with a
+    single matrix-vector product and an argpartition top-k instead of a
+    per-row Python loop.
+
+    With quantized storage there is no float32 matrix: first-pass scores come
+    from the compressed codes and the best `rerank` candidates are rescored
+    with full-precision vectors fetched on demand.
+
+    Attributes:
+        paths: Image path for each row (array or memory-mapped PathTable)
+        matrix: Contiguous (N, 512) float32 matrix of unit-length vectors
+            (float16 from a half-precision sidecar; None with quantized storage)
+        valid: Boolean mask, False for failed images (zero vectors)
+        ivf: Optional IVFIndex used for approximate search
+        hnsw: Optional HNSWIndex used for approximate search
+        method: Default search method, one of SEARCH_METHODS (None: HNSW if
+            attached, else IVF if attached, else exact); a method whose
+            index is not attached falls back to exact search
+        quantized: Optional QuantizedVectors used instead of the matrix
+        rerank: Candidates rescored exactly per query with quantized storage
+        metadata: Optional RowMetadata needed for filtered searches
+    """
+
+    def __init__(self, paths: np.ndarray, matrix: np.ndarray | None, valid: np.ndarray, ivf: IVFIndex | None = None, hnsw: HNSWIndex | None = None, quantized: QuantizedVectors | None = None):
+        self.paths = paths
+        self.matrix = matrix
+        self.valid = valid
+        self.ivf = ivf
+        self.hnsw = hnsw
+        self.method: str | None = None
+        self.quantized = quantized
+        self.rerank = DEFAULT_RERANK
+        self.metadata: RowMetadata | None = None
+        # Read-only so one index can be shared safely between threads
+        for array in (self.paths, self.matrix, self.valid):
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+
+    @classmethod
+    def from_vectors(cls, paths: list[str], vectors) -> "SearchIndex":
+        """Build an index from raw (unnormalized) embedding vectors."""
+        matrix, valid = normalize_rows(vectors)
+        return cls(np.array(paths, dtype=object), matrix, valid)
+
+    @classmethod
+    def from_lance(cls, db_path: str = DB_PATH, version: int | None = None) -> "SearchIndex":
+        """Load all stored embeddings from a Lance DB (optionally a specific version).
+
+        Vectors are streamed as Arrow batches straight into the matrix
+        without materializing a Python object per row.
+        """
+        dataset = lance.dataset(db_path, version=version)
+        paths, vectors = [], []
+        for batch in dataset.to_batches(columns=["path", "vector"], batch_size=_READ_BATCH):
+            paths.extend(batch.column("path").to_pylist())
+            vectors.append(arrow_vectors(batch.column("vector")))
+        return cls.from_vectors(paths, np.concatenate(vectors) if vectors else [])
+
+    @classmethod
+    def from_sidecar(cls, path: Path) -> "SearchIndex":
+        """Memory-map a vector sidecar written by sync (see sidecar.py)."""
+        _, paths, matrix, valid = read_sidecar(path)
+        return cls(paths, matrix, valid)
+
+    @classmethod
+    def from_lance_quantized(cls, db_path: str, version: int, storage: str) -> "SearchIndex":
+        """Load a Lance DB as quantized codes without keeping the float32 matrix.
+
+        Vectors are streamed in batches and encoded with a quantizer fitted on
+        a random sample. Full-precision vectors are re-read from Lance only
+        for re-ranking. Binary codes are read straight from the `bits` column
+        when the DB has one, so no vectors are read at load time.
+
+        Args:
+            db_path: Lance DB path
+            version: Lance DB version to read
+            storage: "int8" (scalar), "pq" (product quantization) or "binary"
+                (sign codes)
+        """
+        dataset = lance.dataset(db_path, version=version)
+        n = dataset.count_rows()
+        if n == 0:
+            return cls.from_vectors([], [])
+
+        if storage == BinaryQuantizer.name and "bits" in dataset.schema.names:
+            paths, codes = [], []
+            for batch in dataset.to_batches(columns=["path", "bits"], batch_size=_READ_BATCH):
+                paths.extend(batch.column("path").to_pylist())
+                codes.append(arrow_bits(batch.column("bits")))
+            codes = np.concatenate(codes)
+            valid = codes.any(axis=1)  # zero vectors (failed images) have no sign bits set
+            quantized = QuantizedVectors(BinaryQuantizer(), codes, LanceVectors(db_path, version))
+            index = cls(np.array(paths, dtype=object), None, valid, quantized=quantized)
+            index.rerank = BINARY_RERANK
+            return index
+
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, min(n, QUANTIZER_SAMPLE), replace=False))
+        sample, sample_valid = normalize_rows(arrow_vectors(dataset.take(sample_rows.tolist(), columns=["vector"]).column("vector")))
+        quantizer = make_quantizer(storage, sample[sample_valid] if sample_valid.any() else sample)
+
+        paths, codes, valid = [], [], []
+        for batch in dataset.to_batches(columns=["path", "vector"], batch_size=_READ_BATCH):
+            vectors, batch_valid = normalize_rows(arrow_vectors(batch.column("vector")))
+            paths.extend(batch.column("path").to_pylist())
+            codes.append(quantizer.encode(vectors))
+            valid.append(batch_valid)
+
+        quantized = QuantizedVectors(quantizer, np.concatenate(codes), LanceVectors(db_path, version))
+        index = cls(np.array(paths, dtype=object), None, np.concatenate(valid), quantized=quantized)
+        if storage == BinaryQuantizer.name:
+            index.rerank = BINARY_RERANK
+        return index
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query against every row (-1 for failed images)."""
+        return self.batch_scores(normalize(query)[None])[0]
+
+    def batch_scores(self, queries: np.ndarray) -> np.ndarray:
+        """(Q, N) cosine similarities of unit query rows with one matrix-matrix product."""
+        if self.matrix.dtype == np.float32:
+            scores = queries @ self.matrix.T
+        else:
+            # Upcast half-precision rows block by block instead of the whole matrix
+            scores = np.empty((len(queries), len(self.matrix)), dtype=np.float32)
+            for start in range(0, len(self.matrix), _READ_BATCH):
+                block = self.matrix[start:start + _READ_BATCH]
+                scores[:, start:start + len(block)] = queries @ block.astype(np.float32).T
+        scores[:, ~self.valid] = -1.0
+        return scores
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the vectors (matrix or quantized codes)."""
+        return self.quantized.nbytes if self.quantized is not None else self.matrix.nbytes
+
+    def search(
+        self,
+        query: np.ndarray,
+        limit: int,
+        nprobe: int | None = None,
+        filters: SearchFilter | None = None,
+        rows: np.ndarray | None = None,
+        method: str | None = None,
+    ) -> list[tuple[str, float]]:
+        """Return up to `limit` (path, score) pairs, best first.
+
+        Failed images and non-positive scores are excluded.
+
+        Args:
+            query: Query embedding
+            limit: Maximum number of results
+            nprobe: IVF posting lists to scan (default: DEFAULT_NPROBE); only
+                used by the IVF method, but 0 forces exact search with any
+            filters: Only rank rows passing this filter. The HNSW graph is
+                not used for filtered searches; the filtered rows are scored
+                directly, or intersected with the IVF candidates when those
+                are fewer.
+            rows: Only rank these row ids (scored like filtered rows)
+            method: One of SEARCH_METHODS (default: self.method)
+        """
+        return [match for chunk in self.search_chunks(query, limit, nprobe, filters, rows, first=limit, method=method) for match in chunk]
+
+    def search_chunks(
+        self,
+        query: np.ndarray,
+        limit: int,
+        nprobe: int | None = None,
+        filters: SearchFilter | None = None,
+        rows: np.ndarray | None = None,
+        first: int = STREAM_FIRST_CHUNK,
+        method: str | None = None,
+    ) -> Iterator[list[tuple[str, float]]]:
+        """Like search, but yield the results in chunks as they are selected.
+
+        All candidates are scored up front; the top `limit` are then ordered
+        a chunk at a time (`first` results, then doubling, see top_k_chunks),
+        so the best results are available without sorting all of them.
+        """
+        method = self._method(method, nprobe)
+        rows = self._filtered_rows(filters, rows)
+        if method == "hnsw" and rows is None:
+            yield from _chunked([(path, score) for path, score in self.hnsw.search(query, limit) if score > 0], first)
+            return
+
+        query = normalize(query)
+        candidates = rows
+        if method == "ivf":
+            probed = self.ivf.candidates(query, nprobe or DEFAULT_NPROBE)
+            if rows is None:
+                candidates = probed
+            elif len(probed) < len(rows):
+                candidates = probed[np.isin(probed, rows, assume_unique=True)]
+        if candidates is not None and candidates is rows and self._dense(rows):
+            scores = np.where(self._row_mask(rows), self.scores(query), -1.0)
+            rows = None
+        else:
+            rows, scores = self._candidate_scores(query, limit, candidates)
+
+        for best in top_k_chunks(scores, limit, first):
+            ids = best if rows is None else rows[best]
+            chunk = [(self.paths[i], float(score)) for i, score in zip(ids, scores[best]) if score > 0]
+            if chunk:
+                yield chunk
+            if len(chunk) < len(best):
+                return
+
+    def search_batch(self, queries: np.ndarray, limit: int, nprobe: int | None = None, filters: SearchFilter | None = None, method: str | None = None) -> list[list[tuple[str, float]]]:
+        """Search several queries at once; returns one result list per query row.
+
+        Exact searches over the matrix score every query with a single
+        matrix-matrix product (over the filtered rows only, with `filters`).
+        With an ANN index or quantized storage each query is searched
+        separately.
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        method = self._method(method, nprobe)
+        if self.matrix is None or method != "exact":
+            return [self.search(query, limit, nprobe=nprobe, filters=filters, method=method) for query in queries]
+
+        rows = self._filtered_rows(filters)
+        queries = normalize_rows(queries)[0]
+        if rows is None or self._dense(rows):
+            all_scores = self.batch_scores(queries)
+            if rows is not None:
+                all_scores[:, ~self._row_mask(rows)] = -1.0
+                rows = None
+        else:
+            all_scores = queries @ self.matrix[rows].astype(np.float32, copy=False).T
+        results = []
+        for scores in all_scores:
+            best = top_k(scores, limit)
+            ids = best if rows is None else rows[best]
+            results.append([(self.paths[i], float(s)) for i, s in zip(ids, scores[best]) if s > 0])
+        return results
+
+    def vector(self, path: str) -> np.ndarray | None:
+        """Stored unit vector of an indexed image (None if not indexed or failed)."""
+        row = self.metadata.row(path) if self.metadata is not None else None
+        if row is None or not self.valid[row]:
+            return None
+        if self.matrix is not None:
+            return self.matrix[row].astype(np.float32)
+        return self.quantized.fetch(np.array([row]))[0]
+
+    def _method(self, method: str | None, nprobe: int | None) -> str:
+        """The search method to use: `method`, else the default, falling back
+        to exact search when its index is not attached or nprobe is 0."""
+        method = method or self.method or ("hnsw" if self.hnsw is not None else "ivf" if self.ivf is not None else "exact")
+        if method not in SEARCH_METHODS:
+            raise ValueError(f"Unknown search method {method!r} (expected one of {', '.join(SEARCH_METHODS)})")
+        if nprobe == 0 or (method == "ivf" and self.ivf is None) or (method == "hnsw" and self.hnsw is None):
+            return "exact"
+        return method
+
+    def _filtered_rows(self, filters: SearchFilter | None, rows: np.ndarray | None = None) -> np.ndarray | None:
+        """Valid row ids passing `filters`, among `rows` if given (None when unrestricted)."""
+        if filters is None and rows is None:
+            return None
+        if rows is not None:
+            rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if filters is not None:
+            if self.metadata is None:
+                raise ValueError("Filtered search needs row metadata (load the index with load_index)")
+            passing = self.metadata.rows(filters)
+            rows = passing if rows is None else rows[np.isin(rows, passing, assume_unique=True)]
+        return rows[self.valid[rows]]
+
+    def _dense(self, rows: np.ndarray) -> bool:
+        """Whether filtered rows are better scored by masking a full exact pass."""
+        return self.quantized is None and len(rows) > _DENSE_FILTER_FRACTION * len(self)
+
+    def _row_mask(self, rows: np.ndarray) -> np.ndarray:
+        mask = np.zeros(len(self), dtype=bool)
+        mask[rows] = True
+        return mask
+
+    def _candidate_scores(self, query: np.ndarray, limit: int, candidates: np.ndarray | None = None) -> tuple[np.ndarray | None, np.ndarray]:
+        """Exact scores of the rows that can make the top `limit`.
+
+        Args:
+            query: Unit-length query vector
+            limit: Number of rows that will be selected
+            candidates: Row ids to consider (all valid if given)
+
+        Returns:
+            (rows, scores): Row ids and their scores, or None and the scores
+            of all rows
+        """
+        if self.quantized is not None:
+            coarse = self.quantized.coarse_scores(query, candidates)
+            if candidates is None:
+                coarse[~self.valid] = -np.inf
+            shortlist = top_k(coarse, max(limit, self.rerank))
+            shortlist = shortlist[np.isfinite(coarse[shortlist])]
+            rows = shortlist if candidates is None else candidates[shortlist]
+            return rows, self.quantized.rerank(query, rows)
+        if candidates is None:
+            return None, self.scores(query)
+        return candidates, self.matrix[candidates].astype(np.float32, copy=False) @ query
+
+
+def normalize(query: np.ndarray) -> np.ndarray:
+    """Return a float32 unit-length copy of a query vector."""
+    query = np.asarray(query, dtype=np.float32)
+    norm = np.linalg.norm(query)
+    return query / norm if norm > 0 else query
+
+
+def find_similar(
+    index: SearchIndex | LanceSearchIndex,
+    path: str,
+    limit: int,
+    embed: Callable[[str], np.ndarray],
+    nprobe: int | None = None,
+    duplicates: DuplicateGroups | None = None,
+) -> list[tuple[str, float]]:
+    """Images most similar to the one at `path`, excluding that image.
+
+    An indexed image is looked up by path and its stored vector reused;
+    only images that are not indexed are embedded, with `embed(path)`.
+    With `duplicates`, only the best match of each near-duplicate group is
+    returned.
+    """
+    query = index.vector(path)
+    if query is None:
+        query = embed(path)
+
+    def search(depth: int) -> list[tuple[str, float]]:
+        results = index.search(query, depth + 1, nprobe=nprobe)
+        return [(p, score) for p, score in results if p != path][:depth]
+
+    return collapsed_search(search, limit, duplicates)
+
+
+def hybrid_search(
+    index: SearchIndex | LanceSearchIndex,
+    lexical: LexicalIndex | None,
+    text: str,
+    query: np.ndarray,
+    limit: int,
+    nprobe: int | None = None,
+    filters: SearchFilter | None = None,
+    vector_results: list[tuple[str, float]] | None = None,
+) -> list[tuple[str, float]]:
+    """Vector search for `query` fused with lexical matches of `text` on image paths.
+
+    Every lexical match is scored exactly against the query vector (common
+    tokens are ignored, so they are a small share of the library), which
+    also drops paths that are not in the index, failed, or excluded by
+    `filters`, and orders matches with equal lexical scores by vector score.
+    The lexical ranking is then cut to `limit`, the depth of the vector
+    ranking, before the two are fused. If at most LEXICAL_DEPTH paths match
+    and at least `limit` of them contain every query token, the vector
+    ranking is taken from the matches alone and the full vector search is
+    skipped. Without lexical matches this is a plain vector search.
+
+    Results are in fused order, with their cosine scores like a vector search.
+
+    Args:
+        vector_results: The vector ranking of `query`, at least `limit`
+            deep, if already computed (such as by a batched search)
+    """
+    matches = lexical.search(text, None) if lexical is not None else []
+    if not matches:
+        return vector_results[:limit] if vector_results is not None else index.search(query, limit, nprobe=nprobe, filters=filters)
+
+    if not isinstance(index, SearchIndex) or index.metadata is None:
+        # No row metadata to check lexical matches against filters
+        if vector_results is None:
+            vector_results = index.search(query, limit, nprobe=nprobe, filters=filters)
+        if filters is not None:
+            return vector_results[:limit]
+        return _cosine_scores(index, query, fuse(vector_results[:limit], matches[:limit], limit), vector_results)
+
+    rows = index.metadata.rows_of([p for p, _ in matches])
+    rows = rows[rows >= 0]
+    candidates = index.search(query, len(rows), nprobe=0, filters=filters, rows=rows)
+    lexical_scores = dict(matches)
+    # Candidates are in vector order, so the stable sort breaks lexical ties by it
+    ranked = sorted(candidates, key=lambda match: -lexical_scores[match[0]])[:LEXICAL_DEPTH]
+    matches = [(p, lexical_scores[p]) for p, _ in ranked]
+
+    if vector_results is None:
+        if len(candidates) <= LEXICAL_DEPTH and sum(score >= 1.0 for _, score in matches) >= limit:
+            vector_results = candidates[:limit]
+        else:
+            vector_results = index.search(query, limit, nprobe=nprobe, filters=filters)
+    # Both rankings are cut to the same depth, so deep path matches cannot
+    # outrank the vector results
+    return _cosine_scores(index, query, fuse(vector_results[:limit], matches[:limit], limit), vector_results + candidates)
+
+
+def _cosine_scores(index, query: np.ndarray, fused: list[tuple[str, float]], scored: list[tuple[str, float]]) -> list[tuple[str, float]]:
+    """Fused results with their cosine scores instead of fusion scores.
+
+    Scores come from `scored`; the few fused paths without one have their
+    stored vectors looked up.
+    """
+    scores = dict(scored)
+    query = normalize(query)
+    results = []
+    for path, _ in fused:
+        if path not in scores:
+            vector = index.vector(path)
+            scores[path] = float(normalize(vector) @ query) if vector is not None else 0.0
+        results.append((path, scores[path]))
+    return results
+
+
+def stream_search(
+    index: SearchIndex | LanceSearchIndex,
+    lexical: LexicalIndex | None,
+    text: str,
+    query: np.ndarray,
+    limit: int,
+    nprobe: int | None = None,
+    filters: SearchFilter | None = None,
+    duplicates: DuplicateGroups | None = None,
+    first: int = STREAM_FIRST_CHUNK,
+) -> Iterator[list[tuple[str, float]]]:
+    """Yield the results of a (hybrid) search in chunks, best first.
+
+    Vector results stream as SearchIndex.search_chunks selects them, with
+    near-duplicates collapsed on the way; if collapsing leaves fewer than
+    `limit`, the rest come from a deeper search at the end. Fusing lexical
+    matches needs the whole vector ranking, so when `text` matches image
+    paths the hybrid ranking is computed first and then chunked.
+    """
+    if lexical is not None and lexical.search(text, 1):
+        ranking = collapsed_search(lambda d: hybrid_search(index, lexical, text, query, d, nprobe, filters), limit, duplicates)
+        yield from _chunked(ranking, first)
+        return
+
+    if isinstance(index, SearchIndex):
+        chunks = index.search_chunks(query, limit, nprobe, filters, first=first)
+    else:
+        chunks = _chunked(index.search(query, limit, nprobe=nprobe, filters=filters), first)
+    if duplicates is None:
+        yield from chunks
+        return
+
+    seen_groups, emitted, ranked = set(), set(), 0
+    for chunk in chunks:
+        ranked += len(chunk)
+        chunk = duplicates.collapse(chunk, seen_groups)
+        emitted.update(path for path, _ in chunk)
+        if chunk:
+            yield chunk
+    if len(emitted) < limit and ranked >= limit:
+        ranking = collapsed_search(lambda d: index.search(query, d, nprobe=nprobe, filters=filters), limit, duplicates)
+        tail = duplicates.collapse([(path, score) for path, score in ranking if path not in emitted], seen_groups)
+        tail = tail[:limit - len(emitted)]
+        if tail:
+            yield tail
+
+
+def lance_version(db_path: str = DB_PATH) -> int:
+    """Return the current version number of a Lance DB."""
+    return lance.dataset(db_path).version
+
+
+def index_files_stamp(db_path: str = DB_PATH) -> tuple[int, ...]:
+    """Modification times of the persisted ANN indexes, vector sidecar, lexical index and duplicate groups (0 if missing).
+
+    Changes whenever one of them is built or updated, even if the Lance DB
+    itself did not change.
+    """
+    paths = (ivf_path(db_path), hnsw_path(db_path), sidecar_path(db_path), lexical_path(db_path), duplicates_path(db_path) / "_versions")
+    return tuple(p.stat().st_mtime_ns if p.exists() else 0 for p in paths)
+
+
+def load_index(db_path: str = DB_PATH, version: int | None = None, storage: str = "float32", method: str | None = None) -> SearchIndex | LanceSearchIndex:
+    """Load embeddings from a Lance DB along with any persisted ANN indexes.
+
+    If the IVF index was built from an older DB version, its centroids are
+    reused and the current vectors are reassigned to posting lists (float32
+    storage only; a stale IVF index is ignored with quantized storage). The
+    HNSW graph is memory-mapped, so attaching it costs milliseconds; a graph
+    saved for another DB version is ignored until the next sync updates it. With
+    float32 storage, a vector sidecar written for the same DB version is
+    memory-mapped instead of reading the vectors out of Lance. Path, extension
+    and mtime metadata for filtered searches is read alongside.
+
+    Args:
+        db_path: Lance DB path
+        version: Lance DB version to read (default: latest)
+        storage: "float32" (full matrix in RAM), "int8", "pq" or "binary"
+            (quantized codes), or "lance" (nothing in RAM; queries use
+            Lance's own vector index)
+        method: Default search method, one of SEARCH_METHODS (None: HNSW if
+            attached, else IVF if attached, else exact)
+    """
+    if method is not None and method not in SEARCH_METHODS:
+        raise ValueError(f"Unknown search method {method!r} (expected one of {', '.join(SEARCH_METHODS)})")
+    if version is None:
+        version = lance_version(db_path)
+    if storage == "lance":
+        return LanceSearchIndex(db_path, version)
+    if storage == "float32":
+        path = sidecar_path(db_path)
+        if path.exists() and read_sidecar(path)[0] == version:
+            index = SearchIndex.from_sidecar(path)
+        else:
+            index = SearchIndex.from_lance(db_path, version=version)
+    else:
+        index = SearchIndex.from_lance_quantized(db_path, version, storage)
+
+    path = ivf_path(db_path)
+    if path.exists() and index.valid.any():
+        ivf = IVFIndex.load(path)
+        if ivf.db_version == version:
+            index.ivf = ivf
+        elif index.matrix is not None:
+            index.ivf = IVFIndex.build(index.matrix, index.valid, version, centroids=ivf.centroids)
+
+    path = hnsw_path(db_path)
+    if path.exists():
+        hnsw = HNSWIndex.load(path, mmap=True)
+        if hnsw.db_version == version:
+            index.hnsw = hnsw
+    index.method = method
+
+    index.metadata = RowMetadata.from_lance(db_path, version)
+    if len(index.metadata) != len(index):
+        raise ValueError(f"Row metadata has {len(index.metadata)} rows, index has {len(index)}")
+    return index
+
+
+@dataclass(frozen=True)
+class IndexSnapshot:
+    """Immutable view of the embeddings that answers searches.
+
+    Attributes:
+        index: SearchIndex built from the Lance DB
+        version: Publish counter, increases by one with every new snapshot
+        db_version: Lance DB version the index was built from
+        files_stamp: index_files_stamp() of the ANN index files it loaded
+        duplicates: Near-duplicate groups used to collapse results (if any)
+        lexical: Path-token index for hybrid search (if any)
+    """
+
+    index: SearchIndex
+    version: int
+    db_version: int
+    files_stamp: tuple = ()
+    duplicates: DuplicateGroups | None = None
+    lexical: LexicalIndex | None = None
+
+
+class SnapshotPublisher:
+    """Holds the current IndexSnapshot and swaps in new ones atomically.
+
+    A new snapshot is fully built before it is published with a single
+    reference assignment. Readers grab `current` once per request and keep
+    using it, so they never block and never see a half-built index; searches
+    already in flight finish on the old snapshot. Only publishers take a lock,
+    to keep version numbers in order.
+    """
+
+    def __init__(self):
+        self._current: IndexSnapshot | None = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> IndexSnapshot | None:
+        """The latest published snapshot (None until the first publish)."""
+        return self._current
+
+    def publish(self, index: SearchIndex, db_version: int, files_stamp: tuple = (), duplicates: DuplicateGroups | None = None, lexical: LexicalIndex | None = None) -> IndexSnapshot:
+        """Publish a new snapshot and return it."""
+        with self._lock:
+            self._version += 1
+            snapshot = IndexSnapshot(
+                index=index, version=self._version, db_version=db_version, files_stamp=files_stamp,
+                duplicates=duplicates, lexical=lexical,
+            )
+            self._current = snapshot
+        return snapshot
+
+    def clear(self):
+        """Drop the current snapshot (e.g. when the Lance DB is removed)."""
+        with self._lock:
+            self._current = None
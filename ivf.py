@@ -0,0 +1,145 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index.
+
+Vectors are partitioned with spherical k-means. Each centroid owns a posting
+list of row ids, and a query only scores the rows in the `nprobe` lists whose
+centroids are closest to it.
+"""
+
+import math
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH
+
+# Libraries of this size get a hint to build the (opt-in, approximate) index
+IVF_MIN_IMAGES = 20_000
+
+# Posting lists scanned per query when the caller does not pass nprobe
+DEFAULT_NPROBE = 32
+
+# Rows per block when assigning vectors to centroids (bounds temporary memory)
+_ASSIGN_BLOCK = 65_536
+
+
+def ivf_path(db_path: str = DB_PATH) -> Path:
+    """Location of the IVF index persisted next to a Lance DB."""
+    return Path(db_path).with_suffix(".ivf.npz")
+
+
+def default_n_lists(n: int) -> int:
+    """Number of k-means partitions for n vectors (~2 * sqrt(n))."""
+    return max(1, min(n, round(2 * math.sqrt(n))))
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Return the nearest centroid (by inner product) for each vector."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), _ASSIGN_BLOCK):
+        block = vectors[start:start + _ASSIGN_BLOCK]
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, n_iter: int = 10, seed: int = 0, max_samples_per_cluster: int = 64) -> np.ndarray:
+    """Spherical k-means over unit vectors.
+
+    Args:
+        vectors: (N, D) float32 matrix of unit vectors
+        n_clusters: Number of centroids
+        n_iter: Lloyd iterations
+        seed: Random seed for sampling and initialization
+        max_samples_per_cluster: Train on at most this many vectors per centroid
+
+    Returns:
+        (n_clusters, D) float32 matrix of unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    n_samples = min(len(vectors), n_clusters * max_samples_per_cluster)
+    sample = vectors[rng.choice(len(vectors), n_samples, replace=False)]
+    centroids = sample[rng.choice(n_samples, n_clusters, replace=False)].copy()
+
+    for _ in range(n_iter):
+        labels = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_clusters)
+
+        # Re-seed empty clusters with random sample vectors
+        empty = counts == 0
+        sums[empty] = sample[rng.choice(n_samples, int(empty.sum()))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = (sums / np.maximum(norms, 1e-12)).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex:
+    """Posting lists of row ids grouped by nearest k-means centroid.
+
+    Posting lists are stored in CSR form: the rows of list i are
+    `rows[offsets[i]:offsets[i + 1]]`. Row ids refer to the row order of the
+    Lance DB at `db_version`.
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, rows: np.ndarray, db_version: int):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+        self.db_version = db_version
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, valid: np.ndarray, db_version: int, n_lists: int | None = None, centroids: np.ndarray | None = None) -> "IVFIndex":
+        """Build posting lists for the valid rows of a normalized matrix.
+
+        Args:
+            matrix: (N, D) float32 matrix of unit vectors
+            valid: Boolean mask of rows to index (failed images are skipped)
+            db_version: Lance DB version the matrix was read from
+            n_lists: Number of partitions (default: ~2 * sqrt(N))
+            centroids: Existing centroids to reuse instead of training k-means
+        """
+        valid_rows = np.flatnonzero(valid)
+        vectors = matrix[valid_rows]
+        if centroids is None:
+            n_lists = n_lists or default_n_lists(len(vectors))
+            centroids = kmeans(vectors, n_lists)
+        return cls.from_assignments(centroids, valid_rows, assign(vectors, centroids), db_version)
+
+    @classmethod
+    def from_assignments(cls, centroids: np.ndarray, rows: np.ndarray, labels: np.ndarray, db_version: int) -> "IVFIndex":
+        """Group row ids into CSR posting lists by their centroid label."""
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=len(centroids))
+        offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(centroids, offsets, rows[order].astype(np.int64), db_version)
+
+    def candidates(self, query: np.ndarray, nprobe: int = DEFAULT_NPROBE) -> np.ndarray:
+        """Row ids in the `nprobe` posting lists closest to a unit query vector."""
+        nprobe = max(1, min(nprobe, self.n_lists))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def save(self, path: Path):
+        """Write the index atomically (readers never see a partial file)."""
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                centroids=self.centroids,
+                offsets=self.offsets,
+                rows=self.rows,
+                db_version=np.int64(self.db_version),
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["offsets"], data["rows"], int(data["db_version"]))
@@ -0,0 +1,193 @@
+"""Search backed by Lance's own IVF_PQ vector index.
+
+Vectors never leave the dataset: queries run through Lance's `nearest`
+scanner, which probes `nprobes` IVF partitions using the PQ codes and
+re-scores `refine_factor * k` candidates with the stored float32 vectors.
+Memory use and startup time stay flat regardless of library size.
+"""
+
+import os
+
+import lance
+import numpy as np
+
+from core import DB_PATH, EMBEDDING_DIM
+from filters import SearchFilter
+from ivf import DEFAULT_NPROBE, default_n_lists
+
+# PQ codebooks need at least this many vectors to train
+LANCE_INDEX_MIN_IMAGES = 256
+
+# Bytes per PQ code (one per 8-dimensional subvector)
+NUM_SUB_VECTORS = 64
+
+# Candidates re-scored with full vectors, as a multiple of the result limit
+DEFAULT_REFINE_FACTOR = 10
+
+# Rows per IVF partition Lance needs for training
+_ROWS_PER_PARTITION = 256
+
+# Data fragments left by in-place syncs before they are compacted
+LANCE_MAX_FRAGMENTS = 32
+
+# Paths per delete predicate
+_DELETE_BATCH = 1000
+
+# Index statistics without the centroids (also silences Lance's warning about them)
+os.environ.setdefault("LANCE_INCLUDE_VECTOR_CENTROIDS", "false")
+
+
+def has_vector_index(db_path: str = DB_PATH, version: int | None = None) -> bool:
+    """Whether a Lance DB (latest or given version) has an index on `vector`."""
+    dataset = lance.dataset(db_path, version=version)
+    return any("vector" in index.field_names for index in dataset.describe_indices())
+
+
+def target_partitions(n: int) -> int:
+    """IVF partitions for an index over n rows."""
+    return max(1, min(default_n_lists(n), n // _ROWS_PER_PARTITION))
+
+
+def index_partitions(db_path: str = DB_PATH) -> int | None:
+    """IVF partitions of the index on `vector` (None without an index)."""
+    dataset = lance.dataset(db_path)
+    for index in dataset.describe_indices():
+        if "vector" in index.field_names:
+            return dataset.stats.index_stats(index.name)["indices"][0]["num_partitions"]
+    return None
+
+
+def create_vector_index(db_path: str = DB_PATH) -> int:
+    """(Re)build the IVF_PQ index on the `vector` column.
+
+    Returns:
+        Number of IVF partitions
+    """
+    dataset = lance.dataset(db_path)
+    n_partitions = target_partitions(dataset.count_rows())
+    dataset.create_index(
+        "vector",
+        index_type="IVF_PQ",
+        metric="cosine",
+        num_partitions=n_partitions,
+        num_sub_vectors=NUM_SUB_VECTORS,
+        replace=True,
+    )
+    return n_partitions
+
+
+def update_vector_index(db_path: str = DB_PATH) -> tuple[int, bool]:
+    """Bring the IVF_PQ index up to date with rows added since it was built.
+
+    New rows are assigned to the existing partitions (deleted rows are
+    already masked out) while the library stays within 2x of the partition
+    count the index was trained for; beyond that it is retrained.
+
+    Returns:
+        (number of IVF partitions, whether the index was retrained)
+    """
+    n_partitions = index_partitions(db_path)
+    target = target_partitions(lance.dataset(db_path).count_rows())
+    if n_partitions is None or not target / 2 <= n_partitions <= target * 2:
+        return create_vector_index(db_path), True
+    lance.dataset(db_path).optimize.optimize_indices()
+    return n_partitions, False
+
+
+def delete_paths(db_path: str, paths: list[str]):
+    """Delete the rows of the given image paths in place."""
+    dataset = lance.dataset(db_path)
+    for start in range(0, len(paths), _DELETE_BATCH):
+        quoted = ", ".join("'" + p.replace("'", "''") + "'" for p in paths[start:start + _DELETE_BATCH])
+        dataset.delete(f"path IN ({quoted})")
+
+
+def compact_if_fragmented(db_path: str = DB_PATH) -> bool:
+    """Compact the data files once in-place syncs have left many fragments.
+
+    Lance remaps the vector index onto the rewritten files. Returns whether
+    files were compacted.
+    """
+    dataset = lance.dataset(db_path)
+    if len(dataset.get_fragments()) <= LANCE_MAX_FRAGMENTS:
+        return False
+    dataset.optimize.compact_files()
+    return True
+
+
+class LanceSearchIndex:
+    """Answers searches with Lance nearest-neighbour queries on one DB version.
+
+    Drop-in for SearchIndex in the servers (`len`, `nbytes`, `search`), but
+    holds no vectors: each query is served from the dataset files through
+    the OS page cache.
+
+    Attributes:
+        dataset: Lance dataset pinned to the version that was loaded
+        indexed: Whether the dataset has a vector index (otherwise queries
+            scan all vectors on disk)
+        refine_factor: Candidates re-scored exactly, as a multiple of the limit
+    """
+
+    def __init__(self, db_path: str, version: int):
+        self.dataset = lance.dataset(db_path, version=version)
+        self.indexed = has_vector_index(db_path, version)
+        self.refine_factor = DEFAULT_REFINE_FACTOR
+        self._count = self.dataset.count_rows()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        """Vectors held in process memory (none; Lance reads them on demand)."""
+        return 0
+
+    def search(self, query: np.ndarray, limit: int, nprobe: int | None = None, filters: SearchFilter | None = None) -> list[tuple[str, float]]:
+        """Return up to `limit` (path, score) pairs, best first.
+
+        Failed images (zero vectors) and non-positive scores are excluded.
+
+        Args:
+            query: Query embedding
+            limit: Maximum number of results
+            nprobe: IVF partitions to probe (default: DEFAULT_NPROBE; 0 forces
+                an exact scan without the index)
+            filters: Only return rows passing this filter (applied by Lance
+                before the nearest-neighbor search)
+        """
+        if limit <= 0 or self._count == 0:
+            return []
+        nearest = {
+            "column": "vector",
+            "q": np.asarray(query, dtype=np.float32).reshape(EMBEDDING_DIM),
+            "k": limit,
+            "metric": "cosine",
+        }
+        if self.indexed and nprobe != 0:
+            nearest.update(nprobes=nprobe or DEFAULT_NPROBE, refine_factor=self.refine_factor)
+        else:
+            nearest["use_index"] = False
+
+        kwargs = {"filter": filters.to_sql(), "prefilter": True} if filters is not None else {}
+        table = self.dataset.to_table(columns=["path", "_distance"], nearest=nearest, **kwargs)
+        results = []
+        for path, distance in zip(table.column("path").to_pylist(), table.column("_distance").to_pylist()):
+            score = 1.0 - distance if distance is not None else 0.0
+            if score > 0:
+                results.append((path, float(score)))
+        return results
+
+    def vector(self, path: str) -> np.ndarray | None:
+        """Stored vector of an indexed image (None if not indexed or failed)."""
+        escaped = path.replace("'", "''")
+        table = self.dataset.to_table(columns=["vector"], filter=f"path = '{escaped}'", limit=1)
+        if table.num_rows == 0:
+            return None
+        vector = np.asarray(table.column("vector")[0].as_py(), dtype=np.float32)
+        return vector if np.linalg.norm(vector) > 1e-8 else None
+
+    def search_batch(self, queries: np.ndarray, limit: int, nprobe: int | None = None, filters: SearchFilter | None = None) -> list[list[tuple[str, float]]]:
+        """Search several queries; Lance answers one nearest query per row."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        return [self.search(query, limit, nprobe=nprobe, filters=filters) for query in queries]
@@ -0,0 +1,200 @@
+"""Inverted index over path tokens, fused with vector search.
+
+Queries like "invoice scan 2023" or "pikachu" often match file and folder
+names better than pixels. Every indexed path is split into lowercase word
+and number tokens; the index maps each token to the documents (paths)
+containing it, as CSR posting lists. Documents are appended and tombstoned
+as syncs add and remove images, so an update only tokenizes the new paths.
+
+Hybrid search (index.hybrid_search) fuses the lexical ranking with the
+vector ranking by reciprocal rank fusion. Tokens that most paths share
+(the library's root folder, the file extension) are ignored.
+"""
+
+import math
+import re
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH
+from hnsw import PathTable
+
+# Rebuild without tombstoned documents once more than this fraction is deleted
+LEXICAL_COMPACT_RATIO = 0.5
+
+# Lexical matches returned by default, and the most matches for which
+# hybrid search skips the full vector search
+LEXICAL_DEPTH = 1000
+
+# Query tokens found in more than this share of the paths (and in more than
+# LEXICAL_COMMON_MIN paths) are ignored, like "photos" or "jpg": they match
+# most of the library and would rank it all alike
+LEXICAL_COMMON_SHARE = 0.05
+LEXICAL_COMMON_MIN = 100
+
+# Reciprocal rank fusion constant: score = sum of 1 / (RRF_K + rank)
+RRF_K = 60
+
+# Words too common in queries to say anything about a path
+STOPWORDS = frozenset({"an", "and", "at", "by", "for", "from", "in", "of", "on", "or", "the", "to", "with"})
+
+_TOKEN = re.compile(r"[^\W\d_]+|\d+")
+
+
+def lexical_path(db_path: str = DB_PATH) -> Path:
+    """Location of the path-token index next to a Lance DB."""
+    return Path(db_path).with_suffix(".lexical.npz")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word and number tokens, without one-letter words and stopwords."""
+    return [t for t in _TOKEN.findall(text.lower()) if (len(t) > 1 or t.isdigit()) and t not in STOPWORDS]
+
+
+class LexicalIndex:
+    """Token -> document posting lists over image paths.
+
+    Attributes:
+        paths: Path of each document (including tombstoned ones)
+        deleted: True for tombstoned documents
+        tokens: Token of each posting list
+        offsets: Posting list i is docs[offsets[i]:offsets[i + 1]]
+        docs: Document ids, sorted within each posting list
+    """
+
+    def __init__(self, paths: list[str], deleted: np.ndarray, tokens: list[str], offsets: np.ndarray, docs: np.ndarray):
+        self.paths = paths
+        self.deleted = deleted
+        self.tokens = tokens
+        self.offsets = offsets
+        self.docs = docs
+        self._token_ids = {t: i for i, t in enumerate(tokens)}
+        self._doc_ids = {p: i for i, p in enumerate(paths) if not deleted[i]}
+
+    @classmethod
+    def build(cls, paths: list[str]) -> "LexicalIndex":
+        return cls([], np.zeros(0, dtype=bool), [], np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)).updated(paths, [])
+
+    def __len__(self) -> int:
+        return len(self._doc_ids)
+
+    @property
+    def tombstone_ratio(self) -> float:
+        return 1 - len(self) / len(self.paths) if self.paths else 0.0
+
+    def updated(self, added: list[str], removed: list[str]) -> "LexicalIndex":
+        """New index with `removed` paths tombstoned and `added` paths appended."""
+        deleted = self.deleted.copy()
+        for path in removed:
+            doc = self._doc_ids.get(path)
+            if doc is not None:
+                deleted[doc] = True
+        # Paths still live are already indexed (their tokens cannot change)
+        added = [p for p in dict.fromkeys(added) if p not in self._doc_ids or deleted[self._doc_ids[p]]]
+
+        tokens = list(self.tokens)
+        token_ids = dict(self._token_ids)
+        new_tokens, new_docs = [], []
+        for doc, path in enumerate(added, start=len(self.paths)):
+            for token in set(tokenize(path)):
+                if token not in token_ids:
+                    token_ids[token] = len(tokens)
+                    tokens.append(token)
+                new_tokens.append(token_ids[token])
+                new_docs.append(doc)
+
+        # Merge the new postings into the CSR arrays
+        token_of = np.concatenate([np.repeat(np.arange(len(self.tokens)), np.diff(self.offsets)), new_tokens]).astype(np.int64)
+        docs = np.concatenate([self.docs, new_docs]).astype(np.int64)
+        order = np.lexsort((docs, token_of))
+        offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(token_of, minlength=len(tokens)), out=offsets[1:])
+        deleted = np.concatenate([deleted, np.zeros(len(added), dtype=bool)])
+        return LexicalIndex(self.paths + added, deleted, tokens, offsets, docs[order])
+
+    def compacted(self) -> "LexicalIndex":
+        """Rebuild from live documents only, dropping tombstones."""
+        return LexicalIndex.build([p for p, d in zip(self.paths, self.deleted) if not d])
+
+    def search(self, text: str, limit: int | None = LEXICAL_DEPTH) -> list[tuple[str, float]]:
+        """Paths matching query tokens, best first (all of them if `limit` is None).
+
+        Common tokens (see LEXICAL_COMMON_SHARE) are ignored. Scores are the
+        IDF weight of the matched query tokens over the weight of all the
+        remaining query tokens, so 1.0 means the path contains every one.
+        Paths with equal scores are in index order; callers that truncate
+        the ranking should break ties first.
+        """
+        query = list(dict.fromkeys(tokenize(text)))
+        n = len(self)
+        if not query or n == 0:
+            return []
+
+        common = max(LEXICAL_COMMON_MIN, LEXICAL_COMMON_SHARE * n)
+        postings, weights, total = [], [], 0.0
+        for token in query:
+            i = self._token_ids.get(token)
+            docs = self.docs[self.offsets[i]:self.offsets[i + 1]] if i is not None else self.docs[:0]
+            docs = docs[~self.deleted[docs]]
+            if len(docs) > common:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            total += idf
+            postings.append(docs)
+            weights.append(np.full(len(docs), idf))
+
+        docs = np.concatenate(postings) if postings else self.docs[:0]
+        if len(docs) == 0:
+            return []
+        matched, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(weights)) / total
+        best = np.argsort(-scores, kind="stable")[:limit]
+        return [(self.paths[matched[i]], round(float(scores[i]), 6)) for i in best]
+
+    def save(self, path: Path):
+        """Write the index atomically (readers never see a partial file)."""
+        paths = PathTable.from_list(self.paths)
+        tokens = PathTable.from_list(self.tokens)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                path_blob=paths.blob,
+                path_offsets=paths.offsets,
+                deleted=self.deleted,
+                token_blob=tokens.blob,
+                token_offsets=tokens.offsets,
+                offsets=self.offsets,
+                docs=self.docs,
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "LexicalIndex":
+        with np.load(path) as data:
+            return cls(
+                list(PathTable(data["path_blob"], data["path_offsets"])),
+                data["deleted"],
+                list(PathTable(data["token_blob"], data["token_offsets"])),
+                data["offsets"],
+                data["docs"],
+            )
+
+
+def fuse(vector_results: list[tuple[str, float]], lexical_results: list[tuple[str, float]], limit: int) -> list[tuple[str, float]]:
+    """Reciprocal rank fusion of a vector and a lexical ranking.
+
+    Both rankings are taken in the order given, one rank per path, so ties
+    in lexical scores should be broken beforehand (hybrid_search orders them
+    by vector score). Fused scores are scaled so that ranking first in both
+    lists scores 1.0.
+    """
+    fused: dict[str, float] = {}
+    for rank, (path, _) in enumerate(vector_results, start=1):
+        fused[path] = 1 / (RRF_K + rank)
+    for rank, (path, _) in enumerate(lexical_results, start=1):
+        fused[path] = fused.get(path, 0.0) + 1 / (RRF_K + rank)
+    best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+    scale = (RRF_K + 1) / 2
+    return [(path, score * scale) for path, score in best]
@@ -10,12 +10,17 @@ import threading
 import time
 from pathlib import Path
 
-import daft
-import numpy as np
 from mcp.server.fastmcp import FastMCP
 
-from core import load_model, embed_text, cosine_similarity, DB_PATH, MODEL_PATH, DEFAULT_EXCLUDE_DIRS
+from composite import CompositeQuery, embed_query, query_text
+from core import load_model, embed_image, embed_texts, DB_PATH, MAX_TEXT_BATCH, MODEL_PATH, DEFAULT_EXCLUDE_DIRS
 from embed import sync_embeddings
+from duplicates import DuplicateGroups, collapsed_search
+from filters import SearchFilter
+from index import SnapshotPublisher, find_similar, hybrid_search, index_files_stamp, lance_version, load_index
+from lexical import LexicalIndex, lexical_path
+from pagination import CursorError, ResultPages, decode_cursor
+from text_cache import TextEmbeddingCache, model_identity, text_cache_path
 
 # File-based lock to prevent concurrent refreshes across processes
 LOCK_FILE = Path(DB_PATH).parent / ".embedding_refresh.lock"
@@ -32,17 +37,30 @@ mcp = FastMCP("local-image-search")
 # Global state - loaded on startup
 model = None
 tokenizer = None
-embeddings_df = None
+img_processor = None
+text_cache = None  # TextEmbeddingCache for query embeddings
+snapshots = SnapshotPublisher()  # current IndexSnapshot, swapped atomically on refresh
+result_pages = ResultPages()  # cached rankings behind pagination cursors
 image_dir = None
 exclude_dirs = None  # Directories to exclude from scanning
 model_loading = False  # True while model is being downloaded/loaded
 
 # Embedding refresh state
 REFRESH_INTERVAL = int(os.environ.get("REFRESH_INTERVAL", "60"))  # default 1 minute
+BUILD_HNSW = os.environ.get("HNSW", "0") == "1"  # build and maintain the HNSW graph index
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "float32")  # float32, int8, pq, binary or lance
+SEARCH_METHOD = os.environ.get("SEARCH_METHOD") or None  # exact, ivf or hnsw (default: HNSW if built, else IVF if built, else exact)
+COLLAPSE_DUPLICATES = os.environ.get("COLLAPSE_DUPLICATES", "1") == "1"  # use dedupe.py groups
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") == "1"  # fuse path-token matches into results
 
 
-def get_status_info() -> dict:
-    """Get current service status."""
+def get_status_info(snapshot=None) -> dict:
+    """Get current service status.
+
+    Args:
+        snapshot: IndexSnapshot to report on (default: the current one)
+    """
+    snapshot = snapshot or snapshots.current
     if model_loading:
         return {
             "ready": False,
@@ -55,7 +73,7 @@ def get_status_info() -> dict:
             "status": "loading_model",
             "message": "Model is loading. Please wait a moment."
         }
-    if embeddings_df is None or len(embeddings_df) == 0:
+    if snapshot is None or len(snapshot.index) == 0:
         return {
             "ready": False,
             "status": "syncing_embeddings",
@@ -64,7 +82,9 @@ def get_status_info() -> dict:
     return {
         "ready": True,
         "status": "ready",
-        "total_images": len(embeddings_df)
+        "total_images": len(snapshot.index),
+        "version": snapshot.version,
+        "text_cache": text_cache.stats(),
     }
 
 
@@ -73,58 +93,162 @@ def get_status() -> dict:
     """Check if the image search service is ready.
 
     Returns:
-        Status dict with 'ready' boolean and 'message' or 'total_images'
+        Status dict with 'ready' boolean and 'message' or 'total_images',
+        'version' (increases each time refreshed embeddings are published)
+        and 'text_cache' (query embedding cache hits and misses)
     """
     return get_status_info()
 
 
 @mcp.tool()
-def search_images(query: str, limit: int = 5) -> list[dict]:
+def search_images(
+    query: str,
+    limit: int = 5,
+    nprobe: int | None = None,
+    cursor: str | None = None,
+    path_prefix: str | None = None,
+    extensions: list[str] | None = None,
+    modified_after: str | None = None,
+    modified_before: str | None = None,
+    terms: dict[str, float] | None = None,
+) -> list[dict]:
     """Search for images matching a text query.
 
+    Images whose file or folder names contain words of the query are ranked
+    higher (e.g. "invoice 2023" finds ~/Documents/invoices/2023/scan.png).
+
     Args:
         query: Natural language description of the image to find
         limit: Maximum number of results to return (default: 5)
+        nprobe: Index partitions to scan for large libraries; higher is more
+            accurate but slower (default: automatic, 0: exact search)
+        cursor: 'next_cursor' from a previous call to get the next page of
+            the same search (query, terms, nprobe and filters are then taken
+            from the cursor)
+        path_prefix: Only search images under this directory (e.g. "~/Pictures/2024")
+        extensions: Only search these file types (e.g. ["jpg", "heic"])
+        modified_after: Only images modified on or after this ISO date (e.g. "2024-01-01")
+        modified_before: Only images modified before this ISO date
+        terms: Extra phrases with weights combined with the query (which has
+            weight 1.0); negative weights exclude, e.g. query "dog on beach"
+            with {"people": -0.5} finds beach dogs without people
 
     Returns:
-        List of matching images with paths and similarity scores
+        List of matching images with paths and similarity scores, followed by
+        a {"next_cursor": ...} entry when more results are available
     """
-    global model, tokenizer, embeddings_df
+    global model, tokenizer
+
+    # Search a single snapshot even if a refresh publishes a new one meanwhile
+    snapshot = snapshots.current
 
     # Check if service is ready
-    status = get_status_info()
+    status = get_status_info(snapshot)
     if not status["ready"]:
         return [status]
 
-    # Embed the query text
-    query_embedding = embed_text(model, tokenizer, query)
-
-    # Get all embeddings and paths
-    data = embeddings_df.to_pydict()
-    paths = data["path"]
-    vectors = data["vector"]
-
-    # Compute similarities
-    scores = []
-    for i, vec in enumerate(vectors):
-        vec_array = np.array(vec, dtype=np.float32)
-        # Skip zero vectors (failed images)
-        if np.allclose(vec_array, 0):
-            scores.append(-1.0)
-        else:
-            scores.append(cosine_similarity(query_embedding, vec_array))
+    offset = 0
+    if cursor:
+        try:
+            query, nprobe, version, offset, filters = decode_cursor(cursor)
+        except CursorError as e:
+            return [{"error": str(e)}]
+        if version != snapshot.version:
+            return [{"error": "Embeddings were refreshed since this cursor was issued; search again"}]
+    else:
+        try:
+            query = CompositeQuery.from_params(query, terms)
+        except ValueError as e:
+            return [{"error": f"Invalid query: {e}"}]
+        try:
+            filters = SearchFilter.from_params(path_prefix, extensions, modified_after, modified_before)
+        except ValueError as e:
+            return [{"error": f"Invalid filter: {e}"}]
+
+    def rank(depth: int) -> list[tuple[str, float]]:
+        # Embed all phrases in one pass and rank images (failed images are excluded by the index)
+        query_embedding = embed_query(lambda texts: embed_texts(model, tokenizer, texts, cache=text_cache), query)
+        return collapsed_search(
+            lambda d: hybrid_search(snapshot.index, snapshot.lexical, query_text(query), query_embedding, d, nprobe, filters),
+            depth,
+            snapshot.duplicates,
+        )
+
+    # Follow-up pages are sliced from the cached ranking
+    matches, next_cursor = result_pages.page(rank, query, nprobe, snapshot.version, offset, limit, filters)
+    results = [{"path": path, "score": round(score, 3)} for path, score in matches]
+    if next_cursor:
+        results.append({"next_cursor": next_cursor})
 
-    # Sort by score descending
-    ranked = sorted(zip(paths, scores), key=lambda x: x[1], reverse=True)
+    return results
+
+
+@mcp.tool()
+def search_images_batch(queries: list[str], limit: int = 5, nprobe: int | None = None) -> list[dict]:
+    """Search for images matching several text queries at once.
+
+    Faster than calling search_images once per query: all queries are
+    embedded and scored together.
+
+    Args:
+        queries: Natural language descriptions (up to 64)
+        limit: Maximum number of results per query (default: 5)
+        nprobe: Index partitions to scan for large libraries (see search_images)
+
+    Returns:
+        One {"query", "results"} dict per query, in order
+    """
+    snapshot = snapshots.current
 
-    # Return top results
-    results = [
-        {"path": path, "score": round(score, 3)}
-        for path, score in ranked[:limit]
-        if score > 0  # exclude failed images
+    status = get_status_info(snapshot)
+    if not status["ready"]:
+        return [status]
+    if len(queries) > MAX_TEXT_BATCH:
+        return [{"error": f"At most {MAX_TEXT_BATCH} queries per call"}]
+
+    query_embeddings = embed_texts(model, tokenizer, queries, cache=text_cache)
+    matches = snapshot.index.search_batch(query_embeddings, limit, nprobe=nprobe)
+    if snapshot.lexical is not None:
+        # Fuse path-token matches like search_images, reusing the batched vector rankings
+        matches = [
+            hybrid_search(snapshot.index, snapshot.lexical, query, embedding, limit, nprobe, vector_results=results)
+            for query, embedding, results in zip(queries, query_embeddings, matches)
+        ]
+
+    return [
+        {"query": query, "results": [{"path": path, "score": round(score, 3)} for path, score in results]}
+        for query, results in zip(queries, matches)
     ]
 
-    return results
+
+@mcp.tool()
+def search_similar(path: str, limit: int = 5) -> list[dict]:
+    """Find images that look like a given image ("more like this").
+
+    Args:
+        path: Path of an image file. Indexed images reuse their stored
+            embedding (instant); other files are embedded first.
+        limit: Maximum number of results to return (default: 5)
+
+    Returns:
+        List of similar images with paths and similarity scores, not
+        including the image itself
+    """
+    snapshot = snapshots.current
+
+    status = get_status_info(snapshot)
+    if not status["ready"]:
+        return [status]
+
+    path = os.path.expanduser(path)
+    try:
+        matches = find_similar(
+            snapshot.index, path, limit, lambda p: embed_image(model, img_processor, p), duplicates=snapshot.duplicates,
+        )
+    except OSError as e:
+        return [{"error": f"Cannot read image {path}: {e}"}]
+
+    return [{"path": p, "score": round(score, 3)} for p, score in matches]
 
 
 def ensure_model_exists():
@@ -167,15 +291,32 @@ def ensure_model_exists():
 
 
 def reload_embeddings():
-    """Reload embeddings from Lance DB."""
-    global embeddings_df
+    """Reload embeddings from Lance DB and publish them as a new snapshot.
 
-    if Path(DB_PATH).exists():
-        embeddings_df = daft.read_lance(DB_PATH).collect()
-        log(f"Reloaded {len(embeddings_df)} embeddings")
-    else:
-        embeddings_df = None
+    The new index is built off to the side while searches keep using the
+    current snapshot. Skipped if neither the Lance DB nor the ANN indexes
+    have changed.
+    """
+    if not Path(DB_PATH).exists():
+        snapshots.clear()
         log("No embeddings found")
+        return
+
+    db_version = lance_version(DB_PATH)
+    files_stamp = index_files_stamp(DB_PATH)
+    current = snapshots.current
+    if current is not None and (current.db_version, current.files_stamp) == (db_version, files_stamp):
+        log("Embeddings unchanged, keeping current snapshot")
+        return
+
+    index = load_index(DB_PATH, version=db_version, storage=VECTOR_STORAGE, method=SEARCH_METHOD)
+    duplicates = DuplicateGroups.load(DB_PATH) if COLLAPSE_DUPLICATES else None
+    lexical = LexicalIndex.load(lexical_path(DB_PATH)) if HYBRID_SEARCH and lexical_path(DB_PATH).exists() else None
+    snapshot = snapshots.publish(index, db_version, files_stamp, duplicates, lexical)
+    result_pages.clear()
+    log(f"Loaded {len(index)} embeddings (snapshot v{snapshot.version}, {VECTOR_STORAGE}: {index.nbytes / 2**20:.1f} MB)")
+    if duplicates is not None:
+        log(f"Collapsing {len(duplicates)} near-duplicate images in results")
 
 
 def embedding_refresh_loop():
@@ -203,7 +344,10 @@ def embedding_refresh_loop():
         try:
             if image_dir and image_dir.exists():
                 log(f"Starting embedding refresh for {image_dir}...")
-                sync_embeddings(image_dir, log_fn=log, exclude_dirs=exclude_dirs)
+                sync_embeddings(
+                    image_dir, log_fn=log, exclude_dirs=exclude_dirs,
+                    hnsw=BUILD_HNSW, lance_index=VECTOR_STORAGE == "lance",
+                )
                 reload_embeddings()
             else:
                 log(f"Image directory not set or doesn't exist: {image_dir}")
@@ -218,7 +362,7 @@ def embedding_refresh_loop():
 
 def startup_task():
     """Background task to download model and load embeddings."""
-    global model, tokenizer, embeddings_df, image_dir, model_loading
+    global model, tokenizer, img_processor, text_cache, image_dir, model_loading
 
     model_loading = True
 
@@ -229,15 +373,12 @@ def startup_task():
         return
 
     log("Loading CLIP model...")
-    model, tokenizer, _ = load_model()
+    text_cache = TextEmbeddingCache(model_identity(), text_cache_path(DB_PATH))
+    model, tokenizer, img_processor = load_model()
     model_loading = False
 
     log("Loading embeddings...")
-    if Path(DB_PATH).exists():
-        embeddings_df = daft.read_lance(DB_PATH).collect()
-        log(f"Loaded {len(embeddings_df)} embeddings")
-    else:
-        log("No embeddings found.")
+    reload_embeddings()
 
     # Start background embedding refresh thread
     if image_dir:
@@ -0,0 +1,126 @@
+"""Cursor-based pagination over cached rankings.
+
+The first page of a search ranks a few pages ahead and caches the ranking
+per (query, nprobe, filters, index version). Follow-up pages pass the opaque
+cursor from the previous response and are served by slicing the cached
+ranking, without re-embedding the query or rescanning the index. Rankings are
+extended on demand when paging past their end, evicted least-recently-used,
+and dropped whenever new embeddings are published.
+"""
+
+import base64
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+from composite import CompositeQuery
+from filters import SearchFilter
+from text_cache import normalize_query
+
+# Rankings kept in memory
+PAGE_CACHE_ENTRIES = 256
+
+# Rank this many times the requested results, so the next pages are cached
+_DEPTH_FACTOR = 4
+
+# Smallest ranking computed per query
+_MIN_DEPTH = 100
+
+
+class CursorError(ValueError):
+    """A cursor that is malformed or refers to embeddings that were replaced."""
+
+
+def encode_cursor(query: str | CompositeQuery, nprobe: int | None, version: int, offset: int, filters: SearchFilter | None = None) -> str:
+    """Opaque cursor for the page of `query` results starting at `offset`."""
+    data = {"q": query.to_dict() if isinstance(query, CompositeQuery) else query, "n": nprobe, "v": version, "o": offset}
+    if filters is not None:
+        data["f"] = filters.to_dict()
+    payload = json.dumps(data, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[str | CompositeQuery, int | None, int, int, SearchFilter | None]:
+    """Return (query, nprobe, version, offset, filters) from a cursor."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        query = CompositeQuery.from_dict(data["q"]) if isinstance(data["q"], dict) else str(data["q"])
+        return query, data["n"], int(data["v"]), int(data["o"]), SearchFilter.from_dict(data.get("f"))
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise CursorError("Invalid cursor") from e
+
+
+def ranking_depth(end: int) -> int:
+    """How many results to rank when a page ending at `end` is not cached."""
+    return max(_MIN_DEPTH, _DEPTH_FACTOR * end)
+
+
+class ResultPages:
+    """Bounded LRU cache of ranked (path, score) lists keyed on query and index version."""
+
+    def __init__(self, max_entries: int = PAGE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, tuple[list, bool]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def key(query: str | CompositeQuery, nprobe: int | None, version: int, filters: SearchFilter | None = None) -> tuple:
+        # Composite queries are normalized when built
+        return (query if isinstance(query, CompositeQuery) else normalize_query(query), nprobe, version, filters)
+
+    def lookup(self, key: tuple, end: int) -> tuple[list, bool] | None:
+        """Cached (ranking, exhausted) if it covers results up to `end` (or holds every result)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (len(entry[0]) < end and not entry[1]):
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def store(self, key: tuple, ranking: list, depth: int) -> tuple[list, bool]:
+        """Cache a ranking computed with `depth` results requested."""
+        entry = (ranking, len(ranking) < depth)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def page(self, search: Callable[[int], list], query: str | CompositeQuery, nprobe: int | None, version: int, offset: int, limit: int, filters: SearchFilter | None = None) -> tuple[list, str | None]:
+        """Return one page of results and the cursor for the next one (None on the last page).
+
+        Args:
+            search: Returns the top `depth` (path, score) pairs for the query;
+                only called when the cached ranking does not cover the page
+            query: Query text or composite query
+            nprobe: Search parameter that is part of the cache key
+            version: Version of the index being searched
+            offset: Rank of the first result on the page
+            limit: Results per page
+            filters: Search filter that is part of the cache key
+        """
+        key = self.key(query, nprobe, version, filters)
+        end = offset + limit
+        entry = self.lookup(key, end)
+        if entry is None:
+            depth = ranking_depth(end)
+            entry = self.store(key, search(depth), depth)
+        return slice_page(entry, query, nprobe, version, offset, limit, filters)
+
+    def clear(self):
+        """Drop all rankings (call when new embeddings are published)."""
+        with self._lock:
+            self._entries.clear()
+
+
+def slice_page(entry: tuple[list, bool], query: str | CompositeQuery, nprobe: int | None, version: int, offset: int, limit: int, filters: SearchFilter | None = None) -> tuple[list, str | None]:
+    """One page of a cached (ranking, exhausted) entry plus the next cursor."""
+    ranking, exhausted = entry
+    end = offset + limit
+    more = len(ranking) > end or not exhausted
+    return ranking[offset:end], encode_cursor(query, nprobe, version, end, filters) if more else None
@@ -0,0 +1,281 @@
+"""Pipelined image embedding: read, decode, batch assembly, model and Arrow stages.
+
+Each stage runs on its own thread(s) and hands work to the next one through
+a bounded queue, so the files of the next batches are read, decoded and
+packed while the model encodes the current batch. Raw file bytes, which
+can be many megabytes per photo, are only read a few files ahead of the
+decoders; decoded images (already resized and cropped) are buffered for
+QUEUE_BATCHES batches. The model runs on the calling thread (MLX work stays on
+one thread). Every stage counts the time it spends working; utilization
+(busy time over wall time, per thread) shows which stage is the
+bottleneck.
+"""
+
+import io
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+from PIL import Image
+
+from core import DECODE_WORKERS, EMBEDDING_DIM, load_image
+
+# Images per model forward pass
+EMBED_BATCH_SIZE = 64
+
+# Threads reading files
+READ_WORKERS = 2
+
+# Batches buffered between stages (also the number of pixel buffers in flight)
+QUEUE_BATCHES = 2
+
+# Files held in memory between reading and decoding (at least one per decoder)
+READ_AHEAD_FILES = 16
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """Another stage failed; unwind this one."""
+
+
+@dataclass
+class StageStats:
+    """Work counters of one pipeline stage.
+
+    Attributes:
+        name: Stage name
+        threads: Threads running the stage
+        items: Images (or batches, for batch stages) processed
+        busy: Seconds spent working, summed over threads
+    """
+
+    name: str
+    threads: int = 1
+    items: int = 0
+    busy: float = 0.0
+
+    def utilization(self, elapsed: float) -> float:
+        """Fraction of the stage's thread time spent working."""
+        return self.busy / (elapsed * self.threads) if elapsed > 0 else 0.0
+
+
+class EmbeddingPipeline:
+    """Embeds image files through overlapping read/decode/assemble/model/Arrow stages.
+
+    Args:
+        model: CLIP model (run on the thread calling run())
+        img_processor: CLIPImageProcessor of the model
+        batch_size: Images per model forward pass
+        decode_workers: Threads decoding, resizing and cropping images
+        read_workers: Threads reading files
+        queue_batches: Batches buffered between stages
+        read_ahead: Files read but not yet decoded at most (raw bytes)
+    """
+
+    def __init__(
+        self,
+        model,
+        img_processor,
+        batch_size: int = EMBED_BATCH_SIZE,
+        decode_workers: int = DECODE_WORKERS,
+        read_workers: int = READ_WORKERS,
+        queue_batches: int = QUEUE_BATCHES,
+        read_ahead: int = READ_AHEAD_FILES,
+    ):
+        self.model = model
+        self.img_processor = img_processor
+        self.batch_size = max(1, batch_size)
+        self.decode_workers = max(1, decode_workers)
+        self.read_workers = max(1, read_workers)
+        self.queue_batches = max(1, queue_batches)
+        self.read_ahead = max(self.decode_workers, read_ahead)
+        self.elapsed = 0.0
+        self.stats: dict[str, StageStats] = {}
+
+    def run(self, paths: list[str], mtimes: list[float]) -> pa.Table:
+        """Embed image files; returns a (path, mtime, vector) table in input order.
+
+        Images that cannot be read get a zero vector, like EmbedImages.
+        """
+        self.stats = {
+            "read": StageStats("read", self.read_workers),
+            "decode": StageStats("decode", self.decode_workers),
+            "assemble": StageStats("assemble"),
+            "model": StageStats("model"),
+            "arrow": StageStats("arrow"),
+        }
+        self._stop = threading.Event()
+        self._error: BaseException | None = None
+        depth = self.batch_size * self.queue_batches
+        self._jobs = iter(enumerate(paths))
+        self._jobs_lock = threading.Lock()
+        self._read_queue: queue.Queue = queue.Queue(self.read_ahead)
+        self._decode_queue: queue.Queue = queue.Queue(depth)
+        self._model_queue: queue.Queue = queue.Queue(self.queue_batches)
+        self._arrow_queue: queue.Queue = queue.Queue(self.queue_batches)
+        # Pixel buffers cycle between batch assembly and the model
+        self._free_buffers: queue.Queue = queue.Queue()
+        for _ in range(self.queue_batches + 1):
+            self._free_buffers.put(self.img_processor.allocate(self.batch_size))
+        self._remaining = {"read": self.read_workers, "decode": self.decode_workers}
+        self._batches: list[pa.RecordBatch] = []
+
+        threads = (
+            [threading.Thread(target=self._guard, args=(self._read,), name=f"embed-read-{i}") for i in range(self.read_workers)]
+            + [threading.Thread(target=self._guard, args=(self._decode,), name=f"embed-decode-{i}") for i in range(self.decode_workers)]
+            + [threading.Thread(target=self._guard, args=(self._assemble, len(paths)), name="embed-assemble")]
+            + [threading.Thread(target=self._guard, args=(self._to_arrow, paths, mtimes), name="embed-arrow")]
+        )
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        self._guard(self._encode)
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+        if self._error is not None:
+            raise self._error
+
+        schema = pa.schema([("path", pa.string()), ("mtime", pa.float64()), ("vector", pa.list_(pa.float32(), EMBEDDING_DIM))])
+        return pa.Table.from_batches(self._batches, schema=schema)
+
+    def report(self) -> str:
+        """One line of per-stage utilization, naming the busiest stage."""
+        parts = []
+        for stats in self.stats.values():
+            threads = f" x{stats.threads}" if stats.threads > 1 else ""
+            parts.append(f"{stats.name} {stats.utilization(self.elapsed):.0%}{threads}")
+        bottleneck = max(self.stats.values(), key=lambda s: s.utilization(self.elapsed))
+        return f"Pipeline utilization: {' | '.join(parts)} (bottleneck: {bottleneck.name})"
+
+    def _guard(self, stage, *args):
+        try:
+            stage(*args)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+
+    def _put(self, q: queue.Queue, item):
+        while True:
+            try:
+                return q.put(item, timeout=0.1)
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _get(self, q: queue.Queue):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _finish(self, stage: str, q: queue.Queue, markers: int, busy: float, items: int):
+        """Add a thread's counters, and pass `markers` end marks downstream once
+        the last thread of `stage` is done."""
+        with self._jobs_lock:
+            self.stats[stage].busy += busy
+            self.stats[stage].items += items
+            self._remaining[stage] -= 1
+            last = self._remaining[stage] == 0
+        if last:
+            for _ in range(markers):
+                self._put(q, _DONE)
+
+    def _read(self):
+        busy, items = 0.0, 0
+        while True:
+            with self._jobs_lock:
+                job = next(self._jobs, None)
+            if job is None:
+                break
+            i, path = job
+            start = time.perf_counter()
+            try:
+                data = Path(path).read_bytes()
+            except OSError as e:
+                print(f"Warning: Failed to load {path}: {e}")
+                data = None
+            busy += time.perf_counter() - start
+            items += 1
+            self._put(self._read_queue, (i, path, data))
+        self._finish("read", self._read_queue, self.decode_workers, busy, items)
+
+    def _decode(self):
+        busy, items = 0.0, 0
+        while (item := self._get(self._read_queue)) is not _DONE:
+            i, path, data = item
+            start = time.perf_counter()
+            image = None
+            if data is not None:
+                try:
+                    image = load_image(io.BytesIO(data), self.img_processor)
+                except Exception as e:
+                    print(f"Warning: Failed to load {path}: {e}")
+            busy += time.perf_counter() - start
+            items += 1
+            self._put(self._decode_queue, (i, image))
+        self._finish("decode", self._decode_queue, 1, busy, items)
+
+    def _assemble(self, total: int):
+        """Restore input order and pack full batches into free pixel buffers."""
+        stats = self.stats["assemble"]
+        pending: dict[int, object] = {}
+        placeholder = None
+        for start in range(0, total, self.batch_size):
+            end = min(start + self.batch_size, total)
+            while any(i not in pending for i in range(start, end)):
+                item = self._get(self._decode_queue)
+                if item is _DONE:
+                    raise RuntimeError("Decode stage ended early")
+                pending[item[0]] = item[1]
+            buffer = self._get(self._free_buffers)
+            began = time.perf_counter()
+            images = [pending.pop(i) for i in range(start, end)]
+            failed = np.array([image is None for image in images], dtype=bool)
+            if failed.any() and placeholder is None:
+                placeholder = Image.new("RGB", (self.img_processor.crop_size,) * 2)
+            pixels = self.img_processor.pack([placeholder if image is None else image for image in images], buffer)
+            stats.busy += time.perf_counter() - began
+            stats.items += 1
+            self._put(self._model_queue, (start, pixels, failed, buffer))
+        self._put(self._model_queue, _DONE)
+
+    def _encode(self):
+        stats = self.stats["model"]
+        while (item := self._get(self._model_queue)) is not _DONE:
+            start, pixels, failed, buffer = item
+            began = time.perf_counter()
+            pixel_values = self.img_processor.from_pixels(pixels)
+            self._free_buffers.put(buffer)
+            output = self.model(pixel_values=pixel_values)
+            embeddings = np.array(output.image_embeds, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+            embeddings[failed] = 0.0
+            stats.busy += time.perf_counter() - began
+            stats.items += 1
+            self._put(self._arrow_queue, (start, embeddings))
+        self._put(self._arrow_queue, _DONE)
+
+    def _to_arrow(self, paths: list[str], mtimes: list[float]):
+        stats = self.stats["arrow"]
+        while (item := self._get(self._arrow_queue)) is not _DONE:
+            start, embeddings = item
+            began = time.perf_counter()
+            end = start + len(embeddings)
+            vectors = pa.FixedSizeListArray.from_arrays(pa.array(embeddings.reshape(-1), pa.float32()), EMBEDDING_DIM)
+            self._batches.append(pa.record_batch(
+                [pa.array(paths[start:end], pa.string()), pa.array(mtimes[start:end], pa.float64()), vectors],
+                names=["path", "mtime", "vector"],
+            ))
+            stats.busy += time.perf_counter() - began
+            stats.items += 1
@@ -0,0 +1,198 @@
+"""Compressed vector storage with exact re-ranking.
+
+First-pass scores are computed on quantized codes (int8 scalar, product
+quantization or binary sign codes). Only the best few hundred candidates are
+rescored against full-precision vectors, which are fetched on demand (from
+Lance in the servers), so the float32 matrix never has to be resident.
+"""
+
+from typing import Callable
+
+import numpy as np
+
+from core import EMBEDDING_DIM
+
+# Candidates rescored with full-precision vectors per query
+DEFAULT_RERANK = 256
+
+# Binary codes are a coarser filter, so more candidates are rescored
+BINARY_RERANK = 1000
+
+# uint64 words per binary sign code (512 bits = 64 bytes)
+BITS_WORDS = EMBEDDING_DIM // 64
+
+# Rows per block when scoring codes (keeps float32 temporaries in cache)
+_SCORE_BLOCK = 4096
+
+
+class ScalarQuantizer:
+    """Per-dimension 8-bit scalar quantization (1 byte per dimension).
+
+    Each dimension is mapped linearly from its [min, max] range onto 0..255,
+    so x ~= low + scale * code and q . x ~= q . low + (q * scale) . code.
+    """
+
+    name = "int8"
+
+    def __init__(self, low: np.ndarray, scale: np.ndarray):
+        self.low = low
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray) -> "ScalarQuantizer":
+        low = vectors.min(axis=0)
+        scale = (vectors.max(axis=0) - low) / 255.0
+        return cls(low.astype(np.float32), np.maximum(scale, 1e-12).astype(np.float32))
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint((vectors - self.low) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.low + codes.astype(np.float32) * self.scale
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate inner products of a query with encoded vectors."""
+        offset = float(query @ self.low)
+        weights = query * self.scale
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK):
+            block = codes[start:start + _SCORE_BLOCK]
+            out[start:start + len(block)] = block.astype(np.float32) @ weights + offset
+        return out
+
+
+class ProductQuantizer:
+    """Product quantization: one byte per subspace of EMBEDDING_DIM / n_subspaces dims.
+
+    Each subvector is replaced by the id of its nearest of 256 k-means
+    centroids. Queries are scored with a per-subspace lookup table.
+    """
+
+    name = "pq"
+
+    def __init__(self, codebooks: np.ndarray):
+        self.codebooks = codebooks  # (n_subspaces, n_centroids <= 256, sub_dim)
+
+    @property
+    def n_subspaces(self) -> int:
+        return len(self.codebooks)
+
+    @classmethod
+    def fit(cls, vectors: np.ndarray, n_subspaces: int = 64, n_iter: int = 10, seed: int = 0) -> "ProductQuantizer":
+        rng = np.random.default_rng(seed)
+        sub_dim = EMBEDDING_DIM // n_subspaces
+        n_centroids = min(256, len(vectors))
+        codebooks = np.zeros((n_subspaces, n_centroids, sub_dim), dtype=np.float32)
+        for j in range(n_subspaces):
+            sub = vectors[:, j * sub_dim:(j + 1) * sub_dim]
+            centroids = sub[rng.choice(len(sub), n_centroids, replace=False)].copy()
+            for _ in range(n_iter):
+                labels = _nearest(sub, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, labels, sub)
+                counts = np.bincount(labels, minlength=n_centroids)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks[j] = centroids
+        return cls(codebooks)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        sub_dim = EMBEDDING_DIM // self.n_subspaces
+        codes = np.empty((len(vectors), self.n_subspaces), dtype=np.uint8)
+        for j in range(self.n_subspaces):
+            codes[:, j] = _nearest(vectors[:, j * sub_dim:(j + 1) * sub_dim], self.codebooks[j])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.n_subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        """Approximate inner products via a (n_subspaces, n_centroids) lookup table."""
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.n_subspaces, -1))
+        out = np.zeros(len(codes), dtype=np.float32)
+        for j in range(self.n_subspaces):
+            out += table[j][codes[:, j]]
+        return out
+
+
+def sign_bits(vectors: np.ndarray) -> np.ndarray:
+    """Pack the sign of each dimension into (N, 8) uint64 codes, 64 bytes per vector."""
+    bits = np.packbits(np.asarray(vectors).reshape(-1, EMBEDDING_DIM) > 0, axis=1)
+    return np.ascontiguousarray(bits).view(np.uint64)
+
+
+class BinaryQuantizer:
+    """512-bit sign codes scored by Hamming distance.
+
+    Scores are the number of matching sign bits (EMBEDDING_DIM minus the
+    Hamming distance), computed with a vectorized popcount over XORed words.
+    Needs no training, so codes can be materialized once when embeddings are
+    written (the `bits` column).
+    """
+
+    name = "binary"
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return sign_bits(vectors)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        query_bits = sign_bits(query)[0]
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), _SCORE_BLOCK):
+            block = codes[start:start + _SCORE_BLOCK]
+            distance = np.bitwise_count(block ^ query_bits).sum(axis=1, dtype=np.int32)
+            out[start:start + len(block)] = EMBEDDING_DIM - distance
+        return out
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the nearest centroid (L2) for each vector."""
+    labels = np.empty(len(vectors), dtype=np.int64)
+    sq_norms = (centroids ** 2).sum(axis=1)
+    for start in range(0, len(vectors), _SCORE_BLOCK):
+        block = vectors[start:start + _SCORE_BLOCK]
+        labels[start:start + len(block)] = np.argmin(sq_norms - 2 * block @ centroids.T, axis=1)
+    return labels
+
+
+class QuantizedVectors:
+    """Quantized codes plus a callback that fetches full-precision vectors.
+
+    Attributes:
+        quantizer: ScalarQuantizer, ProductQuantizer or BinaryQuantizer used for the codes
+        codes: (N, code_size) uint8 codes (uint64 words for binary), one row per index row
+        fetch: Returns unit-length float32 vectors for an array of row ids
+    """
+
+    def __init__(self, quantizer, codes: np.ndarray, fetch: Callable[[np.ndarray], np.ndarray]):
+        self.quantizer = quantizer
+        self.codes = codes
+        self.fetch = fetch
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+    def coarse_scores(self, query: np.ndarray, rows: np.ndarray | None = None) -> np.ndarray:
+        """Approximate scores for all rows (or just `rows`)."""
+        codes = self.codes if rows is None else self.codes[rows]
+        return self.quantizer.scores(codes, query)
+
+    def rerank(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Exact cosine scores for candidate rows from full-precision vectors."""
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.float32)
+        return self.fetch(rows) @ query
+
+
+def make_quantizer(kind: str, sample: np.ndarray):
+    """Fit a quantizer of the given kind ("int8", "pq" or "binary") on sample vectors."""
+    if kind == ScalarQuantizer.name:
+        return ScalarQuantizer.fit(sample)
+    if kind == ProductQuantizer.name:
+        return ProductQuantizer.fit(sample)
+    if kind == BinaryQuantizer.name:
+        return BinaryQuantizer()
+    raise ValueError(f"Unknown vector storage: {kind} (expected 'float32', 'int8', 'pq' or 'binary')")
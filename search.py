@@ -2,28 +2,59 @@
 """CLI tool to search images via the server."""
 
 import argparse
+import json
 import sys
 
 import requests
 
 
+def parse_term(value: str) -> tuple[str, float]:
+    """PHRASE=WEIGHT, e.g. "people=-0.5"."""
+    phrase, _, weight = value.rpartition("=")
+    try:
+        return phrase, float(weight)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected PHRASE=WEIGHT, got {value!r}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Search for images")
     parser.add_argument("query", help="Search query")
+    parser.add_argument(
+        "-t", "--term", type=parse_term, action="append", default=[],
+        help="Extra phrase with a weight, negative to exclude (e.g. -t people=-0.5); repeatable",
+    )
     parser.add_argument("-n", "--limit", type=int, default=5, help="Number of results")
+    parser.add_argument("--stream", action="store_true", help="Print results as the server streams them (for large -n)")
     parser.add_argument("--url", default="http://127.0.0.1:8000", help="Server URL")
     args = parser.parse_args()
 
     try:
         response = requests.post(
-            f"{args.url}/search",
-            json={"query": args.query, "limit": args.limit},
+            f"{args.url}/search/stream" if args.stream else f"{args.url}/search",
+            json={"query": args.query, "terms": dict(args.term) or None, "limit": args.limit},
             timeout=10,
+            stream=args.stream,
         )
-        response.raise_for_status()
     except requests.exceptions.ConnectionError:
         print("Error: Server not running. Start with: uv run python server.py")
         sys.exit(1)
+    if response.status_code == 400:
+        print(f"Error: {response.json()['detail']}")
+        sys.exit(1)
+    response.raise_for_status()
+
+    if args.stream:
+        print(f"Found {response.headers.get('X-Total-Images', '?')} images, streaming top {args.limit}:\n")
+        count = 0
+        for line in response.iter_lines():
+            if line:
+                count += 1
+                r = json.loads(line)
+                print(f"{count}. [{r['score']:.3f}] {r['path']}", flush=True)
+        if not count:
+            print("No results found.")
+        return
 
     data = response.json()
     results = data["results"]
@@ -1,25 +1,56 @@
 """FastAPI server for image search."""
 
+import asyncio
+import json
+import os
 from pathlib import Path
 
-import daft
-import numpy as np
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 
-from core import load_model, embed_text, cosine_similarity, DB_PATH
+from batcher import DEFAULT_MAX_BATCH, DEFAULT_MAX_WAIT_MS, SearchBatcher
+from composite import CompositeQuery, embed_query, query_text
+from core import load_model, embed_image, embed_texts, DB_PATH, MAX_TEXT_BATCH
+from duplicates import DuplicateGroups
+from filters import SearchFilter
+from index import find_similar, lance_version, load_index, stream_search
+from lexical import LexicalIndex, lexical_path
+from pagination import CursorError, ResultPages, decode_cursor, ranking_depth, slice_page
+from text_cache import TextEmbeddingCache, model_identity, text_cache_path
 
 app = FastAPI(title="Local Image Search")
 
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "float32")  # float32, int8, pq, binary or lance
+SEARCH_METHOD = os.environ.get("SEARCH_METHOD") or None  # exact, ivf or hnsw (default: HNSW if built, else IVF if built, else exact)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", DEFAULT_MAX_BATCH))  # queries per forward pass
+BATCH_WAIT_MS = float(os.environ.get("BATCH_WAIT_MS", DEFAULT_MAX_WAIT_MS))  # wait for more queries
+COLLAPSE_DUPLICATES = os.environ.get("COLLAPSE_DUPLICATES", "1") == "1"  # use dedupe.py groups
+HYBRID_SEARCH = os.environ.get("HYBRID_SEARCH", "1") == "1"  # fuse path-token matches into results
+
 # Global state - loaded on startup
 model = None
 tokenizer = None
-embeddings_df = None
+img_processor = None
+text_cache = None  # TextEmbeddingCache for query embeddings
+batcher = None  # SearchBatcher running the text encoder and scoring off the event loop
+index = None  # SearchIndex over all stored embeddings
+index_version = 0  # Lance DB version the index was loaded from
+duplicates = None  # DuplicateGroups from dedupe.py, collapsed in results
+lexical = None  # LexicalIndex over image paths for hybrid search
+result_pages = ResultPages()  # cached rankings behind pagination cursors
 
 
 class SearchRequest(BaseModel):
-    query: str
+    query: str = ""
+    terms: dict[str, float] | None = None  # extra weighted phrases, e.g. {"people": -0.5}
     limit: int = 10
+    nprobe: int | None = None  # IVF lists to scan (None: default, 0: exact search)
+    cursor: str | None = None  # next_cursor of the previous page (replaces query, nprobe and filters)
+    path_prefix: str | None = None  # only images under this directory
+    extensions: list[str] | None = None  # only these file extensions, e.g. ["jpg", "png"]
+    modified_after: float | str | None = None  # Unix seconds or ISO date, inclusive
+    modified_before: float | str | None = None  # Unix seconds or ISO date, exclusive
 
 
 class SearchResult(BaseModel):
@@ -30,66 +61,180 @@ class SearchResult(BaseModel):
 class SearchResponse(BaseModel):
     results: list[SearchResult]
     total_images: int
+    next_cursor: str | None = None  # pass as `cursor` to get the next page
+
+
+class SimilarSearchRequest(BaseModel):
+    path: str  # image file; indexed images reuse their stored vector
+    limit: int = 10
+
+
+class BatchSearchRequest(BaseModel):
+    queries: list[str] = Field(max_length=MAX_TEXT_BATCH)
+    limit: int = 10
+    nprobe: int | None = None
+
+
+class BatchSearchResponse(BaseModel):
+    results: list[list[SearchResult]]  # one list per query, in request order
+    total_images: int
 
 
 @app.on_event("startup")
 async def startup():
     """Load model and embeddings on startup."""
-    global model, tokenizer, embeddings_df
+    global model, tokenizer, img_processor, text_cache, batcher, index, index_version, duplicates, lexical
 
     print("Loading CLIP model...")
-    model, tokenizer, _ = load_model()
+    model, tokenizer, img_processor = load_model()
+    text_cache = TextEmbeddingCache(model_identity(), text_cache_path(DB_PATH))
+    batcher = SearchBatcher(
+        lambda queries: embed_texts(model, tokenizer, queries, cache=text_cache),
+        max_batch=BATCH_MAX_SIZE,
+        max_wait_ms=BATCH_WAIT_MS,
+    )
 
     print("Loading embeddings...")
     if Path(DB_PATH).exists():
-        embeddings_df = daft.read_lance(DB_PATH).collect()
-        print(f"Loaded {len(embeddings_df)} embeddings")
+        index_version = lance_version(DB_PATH)
+        index = load_index(DB_PATH, version=index_version, storage=VECTOR_STORAGE, method=SEARCH_METHOD)
+        print(f"Loaded {len(index)} embeddings")
+        duplicates = DuplicateGroups.load(DB_PATH) if COLLAPSE_DUPLICATES else None
+        if duplicates is not None:
+            print(f"Collapsing {len(duplicates)} near-duplicate images in results")
+        if HYBRID_SEARCH and lexical_path(DB_PATH).exists():
+            lexical = LexicalIndex.load(lexical_path(DB_PATH))
+            print(f"Hybrid search over {len(lexical)} paths")
     else:
         print("No embeddings found. Run embed.py first.")
-        embeddings_df = None
+        index = None
 
 
 @app.get("/health")
 async def health():
     """Health check."""
-    return {"status": "ok", "embeddings_loaded": embeddings_df is not None}
+    return {
+        "status": "ok",
+        "embeddings_loaded": index is not None,
+        "text_cache": text_cache.stats() if text_cache is not None else None,
+        "batcher": batcher.stats() if batcher is not None else None,
+    }
+
+
+async def ranked(query: str | CompositeQuery, depth: int, nprobe: int | None, filters: SearchFilter | None) -> list[tuple[str, float]]:
+    """Top `depth` results, with near-duplicates collapsed (searching deeper as needed)."""
+    searched = depth
+    while True:
+        # Concurrent searches are embedded and scored together on the batcher thread
+        ranking = await asyncio.wrap_future(batcher.submit(index, query, searched, nprobe, filters, lexical))
+        if duplicates is None:
+            return ranking
+        collapsed = duplicates.collapse_ranking(ranking, depth, searched)
+        if collapsed is not None:
+            return collapsed
+        searched *= 2
+
+
+def parse_search(request: SearchRequest) -> tuple[str | CompositeQuery, SearchFilter | None]:
+    """Query and filters of a request (HTTP 400 if invalid)."""
+    try:
+        query = CompositeQuery.from_params(request.query, request.terms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid query: {e}")
+    try:
+        filters = SearchFilter.from_params(request.path_prefix, request.extensions, request.modified_after, request.modified_before)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filter: {e}")
+    return query, filters
 
 
 @app.post("/search", response_model=SearchResponse)
 async def search(request: SearchRequest):
     """Search for images matching the query."""
-    if embeddings_df is None:
+    if index is None:
+        return SearchResponse(results=[], total_images=0)
+
+    if request.cursor:
+        try:
+            query, nprobe, version, offset, filters = decode_cursor(request.cursor)
+        except CursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if version != index_version:
+            raise HTTPException(status_code=410, detail="Embeddings were reloaded since this cursor was issued; search again")
+    else:
+        nprobe, offset = request.nprobe, 0
+        query, filters = parse_search(request)
+
+    # Follow-up pages are sliced from the cached ranking
+    key = result_pages.key(query, nprobe, index_version, filters)
+    entry = result_pages.lookup(key, offset + request.limit)
+    if entry is None:
+        depth = ranking_depth(offset + request.limit)
+        entry = result_pages.store(key, await ranked(query, depth, nprobe, filters), depth)
+    matches, next_cursor = slice_page(entry, query, nprobe, index_version, offset, request.limit, filters)
+
+    results = [SearchResult(path=path, score=score) for path, score in matches]
+    return SearchResponse(results=results, total_images=len(index), next_cursor=next_cursor)
+
+
+@app.post("/search/stream")
+async def search_stream(request: SearchRequest):
+    """Stream results as NDJSON, one {"path", "score"} object per line, best first.
+
+    Results are sent in chunks as they are selected, so the first ones
+    arrive without waiting for the whole `limit` to be ranked and
+    serialized. Cursors are not supported; ask for the whole range at once.
+    """
+    if request.cursor:
+        raise HTTPException(status_code=400, detail="Cursors are not supported for streamed searches")
+    query, filters = parse_search(request)
+    if index is None:
+        return StreamingResponse(iter(()), media_type="application/x-ndjson", headers={"X-Total-Images": "0"})
+
+    # Embed on the batcher thread, which owns the model; the ranking streams from a worker thread
+    embedding = await asyncio.wrap_future(batcher.call(
+        embed_query, lambda texts: embed_texts(model, tokenizer, texts, cache=text_cache), query,
+    ))
+    chunks = stream_search(index, lexical, query_text(query), embedding, request.limit, request.nprobe, filters, duplicates)
+    lines = (
+        "".join(json.dumps({"path": path, "score": score}) + "\n" for path, score in chunk)
+        for chunk in chunks
+    )
+    return StreamingResponse(lines, media_type="application/x-ndjson", headers={"X-Total-Images": str(len(index))})
+
+
+@app.post("/search/similar", response_model=SearchResponse)
+async def search_similar(request: SimilarSearchRequest):
+    """Search for images similar to an image (the image itself is excluded)."""
+    if index is None:
         return SearchResponse(results=[], total_images=0)
 
-    # Embed the query text
-    query_embedding = embed_text(model, tokenizer, request.query)
+    path = os.path.expanduser(request.path)
+    try:
+        # Unindexed images are embedded on the batcher thread, which owns the model
+        matches = await asyncio.wrap_future(batcher.call(
+            lambda: find_similar(index, path, request.limit, lambda p: embed_image(model, img_processor, p), duplicates=duplicates),
+        ))
+    except OSError as e:
+        raise HTTPException(status_code=404, detail=f"Cannot read image {path}: {e}")
 
-    # Get all embeddings and paths
-    data = embeddings_df.to_pydict()
-    paths = data["path"]
-    vectors = data["vector"]
+    results = [SearchResult(path=p, score=score) for p, score in matches]
+    return SearchResponse(results=results, total_images=len(index))
 
-    # Compute similarities
-    scores = []
-    for i, vec in enumerate(vectors):
-        vec_array = np.array(vec, dtype=np.float32)
-        # Skip zero vectors (failed images)
-        if np.allclose(vec_array, 0):
-            scores.append(-1.0)
-        else:
-            scores.append(cosine_similarity(query_embedding, vec_array))
 
-    # Sort by score descending
-    ranked = sorted(zip(paths, scores), key=lambda x: x[1], reverse=True)
+@app.post("/search/batch", response_model=BatchSearchResponse)
+async def search_batch(request: BatchSearchRequest):
+    """Search for several queries at once (encoded and scored in shared batches)."""
+    if index is None:
+        return BatchSearchResponse(results=[[] for _ in request.queries], total_images=0)
 
-    # Return top results
+    futures = [batcher.submit(index, query, request.limit, request.nprobe, lexical=lexical) for query in request.queries]
     results = [
-        SearchResult(path=path, score=score)
-        for path, score in ranked[:request.limit]
-        if score > 0  # exclude failed images
+        [SearchResult(path=path, score=score) for path, score in matches]
+        for matches in await asyncio.gather(*(asyncio.wrap_future(f) for f in futures))
     ]
 
-    return SearchResponse(results=results, total_images=len(paths))
+    return BatchSearchResponse(results=results, total_images=len(index))
 
 
 if __name__ == "__main__":
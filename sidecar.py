@@ -0,0 +1,104 @@
+"""Memory-mapped vector sidecar written next to the Lance DB.
+
+A single flat file holds the normalized vectors, the valid mask and the
+image paths of one Lance version, each section page-aligned so it can be
+mapped with np.memmap. Opening it is O(1): no rows are deserialized, the OS
+page cache is shared by every server process mapping the same file, and RSS
+only grows for the pages a search actually touches.
+
+Layout: a 4 KiB JSON header (padded with spaces) followed by the sections
+listed in it as [offset, shape, dtype].
+"""
+
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from core import DB_PATH, EMBEDDING_DIM
+from hnsw import PathTable
+
+FORMAT_VERSION = 1
+
+# Sections start on page boundaries so they map without copying
+_ALIGN = 4096
+
+
+def sidecar_path(db_path: str = DB_PATH) -> Path:
+    """Location of the vector sidecar written next to a Lance DB."""
+    return Path(db_path).with_suffix(".vectors")
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def write_sidecar(path: Path, paths: list[str], matrix: np.ndarray, valid: np.ndarray, db_version: int, dtype: str = "float32"):
+    """Write a sidecar atomically (readers keep mapping the old file until they reopen).
+
+    Args:
+        path: Destination file
+        paths: Image path for each row
+        matrix: (N, 512) unit vectors in Lance row order
+        valid: Boolean mask, False for failed images
+        db_version: Lance DB version the vectors were read from
+        dtype: "float32" or "float16" (half the size, ~1e-3 score error)
+    """
+    table = PathTable.from_list(list(paths))
+    arrays = {
+        "vectors": np.ascontiguousarray(matrix, dtype=dtype).reshape(-1, EMBEDDING_DIM),
+        "valid": np.ascontiguousarray(valid, dtype=np.bool_),
+        "path_offsets": table.offsets,
+        "paths": table.blob,
+    }
+
+    sections, offset = {}, _ALIGN
+    for name, array in arrays.items():
+        sections[name] = [offset, list(array.shape), array.dtype.str]
+        offset = _aligned(offset + array.nbytes)
+    header = json.dumps({"format": FORMAT_VERSION, "db_version": db_version, "sections": sections}).encode()
+    if len(header) > _ALIGN:
+        raise ValueError("Sidecar header too large")
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header.ljust(_ALIGN, b" "))
+        for name, array in arrays.items():
+            f.seek(sections[name][0])
+            f.write(array.tobytes())
+        f.truncate(offset)
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path.replace(path)
+
+
+def stored_dtype(path: Path) -> str | None:
+    """Precision of the vectors in a sidecar ("float32" or "float16"; None if unreadable)."""
+    try:
+        with open(path, "rb") as f:
+            meta = json.loads(f.read(_ALIGN))
+        return np.dtype(meta["sections"]["vectors"][2]).name
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def read_sidecar(path: Path) -> tuple[int, PathTable, np.ndarray, np.ndarray]:
+    """Map a sidecar read-only.
+
+    Returns:
+        (db_version, paths, matrix, valid): matrix and valid are np.memmap views
+    """
+    with open(path, "rb") as f:
+        meta = json.loads(f.read(_ALIGN))
+    if meta["format"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported sidecar format: {meta['format']}")
+
+    def section(name: str) -> np.ndarray:
+        offset, shape, dtype = meta["sections"][name]
+        if 0 in shape:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=tuple(shape))
+
+    paths = PathTable(section("paths"), section("path_offsets"))
+    return meta["db_version"], paths, section("vectors"), section("valid")
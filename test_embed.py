@@ -14,9 +14,9 @@ DB_PATH = Path(__file__).parent / "embeddings.lance"
 POKEMON_DIR = Path(__file__).parent / "data" / "pokemon"
 
 
-def run_embed(directory: str, dry_run: bool = False) -> str:
-    """Run embed.py and return output."""
-    cmd = ["uv", "run", "python", "embed.py", directory]
+def run_embed(directory: str, dry_run: bool = False, *args: str) -> str:
+    """Run embed.py (with extra command-line args) and return output."""
+    cmd = ["uv", "run", "python", "embed.py", directory, *args]
     if dry_run:
         cmd.append("--dry-run")
     result = subprocess.run(cmd, capture_output=True, text=True)
@@ -229,6 +229,289 @@ def test_mixed_changes():
         print("PASSED: Mixed changes handled correctly")
 
 
+def test_lance_index_kept():
+    """Test: Syncs change a table with a Lance vector index in place and keep the index."""
+    print("\n=== Test: Lance Index Kept ===")
+
+    import lance
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+
+        images = sorted(POKEMON_DIR.glob("*.png"))[:302]
+        for img in images[:300]:
+            shutil.copy(img, tmpdir / img.name)
+        output = run_embed(str(tmpdir), False, "--lance-index")
+        print(output)
+        assert "partitions built" in output
+
+        time.sleep(0.1)
+        (tmpdir / images[0].name).unlink()
+        (tmpdir / images[1].name).write_bytes(images[300].read_bytes())
+        shutil.copy(images[301], tmpdir / images[301].name)
+        output = run_embed(str(tmpdir))
+        print(output)
+        assert "partitions updated" in output, "The index should be updated, not rebuilt"
+
+        dataset = lance.dataset(str(DB_PATH))
+        paths = set(dataset.to_table(columns=["path"])["path"].to_pylist())
+        assert len(paths) == dataset.count_rows() == 300
+        assert str(tmpdir / images[0].name) not in paths and str(tmpdir / images[301].name) in paths
+        index = next(i for i in dataset.describe_indices() if "vector" in i.field_names)
+        assert dataset.stats.index_stats(index.name)["num_unindexed_rows"] == 0
+
+        print("PASSED: Lance index kept across syncs")
+
+
+def test_copied_images():
+    """Test: Copies of an image reuse its vector instead of being embedded again."""
+    print("\n=== Test: Copied Images ===")
+    reset_db()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        (tmpdir / "a").mkdir()
+        (tmpdir / "b").mkdir()
+
+        images = sorted(POKEMON_DIR.glob("*.png"))[:4]
+        for img in images[:3]:
+            shutil.copy(img, tmpdir / "a" / img.name)
+            shutil.copy(img, tmpdir / "b" / img.name)
+        output = run_embed(str(tmpdir))
+        print(output)
+        assert "Embedding 3 images" in output, "Only one of each pair of copies should be embedded"
+
+        # A moved file and a new copy reuse the stored vectors
+        (tmpdir / "a" / images[0].name).rename(tmpdir / "moved.png")
+        shutil.copy(images[1], tmpdir / "c.png")
+        shutil.copy(images[3], tmpdir / images[3].name)
+        output = run_embed(str(tmpdir))
+        print(output)
+        assert "Reusing vectors of identical files for 2 images" in output
+        assert "Embedding 1 images" in output
+
+        print("PASSED: Copies reuse stored vectors")
+
+
+def test_fingerprint_cache():
+    """Test: Sampled fingerprints are confirmed by full hashes before a vector is reused."""
+    print("\n=== Test: Fingerprint Cache ===")
+
+    import numpy as np
+    from fingerprint import SAMPLE_BYTES, FingerprintCache, fingerprint_key, is_complete, sampled_fingerprint
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = Path(tmpdir)
+        rng = np.random.default_rng(0)
+        data = rng.integers(0, 256, SAMPLE_BYTES * 8, dtype=np.uint8).tobytes()
+        # Same size and sampled blocks, different bytes between them
+        other = bytearray(data)
+        other[SAMPLE_BYTES + 10] ^= 0xFF
+        files = {"stored.bin": data, "copy.bin": data, "other.bin": bytes(other), "small.bin": b"small", "small2.bin": b"small"}
+        for name, content in files.items():
+            (tmpdir / name).write_bytes(content)
+        paths = {name: str(tmpdir / name) for name in files}
+
+        assert sampled_fingerprint(paths["stored.bin"]) == sampled_fingerprint(paths["other.bin"])
+        assert not is_complete(sampled_fingerprint(paths["stored.bin"])) and is_complete(sampled_fingerprint(paths["small.bin"]))
+
+        # Row 0 is an unchanged stored file, row 1 a deleted file with the same sampled fingerprint
+        stored = [sampled_fingerprint(paths["stored.bin"]), sampled_fingerprint(paths["small.bin"])]
+        cache = FingerprintCache(stored, [paths["stored.bin"], "/gone.bin"], live={paths["stored.bin"]})
+        plan = cache.resolve([paths["copy.bin"], paths["other.bin"], paths["small2.bin"]], workers=2)
+
+        assert plan.reused == {paths["copy.bin"]: 0, paths["small2.bin"]: 1}, f"Got {plan.reused}"
+        assert plan.embed == [paths["other.bin"]], "A sampled collision must be embedded"
+        assert plan.fingerprints[paths["copy.bin"]] == plan.upgraded[paths["stored.bin"]], "Confirmed matches get full hashes"
+        assert plan.fingerprints[paths["other.bin"]] != plan.fingerprints[paths["copy.bin"]]
+        assert fingerprint_key(plan.fingerprints[paths["other.bin"]]) == stored[0]
+
+        vectors = plan.vectors(
+            [paths["copy.bin"], paths["other.bin"], paths["small2.bin"]],
+            np.full((1, 512), 2.0, dtype=np.float32),
+            lambda rows: np.array([[float(r)] * 512 for r in rows], dtype=np.float32),
+        )
+        assert vectors[:, 0].tolist() == [0.0, 2.0, 1.0]
+
+        # Unverifiable rows: a file moved away is reused, a file edited in place is not
+        rows = [sampled_fingerprint(paths["stored.bin"])]
+        plan = FingerprintCache(rows, [str(tmpdir / "moved-away.bin")], live=set()).resolve([paths["copy.bin"]], workers=1)
+        assert plan.reused == {paths["copy.bin"]: 0}, "A moved file should reuse its row"
+        plan = FingerprintCache(rows, [paths["other.bin"]], live=set()).resolve([paths["other.bin"]], workers=1)
+        assert plan.embed == [paths["other.bin"]], "A modified file must not reuse its own old row"
+        plan = FingerprintCache(rows, [paths["stored.bin"]], live=set()).resolve([paths["copy.bin"]], workers=1)
+        assert plan.embed == [paths["copy.bin"]], "A changed file that still exists cannot confirm a match"
+
+    print("PASSED: Fingerprint cache")
+
+
+def test_parallel_decode():
+    """Test: Threaded decoding gives the same embeddings, in order, as serial decoding."""
+    print("\n=== Test: Parallel Decode ===")
+
+    import numpy as np
+    from core import ImageEmbedder, load_model
+
+    model, _, img_processor = load_model()
+    paths = [str(p) for p in sorted(POKEMON_DIR.glob("*.png"))[:12]]
+    paths.insert(5, str(POKEMON_DIR / "missing.png"))
+
+    serial = ImageEmbedder(model, img_processor, workers=1)(paths)
+    embedder = ImageEmbedder(model, img_processor, workers=4)
+    threaded = embedder(paths)
+
+    assert np.allclose(serial, threaded, atol=1e-5), "Threaded embeddings differ"
+    assert not threaded[5].any() and threaded[6].any(), "Failed image should get a zero row in place"
+    stats = embedder.stats()
+    assert stats["images"] == 13 and stats["decode_s"] > 0 and stats["model_s"] > 0
+
+    print(f"PASSED: Parallel decode ({stats['decode_s']:.2f}s decode, {stats['model_s']:.2f}s model)")
+
+
+def test_fast_decode_parity():
+    """Test: Draft/reduce decoding keeps embeddings within a cosine tolerance of full decoding."""
+    print("\n=== Test: Fast Decode Parity ===")
+
+    import numpy as np
+    from PIL import Image
+    from core import load_image, load_model
+
+    model, _, img_processor = load_model()
+
+    def embed(path, fast):
+        return np.array(model(pixel_values=img_processor([load_image(path, img_processor, fast)])).image_embeds[0])
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # Large JPEGs (draft mode) and PNGs (reduce), in both orientations
+        paths = []
+        for i, img in enumerate(sorted(POKEMON_DIR.glob("*.png"))[:6]):
+            image = Image.open(img).convert("RGB")
+            size = (3000, 2000) if i % 2 else (1500, 2200)
+            path = Path(tmpdir) / f"{img.stem}.{'jpg' if i < 4 else 'png'}"
+            image.resize(size, Image.BICUBIC).save(path)
+            paths.append(str(path))
+        paths.append(str(sorted(POKEMON_DIR.glob("*.png"))[0]))
+
+        for path in paths:
+            full, fast = embed(path, False), embed(path, True)
+            cosine = float(full @ fast / (np.linalg.norm(full) * np.linalg.norm(fast)))
+            assert cosine > 0.99, f"{Path(path).name}: cosine {cosine:.4f} to full decode"
+            assert load_image(path, img_processor).size == (224, 224)
+
+    print(f"PASSED: Fast decode parity ({len(paths)} images)")
+
+
+def test_batch_preprocess():
+    """Test: Batched preprocessing through the reused buffer matches per-image preprocessing."""
+    print("\n=== Test: Batch Preprocess ===")
+
+    import mlx.core as mx
+    import numpy as np
+    from PIL import Image
+    from core import load_model
+
+    _, _, img_processor = load_model()
+    images = [Image.open(p).convert("RGB") for p in sorted(POKEMON_DIR.glob("*.png"))[:8]]
+    images.append(Image.new("L", (300, 500), 128))
+
+    expected = mx.concatenate([img_processor._preprocess(image.convert("RGB"))[None] for image in images], axis=0)
+    batch = img_processor(images)
+    assert batch.shape == (9, 224, 224, 3) and np.allclose(np.array(batch), np.array(expected), atol=1e-6)
+
+    buffer = img_processor._buffer
+    smaller = img_processor(images[:3])
+    assert img_processor._buffer is buffer, "Smaller batches should reuse the buffer"
+    assert np.allclose(np.array(smaller), np.array(expected[:3]), atol=1e-6), "Reuse must not alter earlier batches"
+    assert np.allclose(np.array(batch), np.array(expected), atol=1e-6)
+
+    print("PASSED: Batch preprocess")
+
+
+def test_embedding_pipeline():
+    """Test: The staged pipeline returns embeddings in input order, like ImageEmbedder."""
+    print("\n=== Test: Embedding Pipeline ===")
+
+    import numpy as np
+    from core import ImageEmbedder, load_model
+    from pipeline import EmbeddingPipeline
+
+    model, _, img_processor = load_model()
+    paths = [str(p) for p in sorted(POKEMON_DIR.glob("*.png"))[:20]]
+    paths.insert(3, str(POKEMON_DIR / "missing.png"))
+    mtimes = [float(i) for i in range(len(paths))]
+
+    pipeline = EmbeddingPipeline(model, img_processor, batch_size=4, decode_workers=3, queue_batches=1, read_ahead=1)
+    assert pipeline.read_ahead == 3, "Every decoder should have a file to work on"
+    table = pipeline.run(paths, mtimes)
+    assert table.column("path").to_pylist() == paths and table.column("mtime").to_pylist() == mtimes
+    vectors = np.array(table.column("vector").to_pylist(), dtype=np.float32)
+    expected = ImageEmbedder(model, img_processor, workers=1)(paths)
+    assert np.allclose(vectors, expected, atol=1e-5), "Pipeline embeddings differ"
+    assert not vectors[3].any(), "Unreadable image should get a zero vector"
+
+    stats = pipeline.stats
+    assert stats["read"].items == stats["decode"].items == len(paths)
+    assert stats["model"].items == stats["arrow"].items == 6, "21 images in batches of 4"
+    assert "bottleneck" in pipeline.report()
+
+    class FailingModel:
+        def __call__(self, **kwargs):
+            raise RuntimeError("out of memory")
+
+    try:
+        EmbeddingPipeline(FailingModel(), img_processor, batch_size=2).run(paths, mtimes)
+        assert False, "Model errors should reach the caller"
+    except RuntimeError as e:
+        assert "out of memory" in str(e)
+
+    print(f"PASSED: Embedding pipeline ({pipeline.report()})")
+
+
+def test_autotune():
+    """Test: The batch-size probe climbs to the best rate under the memory ceiling and is stored per machine."""
+    print("\n=== Test: Batch Size Autotune ===")
+
+    import numpy as np
+    from autotune import Tuning, estimated_rate, load_tuning, measure_batch, probe, record_sync_rate, save_tuning
+    from core import IMAGES_PER_SECOND, ImageEmbedder, load_model
+
+    rates = {8: 100.0, 16: 180.0, 32: 250.0, 64: 256.0, 128: 240.0, 256: 300.0}
+    probed = []
+
+    def measure(size):
+        probed.append(size)
+        return rates[size], size * 2**20
+
+    tuning = probe(measure, log_fn=lambda _: None)
+    assert tuning.batch_size == 32, f"64 is under 5% faster than 32, got {tuning.batch_size}"
+    assert probed == [8, 16, 32, 64, 128], f"Should stop once a larger batch is slower, probed {probed}"
+    probed.clear()
+    tuning = probe(measure, memory_limit=20 * 2**20, log_fn=lambda _: None)
+    assert tuning.batch_size == 16 and probed == [8, 16, 32], f"Should stop at the memory ceiling, got {tuning}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "embeddings.autotune.json"
+        assert estimated_rate(path) == (IMAGES_PER_SECOND, False)
+        save_tuning(Tuning(32, 250.0, rates={32: 250.0}), path, key="other-machine")
+        assert load_tuning(path) is None, "Tunings of other machines must not be used"
+        save_tuning(tuning, path)
+        loaded = load_tuning(path)
+        assert loaded == tuning and load_tuning(path, key="other-machine").batch_size == 32
+        assert estimated_rate(path) == (180.0, True)
+        record_sync_rate(1000, 8.0, path)
+        assert estimated_rate(path) == (125.0, True), "Dry runs should use the measured sync rate"
+
+    model, _, img_processor = load_model()
+    rate, _ = measure_batch(model, img_processor, 2, repeats=1)
+    assert rate > 0
+    paths = [str(p) for p in sorted(POKEMON_DIR.glob("*.png"))[:10]]
+    whole = ImageEmbedder(model, img_processor, workers=1)(paths)
+    chunked = ImageEmbedder(model, img_processor, workers=1, batch_size=4)(paths)
+    assert chunked.shape == whole.shape and np.allclose(chunked, whole, atol=1e-5)
+
+    print("PASSED: Batch size autotune")
+
+
 def main():
     print("Starting embed.py tests...")
     print(f"Pokemon images: {POKEMON_DIR}")
@@ -245,6 +528,14 @@ def main():
         test_deleted_image,
         test_added_after_initial,
         test_mixed_changes,
+        test_lance_index_kept,
+        test_copied_images,
+        test_fingerprint_cache,
+        test_parallel_decode,
+        test_fast_decode_parity,
+        test_batch_preprocess,
+        test_embedding_pipeline,
+        test_autotune,
     ]
 
     passed = 0
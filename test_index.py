@@ -0,0 +1,922 @@
+#!/usr/bin/env python3
+"""Tests for the search index (index.py) and its helpers."""
+
+import tempfile
+import threading
+from pathlib import Path
+
+import lance
+import numpy as np
+import pyarrow as pa
+
+from batcher import SearchBatcher
+from composite import CompositeQuery, embed_query
+from core import cosine_similarity, EMBEDDING_DIM
+from dedupe import duplicate_groups, find_duplicates, near_duplicate_pairs
+from duplicates import DuplicateGroups, collapsed_search
+from filters import RowMetadata, SearchFilter
+from index import SearchIndex, SnapshotPublisher, find_similar, hybrid_search, load_index, stream_search, top_k, top_k_chunks
+from hnsw import HNSWIndex
+from ivf import IVFIndex
+from lance_index import LanceSearchIndex, create_vector_index
+from lexical import LexicalIndex, fuse, tokenize
+from pagination import CursorError, ResultPages, decode_cursor, encode_cursor
+from quantize import QuantizedVectors, ScalarQuantizer, make_quantizer
+from sidecar import read_sidecar, stored_dtype, write_sidecar
+from text_cache import TextEmbeddingCache
+
+
+def make_vectors(n: int, seed: int = 0) -> tuple[list[str], np.ndarray]:
+    """Random embeddings with paths, like rows read from Lance."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((n, EMBEDDING_DIM)).astype(np.float32)
+    paths = [f"/images/{i:05d}.png" for i in range(n)]
+    return paths, vectors
+
+
+def test_top_k():
+    """Test: top_k returns the highest scores in descending order."""
+    print("\n=== Test: top_k ===")
+
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3], dtype=np.float32)
+    assert list(top_k(scores, 3)) == [1, 3, 2], f"Got {list(top_k(scores, 3))}"
+    assert list(top_k(scores, 10)) == [1, 3, 2, 4, 0], "k larger than n should sort everything"
+    assert len(top_k(scores, 0)) == 0, "k=0 should return nothing"
+
+    print("PASSED: top_k ordering")
+
+
+def test_matches_per_row_cosine():
+    """Test: Vectorized search ranks exactly like the per-row cosine loop."""
+    print("\n=== Test: Matches Per-Row Cosine ===")
+
+    paths, vectors = make_vectors(500)
+    query = np.random.default_rng(1).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    index = SearchIndex.from_vectors(paths, vectors)
+
+    expected = sorted(
+        ((p, cosine_similarity(query, v)) for p, v in zip(paths, vectors)),
+        key=lambda x: x[1], reverse=True,
+    )
+    expected = [(p, s) for p, s in expected[:20] if s > 0]
+    results = index.search(query, 20)
+
+    assert [p for p, _ in results] == [p for p, _ in expected], "Ranking differs from per-row loop"
+    assert np.allclose([s for _, s in results], [s for _, s in expected], atol=1e-5), "Scores differ"
+
+    print("PASSED: Same ranking and scores as per-row cosine")
+
+
+def test_search_batch():
+    """Test: Batched search returns the same results as one search per query."""
+    print("\n=== Test: Batch Search ===")
+
+    paths, vectors = make_vectors(500)
+    vectors[::9] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+    queries = np.random.default_rng(2).standard_normal((6, EMBEDDING_DIM)).astype(np.float32)
+    queries[0] = vectors[1]
+
+    for expected, found in zip([index.search(q, 10) for q in queries], index.search_batch(queries, 10)):
+        assert [p for p, _ in found] == [p for p, _ in expected], "Ranking differs from single search"
+        assert np.allclose([s for _, s in found], [s for _, s in expected], atol=1e-5), "Scores differ"
+    assert index.search_batch(np.empty((0, EMBEDDING_DIM)), 10) == []
+
+    print("PASSED: Batch search matches single searches")
+
+
+def test_search_batcher():
+    """Test: Concurrent requests are coalesced into batches with per-request results."""
+    print("\n=== Test: Search Batcher ===")
+
+    paths, vectors = make_vectors(500)
+    index = SearchIndex.from_vectors(paths, vectors)
+    batch_sizes = []
+
+    def encode(queries):
+        batch_sizes.append(len(queries))
+        return vectors[[int(q) for q in queries]]
+
+    batcher = SearchBatcher(encode, max_batch=8, max_wait_ms=50)
+    futures = {}
+    threads = [
+        threading.Thread(target=lambda i=i: futures.__setitem__(i, batcher.submit(index, str(i), 1 + i % 3)))
+        for i in range(16)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i, future in futures.items():
+        results = future.result(timeout=10)
+        assert len(results) == 1 + i % 3, "Each request should get its own limit"
+        expected = index.search(vectors[i], 1 + i % 3)
+        assert [p for p, _ in results] == [p for p, _ in expected], "Batched results differ"
+    assert max(batch_sizes) <= 8 and len(batch_sizes) < 16, f"Requests were not coalesced: {batch_sizes}"
+
+    failing = SearchBatcher(lambda queries: 1 / 0)
+    try:
+        failing.submit(index, "x", 1).result(timeout=10)
+        assert False, "Encoder errors should reach the caller"
+    except ZeroDivisionError:
+        pass
+
+    assert batcher.call(threading.current_thread).result(timeout=10).name == "search-batcher", "Calls should run on the worker"
+
+    stats = batcher.stats()
+    assert stats["requests"] == 16 and stats["batches"] == len(batch_sizes) and stats["queue_depth"] == 0
+    print(f"PASSED: 16 requests in {len(batch_sizes)} batches")
+
+
+def test_failed_images_excluded():
+    """Test: Zero vectors (failed images) never appear in results."""
+    print("\n=== Test: Failed Images Excluded ===")
+
+    paths, vectors = make_vectors(50)
+    vectors[::2] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+
+    assert index.valid.sum() == 25, f"Expected 25 valid rows, got {index.valid.sum()}"
+    results = index.search(vectors[1], 50)
+    returned = {p for p, _ in results}
+    assert not returned & set(paths[::2]), "Failed images returned"
+    assert results[0][0] == paths[1], "Query vector should match itself first"
+
+    print("PASSED: Failed images excluded")
+
+
+def test_empty_index():
+    """Test: An empty index returns no results."""
+    print("\n=== Test: Empty Index ===")
+
+    index = SearchIndex.from_vectors([], [])
+    assert len(index) == 0
+    assert index.search(np.ones(EMBEDDING_DIM, dtype=np.float32), 5) == []
+
+    print("PASSED: Empty index")
+
+
+def test_snapshot_publish():
+    """Test: Publishing swaps snapshots without affecting readers of the old one."""
+    print("\n=== Test: Snapshot Publish ===")
+
+    publisher = SnapshotPublisher()
+    assert publisher.current is None, "No snapshot before first publish"
+
+    paths, vectors = make_vectors(10)
+    first = publisher.publish(SearchIndex.from_vectors(paths, vectors), db_version=1)
+    held = publisher.current  # an in-flight search holds this reference
+
+    second = publisher.publish(SearchIndex.from_vectors(paths[:5], vectors[:5]), db_version=2)
+    assert (first.version, second.version) == (1, 2), "Versions should increase by one"
+    assert publisher.current is second, "Current should be the latest snapshot"
+    assert held is first and len(held.index) == 10, "Held snapshot must be unchanged"
+    assert not held.index.matrix.flags.writeable, "Index arrays should be read-only"
+
+    publisher.clear()
+    assert publisher.current is None
+
+    print("PASSED: Snapshots swapped atomically")
+
+
+def test_ivf_full_probe_is_exact():
+    """Test: Probing every IVF list gives the same results as exact search."""
+    print("\n=== Test: IVF Full Probe ===")
+
+    paths, vectors = make_vectors(2000)
+    vectors[:10] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.ivf = IVFIndex.build(index.matrix, index.valid, db_version=1, n_lists=16)
+
+    assert len(index.ivf.rows) == 1990, "Failed images should not be indexed"
+    for seed in range(5):
+        query = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+        exact = index.search(query, 10, nprobe=0)
+        approx = index.search(query, 10, nprobe=16)
+        assert [p for p, _ in approx] == [p for p, _ in exact], "Full probe should match exact"
+
+    print("PASSED: Full probe matches exact search")
+
+
+def test_ivf_save_load():
+    """Test: IVF index survives a save/load round trip."""
+    print("\n=== Test: IVF Save/Load ===")
+
+    paths, vectors = make_vectors(500)
+    index = SearchIndex.from_vectors(paths, vectors)
+    ivf = IVFIndex.build(index.matrix, index.valid, db_version=7, n_lists=8)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "embeddings.ivf.npz"
+        ivf.save(path)
+        loaded = IVFIndex.load(path)
+
+    assert loaded.db_version == 7, f"Expected db_version 7, got {loaded.db_version}"
+    assert np.array_equal(loaded.offsets, ivf.offsets) and np.array_equal(loaded.rows, ivf.rows)
+    query = index.matrix[3]
+    assert 3 in loaded.candidates(query, nprobe=1), "Row should be in its own nearest list"
+
+    print("PASSED: IVF index round trip")
+
+
+def test_hnsw_recall():
+    """Test: HNSW finds nearly all exact top-10 results."""
+    print("\n=== Test: HNSW Recall ===")
+
+    paths, vectors = make_vectors(1000)
+    index = SearchIndex.from_vectors(paths, vectors)
+    hnsw = HNSWIndex()
+    for p, v in zip(paths, vectors):
+        hnsw.add(p, v)
+
+    hits = 0
+    for row in range(0, 1000, 50):
+        query = vectors[row] + 0.5 * np.random.default_rng(row).standard_normal(EMBEDDING_DIM)
+        exact = {p for p, _ in index.search(query, 10, nprobe=0)}
+        hits += len(exact & {p for p, _ in hnsw.search(query, 10, ef=200)})
+    assert hits / 200 >= 0.9, f"Recall too low: {hits / 200:.2f}"
+
+    print(f"PASSED: HNSW recall@10 = {hits / 200:.2f}")
+
+
+def test_hnsw_incremental():
+    """Test: HNSW follows inserts and deletes across a save/load round trip."""
+    print("\n=== Test: HNSW Incremental ===")
+
+    paths, vectors = make_vectors(300)
+    hnsw = HNSWIndex()
+    for p, v in zip(paths[:200], vectors[:200]):
+        hnsw.add(p, v)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "embeddings.hnsw"
+        hnsw.save(path)
+
+        # Sync-style update: delete one, modify one, add the rest
+        hnsw = HNSWIndex.load(path)
+        hnsw.remove(paths[0])
+        hnsw.add(paths[1], vectors[250])
+        for p, v in zip(paths[200:], vectors[200:]):
+            hnsw.add(p, v)
+        hnsw.save(path)
+
+        served = HNSWIndex.load(path, mmap=True)
+        assert len(served) == 299, f"Expected 299 live nodes, got {len(served)}"
+        assert paths[0] not in {p for p, _ in served.search(vectors[0], 5)}, "Deleted image returned"
+        assert served.search(vectors[299], 1)[0][0] == paths[299], "New image not found"
+        assert {p for p, _ in served.search(vectors[250], 2)} == {paths[1], paths[250]}, "Modified image not updated"
+
+    print("PASSED: HNSW inserts and tombstones persisted")
+
+
+def test_search_method():
+    """Test: The search method picks the ANN index, and stale HNSW graphs are not loaded."""
+    print("\n=== Test: Search Method ===")
+
+    paths, vectors = make_vectors(1000, seed=4)
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.ivf = IVFIndex.build(index.matrix, index.valid, db_version=1, n_lists=8)
+    index.hnsw = HNSWIndex()
+    for p, v in zip(paths, vectors):
+        index.hnsw.add(p, v)
+    graph_searches = []
+    graph_search = index.hnsw.search
+    index.hnsw.search = lambda *args, **kwargs: graph_searches.append(args) or graph_search(*args, **kwargs)
+
+    query = vectors[7]
+    exact = index.search(query, 10, method="exact")
+    assert not graph_searches
+    assert index.search(query, 10, nprobe=8, method="ivf") == exact and not graph_searches, "IVF must not use the graph"
+    assert index.search_batch(query[None], 10, nprobe=8, method="ivf")[0] == exact and not graph_searches
+    index.search(query, 10)
+    assert len(graph_searches) == 1, "HNSW is the default when attached"
+    index.method = "ivf"
+    assert index.search(query, 10, nprobe=8) == exact and len(graph_searches) == 1
+    assert index.search(query, 10, nprobe=0, method="hnsw") == exact and len(graph_searches) == 1, "nprobe=0 is exact"
+    try:
+        index.search(query, 10, method="lsh")
+        assert False, "Unknown methods should raise"
+    except ValueError:
+        pass
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = str(Path(tmpdir) / "embeddings.lance")
+        vector_column = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), EMBEDDING_DIM)
+        lance.write_dataset(pa.table({"path": paths, "mtime": np.zeros(len(paths)), "vector": vector_column}), db_path)
+        version = lance.dataset(db_path).version
+        graph = HNSWIndex()
+        for p, v in zip(paths[:10], vectors[:10]):
+            graph.add(p, v)
+        graph.db_version = version - 1
+        graph.save(Path(tmpdir) / "embeddings.hnsw")
+        assert load_index(db_path).hnsw is None, "A graph of another DB version must not be used"
+        graph.db_version = version
+        graph.save(Path(tmpdir) / "embeddings.hnsw")
+        loaded = load_index(db_path, method="exact")
+        assert loaded.hnsw is not None and loaded.search(query, 10) == exact
+
+    print("PASSED: Search method selection")
+
+
+def test_quantized_rerank():
+    """Test: Quantized first pass plus exact re-ranking keeps recall and exact scores."""
+    print("\n=== Test: Quantized Re-ranking ===")
+
+    paths, vectors = make_vectors(3000)
+    index = SearchIndex.from_vectors(paths, vectors)
+    fetched = []
+
+    def fetch(rows):
+        fetched.append(len(rows))
+        return index.matrix[rows]
+
+    for storage, min_recall in [("int8", 0.99), ("pq", 0.8)]:
+        quantizer = make_quantizer(storage, index.matrix)
+        quantized = QuantizedVectors(quantizer, quantizer.encode(index.matrix), fetch)
+        qindex = SearchIndex(index.paths, None, index.valid, quantized=quantized)
+        qindex.rerank = 200
+        assert qindex.nbytes < index.nbytes / 4 + 1, f"{storage} codes should be at least 4x smaller"
+
+        hits = 0
+        for seed in range(20):
+            query = np.random.default_rng(seed).standard_normal(EMBEDDING_DIM)
+            exact = dict(index.search(query, 10, nprobe=0))
+            found = dict(qindex.search(query, 10))
+            hits += len(exact.keys() & found.keys())
+            for p in exact.keys() & found.keys():
+                assert abs(exact[p] - found[p]) < 1e-5, "Re-ranked scores should be exact"
+        assert hits / 200 >= min_recall, f"{storage} recall too low: {hits / 200:.2f}"
+        assert max(fetched) == 200, "Only the re-rank shortlist should be fetched"
+        print(f"  {storage}: recall@10 = {hits / 200:.2f}, {index.nbytes // qindex.nbytes}x smaller")
+
+    print("PASSED: Quantized search with exact re-ranking")
+
+
+def test_scalar_quantizer_roundtrip():
+    """Test: int8 codes decode to within one quantization step."""
+    print("\n=== Test: Scalar Quantizer Round Trip ===")
+
+    _, vectors = make_vectors(100)
+    quantizer = ScalarQuantizer.fit(vectors)
+    error = np.abs(quantizer.decode(quantizer.encode(vectors)) - vectors)
+    assert np.all(error <= quantizer.scale / 2 + 1e-5), "Decode error larger than half a step"
+
+    print("PASSED: int8 round trip")
+
+
+def test_binary_prefilter():
+    """Test: Sign codes score by matching bits and re-rank to exact results."""
+    print("\n=== Test: Binary Prefilter ===")
+
+    paths, vectors = make_vectors(3000)
+    index = SearchIndex.from_vectors(paths, vectors)
+    quantizer = make_quantizer("binary", index.matrix)
+    codes = quantizer.encode(index.matrix)
+    assert codes.shape == (3000, EMBEDDING_DIM // 64) and codes.dtype == np.uint64, f"Got {codes.shape} {codes.dtype}"
+
+    matching = np.sum((index.matrix > 0) == (index.matrix[0] > 0), axis=1)
+    assert np.array_equal(quantizer.scores(codes, index.matrix[0]), matching), "Scores should count matching signs"
+
+    quantized = QuantizedVectors(quantizer, codes, lambda rows: index.matrix[rows])
+    qindex = SearchIndex(index.paths, None, index.valid, quantized=quantized)
+    qindex.rerank = 1000
+    hits = 0
+    for row in range(0, 3000, 150):
+        query = vectors[row] + 0.5 * np.random.default_rng(row).standard_normal(EMBEDDING_DIM)
+        exact = {p for p, _ in index.search(query, 10, nprobe=0)}
+        hits += len(exact & {p for p, _ in qindex.search(query, 10)})
+    assert hits / 200 >= 0.9, f"Recall too low: {hits / 200:.2f}"
+    assert qindex.nbytes == 3000 * 64, "Codes should take 64 bytes per image"
+
+    print(f"PASSED: Binary recall@10 = {hits / 200:.2f}")
+
+
+def test_lance_vector_index():
+    """Test: Lance nearest-neighbour search matches the in-memory index."""
+    print("\n=== Test: Lance Vector Index ===")
+
+    paths, vectors = make_vectors(1000)
+    vectors[:5] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = str(Path(tmpdir) / "embeddings.lance")
+        vector_column = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), EMBEDDING_DIM)
+        lance.write_dataset(pa.table({"path": paths, "vector": vector_column}), db_path)
+
+        unindexed = LanceSearchIndex(db_path, lance.dataset(db_path).version)
+        assert not unindexed.indexed and len(unindexed) == 1000
+        query = vectors[7] + 0.5 * np.random.default_rng(7).standard_normal(EMBEDDING_DIM)
+        exact = index.search(query, 10, nprobe=0)
+        found = unindexed.search(query, 10)
+        assert [p for p, _ in found] == [p for p, _ in exact], "Scan without index should be exact"
+        assert np.allclose([s for _, s in found], [s for _, s in exact], atol=1e-4), "Scores should be cosine similarity"
+        assert np.allclose(unindexed.vector(paths[7]), vectors[7]), "Stored vector lookup by path"
+        assert unindexed.vector(paths[0]) is None and unindexed.vector("/missing.png") is None
+
+        create_vector_index(db_path)
+        lindex = LanceSearchIndex(db_path, lance.dataset(db_path).version)
+        assert lindex.indexed and lindex.nbytes == 0
+        hits = 0
+        for row in range(5, 1000, 50):
+            query = vectors[row] + 0.5 * np.random.default_rng(row).standard_normal(EMBEDDING_DIM)
+            exact = {p for p, _ in index.search(query, 10, nprobe=0)}
+            found = lindex.search(query, 10)
+            assert not {p for p, _ in found} & set(paths[:5]), "Failed images returned"
+            hits += len(exact & {p for p, _ in found})
+        assert hits / 200 >= 0.85, f"Recall too low: {hits / 200:.2f}"
+
+    print(f"PASSED: Lance recall@10 = {hits / 200:.2f}")
+
+
+def test_filtered_search():
+    """Test: Filtered searches rank exactly the rows passing the filter."""
+    print("\n=== Test: Filtered Search ===")
+
+    n = 3000
+    rng = np.random.default_rng(14)
+    _, vectors = make_vectors(n, seed=14)
+    vectors[:10] = 0.0
+    dirs = ["/photos/2023/", "/photos/2024/", "/photos/2024-old/", "/scans/"]
+    exts = [".jpg", ".JPG", ".png", ".heic", ""]
+    paths = [f"{dirs[i % 4]}{i:05d}{exts[i % 5]}" for i in range(n)]
+    mtimes = rng.uniform(0, 1000, n)
+
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.metadata = RowMetadata.from_table(pa.table({"path": paths, "mtime": mtimes}))
+
+    filters = SearchFilter.from_params("/photos/2024", [".jpg", "PNG"], modified_after=100, modified_before=900.0)
+    assert filters.path_prefix == "/photos/2024/" and filters.extensions == {".jpg", ".png"}
+    assert SearchFilter.from_params(extensions=[]) is None, "Empty parameters should mean no filter"
+    assert SearchFilter.from_params(modified_after="1970-01-02T00:00:00+00:00").modified_after == 86400
+
+    def passes(i):
+        return (
+            paths[i].startswith("/photos/2024/")
+            and Path(paths[i]).suffix.lower() in (".jpg", ".png")
+            and 100 <= mtimes[i] < 900
+        )
+
+    expected_rows = [i for i in range(n) if passes(i)]
+    assert index.metadata.rows(filters).tolist() == expected_rows, "Metadata rows differ from brute force"
+    assert index.metadata.rows(SearchFilter(modified_before=500)).tolist() == np.flatnonzero(mtimes < 500).tolist()
+    assert [index.metadata.row(p) for p in paths[:50]] == list(range(50)) and index.metadata.row("/nowhere.jpg") is None
+    assert index.metadata.rows_of(paths[:3] + ["/nowhere.jpg"]).tolist() == [0, 1, 2, -1]
+
+    query = vectors[100] + 0.5 * rng.standard_normal(EMBEDDING_DIM)
+    unfiltered = index.search(query, n, nprobe=0)
+    expected = [(p, s) for p, s in unfiltered if passes(paths.index(p))][:20]
+    results = index.search(query, 20, filters=filters)
+    assert [p for p, _ in results] == [p for p, _ in expected], "Filtered ranking differs from post-filtering"
+    assert [p for p, _ in index.search_batch(query[None], 20, filters=filters)[0]] == [p for p, _ in expected]
+    dense = SearchFilter(modified_before=900)  # most rows pass: scored by masking a full pass
+    expected_dense = [p for p, _ in unfiltered if mtimes[paths.index(p)] < 900][:20]
+    assert [p for p, _ in index.search(query, 20, filters=dense)] == expected_dense
+    assert [p for p, _ in index.search_batch(query[None], 20, filters=dense)[0]] == expected_dense
+
+    allowed = {paths[i] for i in expected_rows}
+    index.ivf = IVFIndex.build(index.matrix, index.valid, db_version=1, n_lists=16)
+    assert {p for p, _ in index.search(query, 20, nprobe=2, filters=filters)} <= allowed, "IVF returned filtered-out rows"
+    assert [p for p, _ in index.search(query, 20, nprobe=16, filters=filters)] == [p for p, _ in expected]
+    assert index.search(query, 20, filters=SearchFilter(path_prefix="/nowhere/")) == []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = str(Path(tmpdir) / "embeddings.lance")
+        vector_column = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), EMBEDDING_DIM)
+        lance.write_dataset(pa.table({"path": paths, "mtime": mtimes, "vector": vector_column}), db_path)
+
+        loaded = load_index(db_path)
+        assert loaded.metadata is not None and len(loaded.metadata) == n, "Metadata should be read at load"
+        assert [p for p, _ in loaded.search(query, 20, filters=filters)] == [p for p, _ in expected], "load_index should attach metadata"
+        found = LanceSearchIndex(db_path, lance.dataset(db_path).version).search(query, 20, filters=filters)
+        assert [p for p, _ in found] == [p for p, _ in expected], "Lance SQL filter differs"
+
+    print(f"PASSED: Filtered search ({len(expected_rows)} of {n} rows pass)")
+
+
+def test_find_similar():
+    """Test: Indexed images reuse their stored vector; other files are embedded."""
+    print("\n=== Test: Find Similar ===")
+
+    paths, vectors = make_vectors(1000, seed=15)
+    vectors[3] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.metadata = RowMetadata.from_table(pa.table({"path": paths, "mtime": np.zeros(len(paths))}))
+    embedded = []
+
+    def embed(path):
+        embedded.append(path)
+        return vectors[0]
+
+    results = find_similar(index, paths[10], 5, embed)
+    expected = index.search(vectors[10], 6)
+    assert not embedded, "Indexed image should not be embedded"
+    assert [p for p, _ in results] == [p for p, _ in expected if p != paths[10]][:5], "Image itself should be excluded"
+    assert np.allclose(index.vector(paths[10]), index.matrix[10])
+
+    results = find_similar(index, "/elsewhere/new.png", 5, embed)
+    assert embedded == ["/elsewhere/new.png"], "Unindexed image should be embedded once"
+    assert [p for p, _ in results] == [p for p, _ in index.search(vectors[0], 5)]
+
+    assert index.vector(paths[3]) is None, "Failed images have no stored vector"
+
+    print("PASSED: Find similar")
+
+
+def test_near_duplicates():
+    """Test: Tiled all-pairs search finds every near-duplicate pair and groups them."""
+    print("\n=== Test: Near Duplicates ===")
+
+    rng = np.random.default_rng(16)
+    paths, vectors = make_vectors(700, seed=16)
+    for src, dst in [(0, 1), (1, 2), (10, 650), (300, 301), (302, 303)]:  # 0-1-2 chain across tiles
+        vectors[dst] = vectors[src] + 0.05 * rng.standard_normal(EMBEDDING_DIM)
+    vectors[303] = 0.0  # failed image
+    index = SearchIndex.from_vectors(paths, vectors)
+
+    scores = index.matrix @ index.matrix.T
+    a, b = np.nonzero(np.triu(scores >= 0.95, k=1))
+    keep = index.valid[a] & index.valid[b]
+    expected = set(zip(a[keep].tolist(), b[keep].tolist()))
+    for matrix in (index.matrix, index.matrix.astype(np.float16)):
+        found = near_duplicate_pairs(matrix, index.valid, 0.95, tile=128, workers=4)
+        assert set(zip(found[0].tolist(), found[1].tolist())) == expected, "Tiled pairs differ from brute force"
+
+    groups = duplicate_groups(len(index), near_duplicate_pairs(index.matrix, index.valid, 0.95, tile=128))
+    assert groups == [[0, 1, 2], [10, 650], [300, 301]], f"Got {groups}"
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_path = str(Path(tmpdir) / "embeddings.lance")
+        vector_column = pa.FixedSizeListArray.from_arrays(pa.array(vectors.reshape(-1)), EMBEDDING_DIM)
+        lance.write_dataset(pa.table({"path": paths, "mtime": np.zeros(700), "vector": vector_column}), db_path)
+        assert DuplicateGroups.load(db_path) is None
+        find_duplicates(db_path, 0.95, tile=128, log_fn=lambda msg: None)
+        duplicates = DuplicateGroups.load(db_path)
+        assert len(duplicates) == 7 and duplicates.threshold == 0.95
+
+        loaded = load_index(db_path)
+        results = find_similar(loaded, paths[5], 20, None)
+        collapsed = find_similar(loaded, paths[5], 20, None, duplicates=duplicates)
+        assert [p for p, _ in collapsed] == [p for p, _ in duplicates.collapse(find_similar(loaded, paths[5], 40, None))][:20]
+        assert len(collapsed) == 20 and len({duplicates.groups.get(p, p) for p, _ in collapsed}) == 20
+
+    # Deeper searches fill the page when collapsing removes results
+    ranking = [(f"/a{i}", 1 - i / 100) for i in range(10)] + [(f"/b{i}", 0.5 - i / 100) for i in range(10)]
+    groups = DuplicateGroups({f"/a{i}": 0 for i in range(10)})
+    depths = []
+
+    def search(depth):
+        depths.append(depth)
+        return ranking[:depth]
+
+    assert [p for p, _ in collapsed_search(search, 5, groups)] == ["/a0", "/b0", "/b1", "/b2", "/b3"]
+    assert depths == [5, 10, 20], f"Got {depths}"
+    assert len(collapsed_search(lambda depth: ranking[:depth], 50, groups)) == 11, "Exhausted ranking ends the search"
+    assert groups.collapse(results) == results, "Ungrouped results are kept"
+
+    print(f"PASSED: Near duplicates ({len(expected)} pairs, {len(groups.groups)} grouped)")
+
+
+def test_composite_query():
+    """Test: Weighted phrases score like the weighted sum of their similarities, in one encoder pass."""
+    print("\n=== Test: Composite Query ===")
+
+    assert CompositeQuery.from_params("a dog") == "a dog", "Plain queries stay strings"
+    query = CompositeQuery.from_params("Dog on  beach", {"people": -0.5, "dog on beach": 0.5, "sand": 0})
+    assert query.terms == (("dog on beach", 1.5), ("people", -0.5)), f"Got {query.terms}"
+    assert query == CompositeQuery.from_params("people", {"dog on beach": 1.5, "PEOPLE": -1.5})
+    assert query.text == "dog on beach"
+    for bad in [{"": 1.0, "people": -2.0}, {str(i): 1.0 for i in range(17)}]:
+        try:
+            CompositeQuery.from_params("", bad)
+            assert False, f"Should reject {bad}"
+        except ValueError:
+            pass
+
+    paths, vectors = make_vectors(800, seed=20)
+    index = SearchIndex.from_vectors(paths, vectors)
+    phrases = {"dog on beach": 0, "people": 1, "sunset": 2}
+    query = CompositeQuery.from_params("dog on beach", {"sunset": 0.5, "people": -1.0})
+    encoded = []
+
+    def encode(texts):
+        encoded.append(list(texts))
+        return index.matrix[[phrases.get(t, 3) for t in texts]]
+
+    vector = embed_query(encode, query)
+    assert encoded == [["dog on beach", "people", "sunset"]], "All phrases in one encoder call"
+    similarities = index.matrix @ index.matrix[:3].T
+    expected = similarities @ np.array([1.0, -1.0, 0.5])
+    results = index.search(vector, 20)
+    for path, score in results:
+        assert abs(score * np.linalg.norm(vector) - expected[paths.index(path)]) < 1e-5, "Score should be the weighted similarity sum"
+    assert [p for p, _ in results] == [paths[i] for i in np.argsort(-expected)[:20]]
+
+    # Cursors and cached rankings treat equal composite queries alike
+    restored = decode_cursor(encode_cursor(query, None, 3, 10))[0]
+    assert restored == query and ResultPages.key(restored, None, 3) == ResultPages.key(query, None, 3)
+
+    # The batcher encodes the phrases of all queued requests together
+    encoded.clear()
+    batcher = SearchBatcher(encode, max_batch=8, max_wait_ms=200)
+    futures = [batcher.submit(index, query, 5), batcher.submit(index, "a cat", 5)]
+    assert [p for p, _ in futures[0].result(timeout=10)] == [p for p, _ in results[:5]]
+    assert [p for p, _ in futures[1].result(timeout=10)] == [p for p, _ in index.search(vectors[3], 5)]
+    assert encoded == [["dog on beach", "people", "sunset", "a cat"]], f"Got {encoded}"
+
+    print("PASSED: Composite query")
+
+
+def test_streamed_search():
+    """Test: Chunked selection yields the same ranking as a full search, best chunk first."""
+    print("\n=== Test: Streamed Search ===")
+
+    scores = np.random.default_rng(21).standard_normal(10_000)
+    chunks = list(top_k_chunks(scores, 500, first=16))
+    assert [len(c) for c in chunks] == [16, 32, 64, 128, 256, 4], f"Got {[len(c) for c in chunks]}"
+    assert np.array_equal(np.concatenate(chunks), top_k(scores, 500))
+    assert list(top_k_chunks(scores, 0)) == [] and np.array_equal(np.concatenate(list(top_k_chunks(scores[:5], 10))), top_k(scores[:5], 5))
+
+    paths, vectors = make_vectors(3000, seed=22)
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.metadata = RowMetadata.from_table(pa.table({"path": paths, "mtime": np.arange(len(paths), dtype=np.float64)}))
+    query = vectors[0] + vectors[1]
+    for filters in [None, SearchFilter(modified_after=2000.0), SearchFilter(modified_before=100.0)]:
+        streamed = [m for chunk in index.search_chunks(query, 1000, filters=filters, first=8) for m in chunk]
+        assert streamed == index.search(query, 1000, filters=filters), f"Chunks differ from search ({filters})"
+
+    # Duplicates collapse across chunks, and the tail is filled from a deeper search
+    duplicates = DuplicateGroups({path: i % 50 for i, path in enumerate(paths[:2000])})
+    expected = collapsed_search(lambda d: index.search(query, d), 300, duplicates)
+    streamed = list(stream_search(index, None, "", query, 300, duplicates=duplicates))
+    assert [m for chunk in streamed for m in chunk] == expected
+    assert len(streamed[0]) <= 16 and len(expected) == 300
+
+    # Queries matching paths are fused before streaming
+    lexical = LexicalIndex.build(paths)
+    query = query + vectors[42]
+    fused = [m for chunk in stream_search(index, lexical, "00042", query, 40) for m in chunk]
+    assert fused == hybrid_search(index, lexical, "00042", query, 40) and fused[0][0] == paths[42]
+
+    print(f"PASSED: Streamed search ({len(chunks)} chunks)")
+
+
+def test_hybrid_search():
+    """Test: Path tokens are indexed incrementally and fused with vector results."""
+    print("\n=== Test: Hybrid Search ===")
+
+    assert tokenize("/Photos/Invoice_scan-2023/IMG_0042.JPG") == ["photos", "invoice", "scan", "2023", "img", "0042", "jpg"]
+    assert tokenize("a scan of the invoice p3") == ["scan", "invoice", "3"], "Stopwords and single letters are dropped"
+
+    paths, vectors = make_vectors(400, seed=19)
+    for i in range(0, 40, 5):
+        paths[i] = f"/docs/invoices/2023/scan_{i}.png"
+    paths[41] = "/docs/invoices/2022/scan_41.png"
+    lexical = LexicalIndex.build(paths)
+    assert all(score < 1.0 for _, score in lexical.search("invoice 2023")), "Tokens match whole words only"
+    matches = lexical.search("invoices 2023")
+    assert {p for p, s in matches if s == 1.0} == {paths[i] for i in range(0, 40, 5)}
+    assert dict(matches)[paths[41]] < 1.0, "Partial matches score lower"
+
+    # Incremental updates match a fresh build, and survive a save/load
+    updated = lexical.updated(["/docs/invoices/2023/new.png", paths[0]], [paths[5], paths[41]])
+    live = [p for p in paths if p not in (paths[5], paths[41])] + ["/docs/invoices/2023/new.png"]
+    assert len(updated) == len(live) and abs(updated.tombstone_ratio - 2 / 401) < 1e-12
+    assert updated.search("invoices 2023") == LexicalIndex.build(live).search("invoices 2023")
+    assert updated.compacted().search("invoices") == updated.search("invoices")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "embeddings.lexical.npz"
+        updated.save(path)
+        assert LexicalIndex.load(path).search("scan 2023") == updated.search("scan 2023")
+
+    # Tokens most paths share are ignored
+    assert lexical.search("images invoices") == lexical.search("invoices")
+    assert lexical.search("images png") == [], "Only common tokens: no lexical matches"
+
+    # Each path takes its own rank in both lists; ranking first in both scores 1.0
+    fused = fuse([("/a", 0.9), ("/b", 0.8), ("/c", 0.7)], [("/b", 1.0), ("/c", 1.0), ("/d", 0.5)], 4)
+    assert [p for p, _ in fused] == ["/b", "/c", "/a", "/d"], f"Got {fused}"
+    assert fuse([("/a", 0.9)], [("/a", 1.0)], 1) == [("/a", 1.0)]
+
+    index = SearchIndex.from_vectors(paths, vectors)
+    index.metadata = RowMetadata.from_table(pa.table({"path": paths, "mtime": np.zeros(len(paths))}))
+    query = vectors[0] + vectors[10] + vectors[200]
+    searched_rows = []
+    search = index.search
+
+    def recording_search(*args, **kwargs):
+        searched_rows.append(kwargs.get("rows"))
+        return search(*args, **kwargs)
+
+    index.search = recording_search
+    vector_only = search(query, 5)
+    assert hybrid_search(index, None, "invoices 2023", query, 5) == vector_only
+    assert hybrid_search(index, lexical, "sunset", query, 5) == vector_only, "No lexical match is a plain vector search"
+
+    # Enough full matches: only the lexical candidates are scored
+    searched_rows.clear()
+    results = hybrid_search(index, lexical, "invoices 2023", query, 3)
+    assert len(searched_rows) == 1 and searched_rows[0] is not None, "Full vector search should be skipped"
+    assert all("/2023/" in p for p, _ in results) and results[0][0] in (paths[0], paths[10])
+    cosines = dict(search(query, len(paths)))
+    assert all(abs(score - cosines[p]) < 1e-6 for p, score in results), "Hybrid results keep their cosine scores"
+    full_matches = {p for p, _ in search(query, len(paths))} & {paths[i] for i in range(0, 40, 5)}
+    assert {p for p, _ in hybrid_search(index, lexical, "invoices 2023", query, 20)} >= full_matches
+
+    # Too few full matches: fused with the full vector ranking
+    searched_rows.clear()
+    results = hybrid_search(index, lexical, "invoices 2022", query, 5)
+    assert len(searched_rows) == 2 and searched_rows[1] is None
+    assert results[0][0] in (paths[0], paths[10]), "Paths ranked by both lists come first"
+    assert paths[200] in dict(results), "Lexical matches beyond `limit` must not push out vector hits"
+    assert all(abs(score - cosines[p]) < 1e-6 for p, score in results)
+    precomputed = hybrid_search(index, lexical, "invoices 2022", query, 5, vector_results=search(query, 5))
+    assert precomputed == results and len(searched_rows) == 3, "A given vector ranking replaces the full search"
+
+    filters = SearchFilter.from_params("/images")
+    results = hybrid_search(index, lexical, "invoices 2023", query, 10, filters=filters)
+    assert results and all(p.startswith("/images/") for p, _ in results), "Filters apply to lexical matches"
+
+    # Batched hybrid searches share one scoring pass, then fuse their own lexical matches
+    batched = []
+    search_batch = index.search_batch
+    index.search_batch = lambda queries, *args, **kwargs: batched.append(len(queries)) or search_batch(queries, *args, **kwargs)
+    batcher = SearchBatcher(lambda texts: np.stack([query] * len(texts)), max_batch=8, max_wait_ms=200)
+    futures = [batcher.submit(index, text, 5, lexical=lexical) for text in ("invoices 2022", "sunset")]
+    for future, text in zip(futures, ("invoices 2022", "sunset")):
+        expected = hybrid_search(index, lexical, text, query, 5)
+        assert [p for p, _ in future.result(timeout=10)] == [p for p, _ in expected], f"Batched {text!r} differs"
+    assert batched == [2], f"Got scoring passes {batched}"
+
+    print(f"PASSED: Hybrid search ({len(lexical.tokens)} tokens)")
+
+
+def test_sidecar_mmap():
+    """Test: A memory-mapped sidecar searches like the in-memory index."""
+    print("\n=== Test: Vector Sidecar ===")
+
+    paths, vectors = make_vectors(500)
+    paths[3] = "/images/ünïcode.png"
+    vectors[::7] = 0.0
+    index = SearchIndex.from_vectors(paths, vectors)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "embeddings.vectors"
+        write_sidecar(path, paths, index.matrix, index.valid, db_version=4)
+        db_version, _, matrix, _ = read_sidecar(path)
+        assert db_version == 4 and isinstance(matrix, np.memmap), "Vectors should be memory-mapped"
+        assert matrix.ctypes.data % 64 == 0, "Vectors should be aligned"
+
+        mapped = SearchIndex.from_sidecar(path)
+        assert list(mapped.paths) == paths, "Paths differ"
+        for row in [1, 3, 100]:
+            assert mapped.search(vectors[row], 10) == index.search(vectors[row], 10), "Results differ"
+
+        write_sidecar(path, paths, index.matrix, index.valid, db_version=5, dtype="float16")
+        half = SearchIndex.from_sidecar(path)
+        assert half.matrix.dtype == np.float16
+        assert stored_dtype(path) == "float16", "Syncs keep the precision read from the header"
+        assert [p for p, _ in half.search(vectors[1], 5)] == [p for p, _ in index.search(vectors[1], 5)]
+
+        write_sidecar(path, [], np.empty((0, EMBEDDING_DIM)), np.empty(0, dtype=bool), db_version=6)
+        assert SearchIndex.from_sidecar(path).search(vectors[1], 5) == [], "Empty sidecar should return nothing"
+
+    print("PASSED: Sidecar round trip")
+
+
+def test_text_cache():
+    """Test: Repeat queries skip the encoder, in memory and across restarts."""
+    print("\n=== Test: Text Embedding Cache ===")
+
+    calls = []
+
+    def encode(text):
+        calls.append(text)
+        return np.random.default_rng(len(text)).standard_normal(EMBEDDING_DIM).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = Path(tmpdir) / "embeddings.textcache.sqlite"
+        cache = TextEmbeddingCache("model-a", path, max_entries=2)
+        first = cache.get("a red  car", encode)
+        assert np.array_equal(cache.get("A Red Car ", encode), first), "Normalized queries should share an entry"
+        cache.get("a dog", encode)
+        cache.get("a cat", encode)  # evicts "a red car" from memory
+        assert len(cache) == 2 and len(calls) == 3
+        assert np.array_equal(cache.get("a red car", encode), first), "Evicted entry should come from disk"
+        assert cache.stats() == {"hits": 1, "disk_hits": 1, "misses": 3, "hit_rate": 0.4, "entries": 2}
+
+        restarted = TextEmbeddingCache("model-a", path)
+        assert np.array_equal(restarted.get("a dog", encode), encode("a dog")) and len(calls) == 4
+        assert restarted.stats()["disk_hits"] == 1, "Entries should survive a restart"
+
+        other_model = TextEmbeddingCache("model-b", path)
+        other_model.get("a dog", encode)
+        assert other_model.stats()["misses"] == 1, "Another model must not reuse embeddings"
+
+    print("PASSED: Text embedding cache")
+
+
+def test_cursor_pagination():
+    """Test: Pages follow the full ranking and reuse the cached search."""
+    print("\n=== Test: Cursor Pagination ===")
+
+    paths, vectors = make_vectors(1000, seed=17)
+    index = SearchIndex.from_vectors(paths, vectors)
+    query = np.random.default_rng(18).standard_normal(EMBEDDING_DIM).astype(np.float32)
+    expected = index.search(query, len(paths))
+
+    depths = []
+
+    def search(depth):
+        depths.append(depth)
+        return index.search(query, depth)
+
+    assert decode_cursor(encode_cursor("a dog", 4, 7, 30)) == ("a dog", 4, 7, 30, None)
+    filters = SearchFilter.from_params("/photos", ["JPG"])
+    assert decode_cursor(encode_cursor("a dog", None, 7, 30, filters))[4] == filters, "Cursor should carry filters"
+    try:
+        decode_cursor("not a cursor")
+        assert False, "Malformed cursor should be rejected"
+    except CursorError:
+        pass
+
+    pages = ResultPages(max_entries=2)
+    collected = []
+    cursor = "start"
+    offset = 0
+    while cursor:
+        page, cursor = pages.page(search, "a dog", None, 1, offset, 40)
+        collected.extend(page)
+        if cursor:
+            offset = decode_cursor(cursor)[3]
+    assert [p for p, _ in collected] == [p for p, _ in expected], "Pages should concatenate to the full ranking"
+    assert depths == [160, 800], f"Only pages past the cached ranking should search again, got {depths}"
+
+    # Normalized queries share a ranking; other versions and evicted keys do not
+    pages.page(search, " A  Dog", None, 1, 0, 10)
+    assert len(depths) == 2
+    pages.page(search, "a dog", None, 2, 0, 10)
+    pages.page(search, "a cat", None, 2, 0, 10)
+    assert len(pages) == 2 and len(depths) == 4
+    pages.page(search, "a dog", None, 1, 0, 10)
+    assert len(depths) == 5, "Least recently used ranking should be evicted"
+
+    pages.clear()
+    assert len(pages) == 0
+
+    print("PASSED: Cursor pagination")
+
+
+def main():
+    tests = [
+        test_top_k,
+        test_matches_per_row_cosine,
+        test_search_batch,
+        test_search_batcher,
+        test_failed_images_excluded,
+        test_empty_index,
+        test_snapshot_publish,
+        test_ivf_full_probe_is_exact,
+        test_ivf_save_load,
+        test_hnsw_recall,
+        test_hnsw_incremental,
+        test_search_method,
+        test_quantized_rerank,
+        test_scalar_quantizer_roundtrip,
+        test_binary_prefilter,
+        test_lance_vector_index,
+        test_filtered_search,
+        test_find_similar,
+        test_near_duplicates,
+        test_hybrid_search,
+        test_composite_query,
+        test_streamed_search,
+        test_sidecar_mmap,
+        test_text_cache,
+        test_cursor_pagination,
+    ]
+
+    passed = 0
+    failed = 0
+
+    for test in tests:
+        try:
+            test()
+            passed += 1
+        except AssertionError as e:
+            print(f"FAILED: {e}")
+            failed += 1
+        except Exception as e:
+            print(f"ERROR: {e}")
+            failed += 1
+
+    print(f"\n{'='*40}")
+    print(f"Results: {passed} passed, {failed} failed")
+
+    return failed == 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(0 if main() else 1)
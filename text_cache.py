@@ -0,0 +1,182 @@
+"""Two-level cache for text query embeddings.
+
+Agents repeat and rephrase the same queries, and each miss runs the full
+text transformer. Embeddings are kept in a bounded in-memory LRU, backed by
+a small SQLite store next to the Lance DB so repeat queries skip the encoder
+across restarts too. Entries are keyed on the normalized query text plus a
+model identity, so converting a different model never returns stale vectors.
+"""
+
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+from core import DB_PATH, EMBEDDING_DIM, MODEL_PATH
+
+# Embeddings kept in memory (2 KB each)
+MEMORY_ENTRIES = 1024
+
+# Embeddings kept on disk; the oldest are dropped beyond this
+DISK_ENTRIES = 100_000
+
+
+def text_cache_path(db_path: str = DB_PATH) -> Path:
+    """Location of the on-disk text embedding cache next to a Lance DB."""
+    return Path(db_path).with_suffix(".textcache.sqlite")
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query: lowercased with whitespace collapsed.
+
+    The CLIP tokenizer does the same, so queries with equal keys have equal
+    embeddings.
+    """
+    return " ".join(text.lower().split())
+
+
+def model_identity(model_dir: str = MODEL_PATH) -> str:
+    """Short hash identifying a converted model (its config and weight files)."""
+    digest = hashlib.sha256()
+    for path in sorted(Path(model_dir).glob("*")):
+        if path.suffix in (".json", ".txt"):
+            digest.update(path.read_bytes())
+        elif path.is_file():
+            stat = path.stat()
+            digest.update(f"{path.name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()[:16]
+
+
+class TextEmbeddingCache:
+    """Bounded LRU of query embeddings backed by an optional SQLite store.
+
+    Safe to share between threads. Counters distinguish memory hits, disk
+    hits (which are promoted into memory) and misses (which run `compute`).
+    """
+
+    def __init__(self, model_id: str, path: Path | None = None, max_entries: int = MEMORY_ENTRIES, max_disk_entries: int = DISK_ENTRIES):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(str(path), check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS text_embeddings "
+                "(model TEXT, query TEXT, vector BLOB, PRIMARY KEY (model, query))"
+            )
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, text: str, compute: Callable[[str], np.ndarray]) -> np.ndarray:
+        """Return the embedding for `text`, calling compute(text) on a miss."""
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+            vector = self._load(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+
+        # Encode outside the lock so other queries are not held up
+        vector = np.asarray(compute(text), dtype=np.float32)
+        vector.flags.writeable = False
+        with self._lock:
+            self.misses += 1
+            self._remember(key, vector)
+            self._store(key, vector)
+        return vector
+
+    def get_batch(self, texts: list[str], compute: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """Return (len(texts), 512) embeddings, encoding all misses with one compute(texts) call."""
+        keys = [normalize_query(t) for t in texts]
+        found: dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                if key in found:
+                    continue
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                elif (vector := self._load(key)) is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                if vector is not None:
+                    found[key] = vector
+
+        missing = {}
+        for text, key in zip(texts, keys):
+            if key not in found:
+                missing.setdefault(key, text)
+        if missing:
+            vectors = np.asarray(compute(list(missing.values())), dtype=np.float32)
+            with self._lock:
+                for key, vector in zip(missing, vectors):
+                    vector.flags.writeable = False
+                    self.misses += 1
+                    self._remember(key, vector)
+                    self._store(key, vector)
+                    found[key] = vector
+
+        out = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+        for i, key in enumerate(keys):
+            out[i] = found[key]
+        return out
+
+    def stats(self) -> dict:
+        """Hit/miss counters for status endpoints."""
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> np.ndarray | None:
+        if self._db is None:
+            return None
+        row = self._db.execute(
+            "SELECT vector FROM text_embeddings WHERE model = ? AND query = ?", (self.model_id, key)
+        ).fetchone()
+        if row is None or len(row[0]) != EMBEDDING_DIM * 4:
+            return None
+        return np.frombuffer(row[0], dtype=np.float32)
+
+    def _store(self, key: str, vector: np.ndarray):
+        if self._db is None:
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO text_embeddings (model, query, vector) VALUES (?, ?, ?)",
+            (self.model_id, key, vector.tobytes()),
+        )
+        # Drop the oldest rows once the store outgrows its bound
+        self._db.execute(
+            "DELETE FROM text_embeddings WHERE rowid <= (SELECT MAX(rowid) FROM text_embeddings) - ?",
+            (self.max_disk_entries,),
+        )
+        self._db.commit()